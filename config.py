@@ -17,6 +17,21 @@ REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = cast(int,os.getenv("REDIS_PORT"))
 REDIS_DB = cast(int,os.getenv("REDIS_DB"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+# TTL (сек) кэша ролей пользователей в комнатах (в памяти процесса)
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", "5"))
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+# Webhook: публичный адрес (https://bot.example.com), путь и секрет для Telegram
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Адрес, на котором слушает встроенный aiohttp-сервер
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Воркеры обработки апдейтов и размер очереди (при переполнении — 503, Telegram повторит)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
 redis = Redis(
     host=REDIS_HOST,
     port=REDIS_PORT,
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Сливает одинаковые файлы аудиокэша.
+
+До перехода на хранилище по id видео каждый запрос сохранялся в свой
+файл (md5 запроса), поэтому одно видео могло лежать в кэше несколько раз.
+Скрипт находит файлы с одинаковым содержимым (по размерам из индекса
+кэша, затем sha256), оставляет один, а остальные хеши делает алиасами
+(audio_cache:aliases): треки комнат, модерация и треки пользователей
+со старыми хешами продолжают работать. Ссылки плейлистов переносятся
+на оставшийся файл.
+
+Индекс аудиокэша должен быть построен (rebuild_audio_cache_index.py).
+Перед запуском остановите бота.
+
+Использование:
+    python dedup_audio_cache.py [--dry-run]
+"""
+import asyncio
+import hashlib
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import redis
+from utils.audio_cache import path_for, get_audio_cache
+
+
+def file_digest(path: Path) -> str:
+    """sha256 содержимого файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def main():
+    dry_run = "--dry-run" in sys.argv[1:]
+    audio_cache = get_audio_cache()
+    repo = audio_cache.repo
+
+    # Кандидаты — только файлы одинакового размера (группы из индекса кэша)
+    by_size = await asyncio.to_thread(audio_cache.index.same_size_groups)
+
+    merged = 0
+    freed = 0
+    for size, hashes in by_size.items():
+        by_digest = defaultdict(list)
+        for file_hash in hashes:
+            path = path_for(file_hash)
+            if path.exists():
+                by_digest[await asyncio.to_thread(file_digest, path)].append(file_hash)
+
+        for duplicates in by_digest.values():
+            if len(duplicates) < 2:
+                continue
+            # Оставляем файл, на который больше всего ссылок из плейлистов
+            refs = await repo.get_refs(duplicates)
+            canonical = max(zip(duplicates, refs), key=lambda x: x[1])[0]
+            for file_hash in duplicates:
+                if file_hash == canonical:
+                    continue
+                print(f"   🔗 {file_hash} -> {canonical} ({size / 1024 / 1024:.1f} MB)")
+                if not dry_run:
+                    await repo.set_alias(file_hash, canonical)
+                    await audio_cache.remove(file_hash)
+                merged += 1
+                freed += size
+
+    action = "Будет слито" if dry_run else "Слито"
+    print(f"\n✅ {action} дубликатов: {merged}, освобождено {freed / 1024 / 1024:.1f} MB.")
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
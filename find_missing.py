@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from config import redis
 from utils.redis_helper import redis_safe
+from repositories.moderation_repository import ModerationRepository
 
 async def main():
     print("🔍 Поиск потерянных треков...\n")
@@ -46,10 +47,9 @@ async def main():
             
             if track.get("status") == "pending":
                 # Проверяем очередь
-                queue_raw = await redis_safe(redis.lrange(f"room:{room_id}:moderation_queue", 0, -1))
-                queue_tokens = [t.decode() if isinstance(t, bytes) else str(t) for t in (queue_raw or [])]
+                queued = await redis_safe(redis.zscore(f"room:{room_id}:moderation_queue", token)) is not None
                 
-                if token not in queue_tokens:
+                if not queued:
                     # Проверяем данные
                     mod_key = f"moderation_queue:{room_id}:{token}"
                     mod_data = await redis_safe(redis.get(mod_key))
@@ -76,6 +76,7 @@ async def main():
             print(f"   Token: {m['token']}\n")
         
         print("🔄 Восстанавливаю...\n")
+        moderation_repo = ModerationRepository()
         for m in missing:
             mod_track = {
                 "title": m["track"].get("title"),
@@ -88,11 +89,8 @@ async def main():
                 "added_at": m["track"].get("added_at")
             }
             
-            mod_key = f"moderation_queue:{m['room_id']}:{m['token']}"
-            await redis_safe(redis.set(mod_key, json.dumps(mod_track), ex=86400))
-            
-            queue_key = f"room:{m['room_id']}:moderation_queue"
-            await redis_safe(redis.rpush(queue_key, m["token"]))
+            # Данные трека и место в очереди (ZSET по времени добавления)
+            await moderation_repo.add_to_moderation_queue(m["room_id"], m["token"], mod_track)
             
             print(f"✅ {m['title'][:50]}")
         
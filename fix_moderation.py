@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from config import redis
 from utils.redis_helper import redis_safe
+from repositories.moderation_repository import ModerationRepository
 
 async def restore_all():
     print("🔍 Поиск всех треков со статусом pending...")
@@ -57,6 +58,7 @@ async def restore_all():
     print(f"\n📊 Найдено комнат с pending треками: {len(pending_by_room)}")
     
     total_restored = 0
+    moderation_repo = ModerationRepository()
     
     # Восстанавливаем треки по комнатам
     for room_id, tracks in pending_by_room.items():
@@ -68,7 +70,7 @@ async def restore_all():
         
         # Получаем текущую очередь
         queue_key = f"room:{room_id}:moderation_queue"
-        queue_tokens_raw = await redis_safe(redis.lrange(queue_key, 0, -1))
+        queue_tokens_raw = await redis_safe(redis.zrange(queue_key, 0, -1))
         queue_tokens = [t.decode() if isinstance(t, bytes) else str(t) for t in (queue_tokens_raw or [])]
         
         restored = 0
@@ -96,13 +98,9 @@ async def restore_all():
                 "added_at": track_data.get("added_at")
             }
             
-            # Сохраняем данные трека
-            mod_key = f"moderation_queue:{room_id}:{token}"
-            await redis_safe(redis.set(mod_key, json.dumps(moderation_track), ex=86400))
-            
-            # Добавляем в очередь
+            # Сохраняем данные трека и добавляем в очередь (ZADD NX — без дубликатов)
+            await moderation_repo.add_to_moderation_queue(room_id, token, moderation_track)
             if token not in queue_tokens:
-                await redis_safe(redis.rpush(queue_key, token))
                 restored += 1
                 total_restored += 1
                 print(f"   ✅ Восстановлен: {track_data.get('title', 'Неизвестно')[:50]}")
@@ -3,6 +3,7 @@ Handlers для управления комнатой: настройки, ад
 Рефакторинг с использованием Repository и Service слоев
 """
 import json
+from typing import Any, Dict
 from pathlib import Path
 from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
@@ -11,13 +12,14 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from config import redis, bot as bot_instance
 from utils.redis_helper import redis_safe
 from handlers.rooms import open_room
-from utils.youtube import CACHE_DIR
+from utils.audio_cache import get_audio_cache
 from utils.timezone import iso_now, now_tyumen, format_datetime
 from types import SimpleNamespace
 from services.room_service import RoomService
 from services.moderation_service import ModerationService
 from services.notification_service import NotificationService
 from services.track_service import TrackService
+from services.audio_service import AudioService
 from repositories.track_repository import TrackRepository
 from repositories.moderation_repository import ModerationRepository
 from repositories.room_repository import RoomRepository
@@ -27,12 +29,15 @@ room_service = RoomService()
 moderation_service = ModerationService()
 notification_service = NotificationService()
 track_service = TrackService()
+audio_service = AudioService()
 track_repo = TrackRepository()
 moderation_repo = ModerationRepository()
 room_repo = RoomRepository()
 
 router = Router()
 
+BATCH_PAGE_SIZE = 10  # треков на странице очереди модерации
+
 
 class ManageUser(StatesGroup):
     waiting_for_user_id = State()
@@ -51,9 +56,8 @@ async def room_settings(callback: types.CallbackQuery):
     moderation_enabled = await room_repo.is_moderation_enabled(room_id)
     moderation_status = "✅ Включена" if moderation_enabled else "❌ Выключена"
     
-    # Проверяем количество треков на модерации через репозиторий
-    pending_tracks = await moderation_repo.get_pending_tracks(room_id)
-    queue_length = len(pending_tracks)
+    # Количество треков на модерации (ZCARD, без чтения очереди)
+    queue_length = await moderation_repo.count_moderation_queue(room_id)
     
     kb = InlineKeyboardBuilder()
     kb.button(
@@ -297,13 +301,10 @@ async def show_moderation_queue(callback: types.CallbackQuery):
         await callback.answer("❌ Нет прав.", show_alert=True)
         return
     
-    # Получаем pending треки через репозиторий (автоматически возвращает в pending при неактивности)
-    # Сначала принудительно восстанавливаем все потерянные треки
-    restored = await moderation_repo.restore_all_pending_from_user_tracks(room_id)
-    if restored > 0:
-        print(f"✅ Восстановлено {restored} потерянных треков для комнаты {room_id}")
-    
-    pending_tracks = await moderation_repo.get_pending_tracks(room_id)
+    # Читаем только количество и первый трек очереди. Потерянные треки
+    # возвращает restore_moderation_tracks.py
+    queue_length = await moderation_repo.count_moderation_queue(room_id)
+    pending_tracks = await moderation_repo.get_moderation_page(room_id, 0, 1)
     
     if not pending_tracks:
         kb = InlineKeyboardBuilder()
@@ -325,7 +326,7 @@ async def show_moderation_queue(callback: types.CallbackQuery):
     text = f"📋 <b>Очередь модерации</b>\n\n"
     text += f"🎵 <b>{first_track.get('title', 'Неизвестно')}</b>\n"
     text += f"👤 От: {first_track.get('added_by', 'Неизвестно')}\n"
-    text += f"📊 В очереди: <b>{len(pending_tracks)}</b> треков\n"
+    text += f"📊 В очереди: <b>{queue_length}</b> треков\n"
     
     kb = InlineKeyboardBuilder()
     
@@ -338,6 +339,17 @@ async def show_moderation_queue(callback: types.CallbackQuery):
     kb.button(text="❌ Отклонить", callback_data=f"mod_reject:{room_id}:{token}")
     kb.adjust(2)
     
+    # Пакетная модерация
+    user_id = first_track.get("user_id")
+    # Считаем по всей очереди, а не по первой странице
+    if user_id and await moderation_repo.count_pending_by_user(room_id, user_id) > 1:
+        kb.button(
+            text=f"✅ Все от {first_track.get('added_by', user_id)}",
+            callback_data=f"mod_approve_user:{room_id}:{user_id}"
+        )
+    if queue_length > 1:
+        kb.button(text="☑️ Выбрать несколько", callback_data=f"mod_batch:{room_id}:0")
+    
     # Кнопка отклоненных треков (всегда доступна)
     kb.button(text="❌ Отклоненные треки", callback_data=f"rejected_tracks:{room_id}")
     
@@ -377,23 +389,19 @@ async def mod_play_track(callback: types.CallbackQuery):
         await callback.answer("⚠️ Файл трека не найден.", show_alert=True)
         return
     
-    audio_file = CACHE_DIR / f"{file_hash}.mp3"
-    if not audio_file.exists():
-        await callback.answer("⚠️ Аудиофайл не найден на сервере.", show_alert=True)
-        return
-    
-    # Отправляем аудио
+    # Отправляем аудио (по сохраненному file_id, иначе загрузкой файла)
     try:
-        with open(audio_file, "rb") as f:
-            audio_data = f.read()
-        input_file = types.BufferedInputFile(audio_data, filename=f"{title}.mp3")
-        
-        await callback.message.answer_audio( # type: ignore
-            audio=input_file,
+        await audio_service.send_audio(
+            callback.bot,
+            callback.message.chat.id,  # type: ignore
+            file_hash,
+            filename=f"{title}.mp3",
             title=title,
             caption=f"🎧 {title}"
         )
         await callback.answer("✅ Трек отправлен")
+    except FileNotFoundError:
+        await callback.answer("⚠️ Аудиофайл не найден на сервере.", show_alert=True)
     except Exception as e:
         print(f"❌ Ошибка при отправке трека: {e}")
         await callback.answer("⚠️ Ошибка при отправке трека.", show_alert=True)
@@ -469,6 +477,193 @@ async def mod_reject_track(callback: types.CallbackQuery):
         await callback.answer("⚠️ Ошибка при отклонении трека.", show_alert=True)
 
 
+# --- Пакетная модерация ---
+
+async def _show_batch_screen(callback: types.CallbackQuery, room_id: str, page: int):
+    """Экран выбора нескольких треков из очереди модерации"""
+    admin_id = callback.from_user.id  # type: ignore
+    queue_length = await moderation_repo.count_moderation_queue(room_id)
+    if not queue_length:
+        await moderation_repo.clear_selection(room_id, admin_id)
+        await show_moderation_queue(callback)
+        return
+    
+    # Читаем только текущую страницу очереди
+    pages = (queue_length + BATCH_PAGE_SIZE - 1) // BATCH_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    page_tracks = await moderation_repo.get_moderation_page(room_id, page * BATCH_PAGE_SIZE, BATCH_PAGE_SIZE)
+    # Треки, которых уже нет в очереди, при применении будут пропущены
+    selected = set(await moderation_repo.get_selection(room_id, admin_id))
+    
+    text = "📋 <b>Пакетная модерация</b>\n\n"
+    text += f"📊 В очереди: <b>{queue_length}</b> треков\n"
+    text += f"☑️ Выбрано: <b>{len(selected)}</b>\n"
+    if pages > 1:
+        text += f"📄 Страница {page + 1}/{pages}\n"
+    
+    kb = InlineKeyboardBuilder()
+    for track in page_tracks:
+        mark = "✅" if track["token"] in selected else "⬜"
+        kb.button(
+            text=f"{mark} {track.get('title', 'Неизвестно')[:40]} — {track.get('added_by', '')}"[:64],
+            callback_data=f"mod_sel:{room_id}:{page}:{track['token']}"
+        )
+    
+    nav = []
+    if page > 0:
+        nav.append(("⬅️", f"mod_batch:{room_id}:{page - 1}"))
+    if page < pages - 1:
+        nav.append(("➡️", f"mod_batch:{room_id}:{page + 1}"))
+    for nav_text, nav_data in nav:
+        kb.button(text=nav_text, callback_data=nav_data)
+    
+    kb.button(text="☑️ Выбрать страницу", callback_data=f"mod_sel_page:{room_id}:{page}")
+    kb.button(text="🔄 Снять выбор", callback_data=f"mod_sel_clear:{room_id}:{page}")
+    if selected:
+        kb.button(text=f"✅ Одобрить ({len(selected)})", callback_data=f"mod_batch_approve:{room_id}")
+        kb.button(text=f"❌ Отклонить ({len(selected)})", callback_data=f"mod_batch_reject:{room_id}")
+    kb.button(text="🔙 К очереди модерации", callback_data=f"moderation_queue:{room_id}")
+    
+    sizes = [1] * len(page_tracks)
+    if nav:
+        sizes.append(len(nav))
+    sizes.append(2)
+    if selected:
+        sizes.append(2)
+    sizes.append(1)
+    kb.adjust(*sizes)
+    
+    await callback.message.edit_text( # type: ignore
+        text,
+        reply_markup=kb.as_markup(),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("mod_batch:"))
+async def mod_batch_screen(callback: types.CallbackQuery):
+    """Открывает экран пакетной модерации"""
+    parts = callback.data.split(":")  # type: ignore
+    room_id = parts[1]
+    page = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+    
+    if not await room_service.is_admin_or_owner(callback.from_user.id, room_id):  # type: ignore
+        await callback.answer("❌ Нет прав.", show_alert=True)
+        return
+    
+    await _show_batch_screen(callback, room_id, page)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("mod_sel:"))
+async def mod_toggle_selection(callback: types.CallbackQuery):
+    """Выбирает трек на экране пакетной модерации или снимает выбор"""
+    _, room_id, page, token = callback.data.split(":")  # type: ignore
+    admin_id = callback.from_user.id  # type: ignore
+    
+    if not await room_service.is_admin_or_owner(admin_id, room_id):  # type: ignore
+        await callback.answer("❌ Нет прав.", show_alert=True)
+        return
+    
+    await moderation_repo.toggle_selection(room_id, admin_id, token)
+    await _show_batch_screen(callback, room_id, int(page))
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("mod_sel_page:"))
+async def mod_select_page(callback: types.CallbackQuery):
+    """Выбирает все треки текущей страницы"""
+    _, room_id, page = callback.data.split(":")  # type: ignore
+    admin_id = callback.from_user.id  # type: ignore
+    
+    if not await room_service.is_admin_or_owner(admin_id, room_id):  # type: ignore
+        await callback.answer("❌ Нет прав.", show_alert=True)
+        return
+    
+    page_tracks = await moderation_repo.get_moderation_page(room_id, int(page) * BATCH_PAGE_SIZE, BATCH_PAGE_SIZE)
+    tokens = [t["token"] for t in page_tracks]
+    await moderation_repo.add_to_selection(room_id, admin_id, tokens)
+    await _show_batch_screen(callback, room_id, int(page))
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("mod_sel_clear:"))
+async def mod_clear_selection(callback: types.CallbackQuery):
+    """Снимает выбор со всех треков"""
+    _, room_id, page = callback.data.split(":")  # type: ignore
+    admin_id = callback.from_user.id  # type: ignore
+    
+    if not await room_service.is_admin_or_owner(admin_id, room_id):  # type: ignore
+        await callback.answer("❌ Нет прав.", show_alert=True)
+        return
+    
+    await moderation_repo.clear_selection(room_id, admin_id)
+    await _show_batch_screen(callback, room_id, int(page))
+    await callback.answer()
+
+
+def _batch_summary(result: Dict[str, Any], action: str) -> str:
+    text = f"{action}: {result['processed']}"
+    if result["duplicates"]:
+        text += f", уже в плейлисте: {result['duplicates']}"
+    if result["skipped"]:
+        text += f", пропущено: {result['skipped']}"
+    return text
+
+
+@router.callback_query(F.data.startswith("mod_batch_approve:") | F.data.startswith("mod_batch_reject:"))
+async def mod_batch_apply(callback: types.CallbackQuery):
+    """Одобряет или отклоняет выбранные треки одной транзакцией"""
+    action, room_id = callback.data.split(":")  # type: ignore
+    admin_id = callback.from_user.id  # type: ignore
+    approve = action == "mod_batch_approve"
+    
+    if not await room_service.is_admin_or_owner(admin_id, room_id):  # type: ignore
+        await callback.answer("❌ Нет прав.", show_alert=True)
+        return
+    
+    tokens = await moderation_repo.get_selection(room_id, admin_id)
+    if not tokens:
+        await callback.answer("⚠️ Не выбрано ни одного трека.", show_alert=True)
+        return
+    
+    try:
+        if approve:
+            result = await moderation_service.approve_many(room_id, tokens, admin_id)
+        else:
+            result = await moderation_service.reject_many(room_id, tokens, admin_id)
+        await moderation_repo.clear_selection(room_id, admin_id)
+        
+        # Одно уведомление на пользователя со всеми его треками
+        await notification_service.notify_tracks_moderated(result["by_user"], room_id, approved=approve)
+        
+        await callback.answer(_batch_summary(result, "✅ Одобрено" if approve else "❌ Отклонено"))
+        await show_moderation_queue(callback)
+    except Exception as e:
+        print(f"❌ Ошибка пакетной модерации: {e}")
+        await callback.answer("⚠️ Ошибка пакетной модерации.", show_alert=True)
+
+
+@router.callback_query(F.data.startswith("mod_approve_user:"))
+async def mod_approve_all_from_user(callback: types.CallbackQuery):
+    """Одобряет все треки пользователя из очереди модерации"""
+    _, room_id, user_id = callback.data.split(":")  # type: ignore
+    admin_id = callback.from_user.id  # type: ignore
+    
+    if not await room_service.is_admin_or_owner(admin_id, room_id):  # type: ignore
+        await callback.answer("❌ Нет прав.", show_alert=True)
+        return
+    
+    try:
+        result = await moderation_service.approve_all_from_user(room_id, int(user_id), admin_id)
+        await notification_service.notify_tracks_moderated(result["by_user"], room_id, approved=True)
+        await callback.answer(_batch_summary(result, "✅ Одобрено"))
+        await show_moderation_queue(callback)
+    except Exception as e:
+        print(f"❌ Ошибка при одобрении треков пользователя: {e}")
+        await callback.answer("⚠️ Ошибка при одобрении треков.", show_alert=True)
+
+
 # --- Просмотр отклоненных треков ---
 @router.callback_query(F.data.startswith("rejected_tracks:"))
 async def show_rejected_tracks(callback: types.CallbackQuery):
@@ -565,8 +760,8 @@ async def view_rejected_track(callback: types.CallbackQuery):
     
     # Кнопка прослушать
     if file_hash:
-        audio_file = CACHE_DIR / f"{file_hash}.mp3"
-        if audio_file.exists():
+        audio_cache = get_audio_cache()
+        if await audio_cache.get_entry(await audio_cache.resolve(file_hash)):
             kb.button(text="🎧 Прослушать", callback_data=f"rej_play_track:{room_id}:{token}")
     
     # Кнопка добавить в плейлист
@@ -609,23 +804,19 @@ async def rej_play_track(callback: types.CallbackQuery):
         await callback.answer("⚠️ Файл трека не найден.", show_alert=True)
         return
     
-    audio_file = CACHE_DIR / f"{file_hash}.mp3"
-    if not audio_file.exists():
-        await callback.answer("⚠️ Аудиофайл не найден на сервере.", show_alert=True)
-        return
-    
-    # Отправляем аудио
+    # Отправляем аудио (по сохраненному file_id, иначе загрузкой файла)
     try:
-        with open(audio_file, "rb") as f:
-            audio_data = f.read()
-        input_file = types.BufferedInputFile(audio_data, filename=f"{title}.mp3")
-        
-        await callback.message.answer_audio( # type: ignore
-            audio=input_file,
+        await audio_service.send_audio(
+            callback.bot,
+            callback.message.chat.id,  # type: ignore
+            file_hash,
+            filename=f"{title}.mp3",
             title=title,
             caption=f"🎧 {title}"
         )
         await callback.answer("✅ Трек отправлен")
+    except FileNotFoundError:
+        await callback.answer("⚠️ Аудиофайл не найден на сервере.", show_alert=True)
     except Exception as e:
         print(f"❌ Ошибка при отправке трека: {e}")
         await callback.answer("⚠️ Ошибка при отправке трека.", show_alert=True)
@@ -681,14 +872,10 @@ async def manage_user_tracks(callback: types.CallbackQuery):
         await callback.answer("⚠️ Функция в разработке", show_alert=True)
         return
     
-    # Получаем треки пользователя
-    track_tokens_raw = await redis_safe(redis.smembers(f"user:{target_user_id}:tracks:{room_id}"))
-    track_tokens = [
-        t.decode() if isinstance(t, bytes) else str(t)
-        for t in (track_tokens_raw or [])
-    ]
+    # Получаем треки пользователя через репозиторий (SMEMBERS + MGET)
+    tracks_data = await track_repo.get_user_tracks(target_user_id, room_id)
     
-    if not track_tokens:
+    if not tracks_data:
         kb = InlineKeyboardBuilder()
         kb.button(text="🔙 Назад", callback_data=f"room_settings:{room_id}")
         await callback.message.edit_text( # type: ignore
@@ -699,18 +886,6 @@ async def manage_user_tracks(callback: types.CallbackQuery):
         )
         return
     
-    # Получаем данные о треках
-    tracks_data = []
-    for token in track_tokens:
-        user_track_key = f"user_track:{target_user_id}:{room_id}:{token}"
-        data_raw = await redis_safe(redis.get(user_track_key))
-        if data_raw:
-            try:
-                data = json.loads(data_raw)
-                tracks_data.append(data)
-            except Exception:
-                pass
-    
     # Группируем по статусам
     approved_tracks = [t for t in tracks_data if t.get("status") == "approved"]
     rejected_tracks = [t for t in tracks_data if t.get("status") == "rejected"]
@@ -766,17 +941,13 @@ async def restore_track(callback: types.CallbackQuery):
         return
     
     # Получаем данные трека
-    user_track_key = f"user_track:{user_id}:{room_id}:{token}"
-    data_raw = await redis_safe(redis.get(user_track_key))
+    track_data = await track_repo.get_user_track(user_id, room_id, token)
     
-    if not data_raw:
+    if not track_data:
         await callback.answer("⚠️ Трек не найден.", show_alert=True)
         return
     
-    track_data = json.loads(data_raw)
-    
     # Возвращаем в очередь модерации
-    moderation_key = f"moderation_queue:{room_id}:{token}"
     moderation_data = {
         "title": track_data.get("title"),
         "file": track_data.get("file"),
@@ -786,12 +957,10 @@ async def restore_track(callback: types.CallbackQuery):
         "status": "pending",
         "anon": track_data.get("anon", False)
     }
-    await redis_safe(redis.set(moderation_key, json.dumps(moderation_data), ex=86400))
-    await redis_safe(redis.rpush(f"room:{room_id}:moderation_queue", token))
+    await moderation_repo.add_to_moderation_queue(room_id, token, moderation_data)
     
-    # Обновляем статус трека пользователя
-    track_data["status"] = "pending"
-    await redis_safe(redis.set(user_track_key, json.dumps(track_data), ex=604800))
+    # Обновляем статус трека пользователя (и индекс pending комнаты)
+    await track_repo.update_user_track_status(user_id, room_id, token, "pending")
     
     # Уведомляем пользователя
     try:
@@ -821,32 +990,24 @@ async def reject_approved_track(callback: types.CallbackQuery):
         return
     
     # Получаем данные трека
-    user_track_key = f"user_track:{user_id}:{room_id}:{token}"
-    data_raw = await redis_safe(redis.get(user_track_key))
+    track_data = await track_repo.get_user_track(user_id, room_id, token)
     
-    if not data_raw:
+    if not track_data:
         await callback.answer("⚠️ Трек не найден.", show_alert=True)
         return
     
-    track_data = json.loads(data_raw)
     title = track_data.get("title")
     file_hash = track_data.get("file")
     
-    # Удаляем трек из плейлиста комнаты
-    tracks_raw = await redis_safe(redis.lrange(f"room:{room_id}:tracks", 0, -1))
-    for i, t_raw in enumerate(tracks_raw or []):
-        try:
-            t = json.loads(t_raw)
-            if t.get("file") == file_hash or t.get("title", "").lower() == title.lower():
-                await redis_safe(redis.lset(f"room:{room_id}:tracks", i, "__deleted__"))
-                await redis_safe(redis.lrem(f"room:{room_id}:tracks", 1, "__deleted__"))
-                break
-        except Exception:
-            pass
+    # Удаляем трек из плейлиста комнаты (поиск по индексам хеша и названия)
+    track_id = await track_repo.find_track_id_by_hash(room_id, file_hash)
+    if track_id is None:
+        track_id = await track_repo.find_track_id_by_title(room_id, title or "")
+    if track_id is not None:
+        await track_repo.remove_track_by_id(room_id, track_id)
     
     # Обновляем статус трека пользователя
-    track_data["status"] = "rejected"
-    await redis_safe(redis.set(user_track_key, json.dumps(track_data), ex=604800))
+    await track_repo.update_user_track_status(user_id, room_id, token, "rejected")
     
     # Уведомляем пользователя
     try:
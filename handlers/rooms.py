@@ -2,22 +2,19 @@
 Handlers для работы с комнатами
 Рефакторинг с использованием Repository и Service слоев
 """
-import hashlib
-import io
 import json
-import zipfile
-from pathlib import Path
 from types import SimpleNamespace
 from typing import Union, Set, cast
 
 from aiogram import Router, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from config import redis, bot as bot_instance, TG_MAX_FILE_BYTES
+from config import redis, bot as bot_instance
 from utils.google_drive import upload_to_drive
 from utils.redis_helper import redis_safe
 from utils.storage import RoomContext
-from utils.youtube import CACHE_DIR
+from utils.audio_cache import get_audio_cache
 from utils.timezone import format_datetime, iso_now
 from repositories.track_repository import TrackRepository
 from repositories.room_repository import RoomRepository
@@ -25,12 +22,19 @@ from services.room_service import RoomService
 from services.track_service import TrackService
 from services.moderation_service import ModerationService
 from services.notification_service import NotificationService
+from services.user_profile_cache import get_user_profile_cache
+from services.audio_service import AudioService
+from services.export_service import get_export_service
+from utils.notification_fanout import get_fanout_engine
 
 # Инициализация сервисов и репозиториев
 room_service = RoomService()
 track_service = TrackService()
 moderation_service = ModerationService()
 notification_service = NotificationService()
+profile_cache = get_user_profile_cache()
+audio_service = AudioService()
+export_service = get_export_service()
 track_repo = TrackRepository()
 room_repo = RoomRepository()
 
@@ -53,9 +57,11 @@ async def build_rooms_kb(user_id: int, page: int = 0, per_page: int = 5) -> type
     kb.button(text="➕ Создать комнату", callback_data="create_room")
     kb.adjust(1)  # ← она будет в своей строке
 
-    # комнаты в столбик
-    for rid in rooms[start:end]:
-        name = await room_repo.get_room_name(rid) or "Без имени"
+    # комнаты в столбик (названия страницы — одним MGET)
+    page_rooms = rooms[start:end]
+    names = await room_repo.get_room_names(page_rooms)
+    for rid in page_rooms:
+        name = names.get(rid) or "Без имени"
         star = "⭐ " if rid in admin_rooms_set else ""
         kb.button(text=f"{star}{name}", callback_data=f"room:{rid}")
 
@@ -168,6 +174,14 @@ async def open_room(callback: types.CallbackQuery):
     # Получаем участников через репозиторий
     members = await room_repo.get_room_members(room_id)
 
+    # Профили участников и авторов без имени — одним запросом к кэшу
+    # (get_chat только для тех, кого нет ни в памяти, ни в Redis)
+    nameless_authors = [
+        data.get("user_id") for author, data in author_data.items()
+        if (not author.strip() or author.strip() == "ㅤ") and data.get("user_id")
+    ]
+    profiles = await profile_cache.resolve_many(callback.bot, list(members) + nameless_authors)
+
     # текст заголовка
     text = f"🎧 <b>{room_name}</b>\n"
     text += f"📀 Треков всего: <b>{total_tracks}</b>\n\n"
@@ -211,11 +225,9 @@ async def open_room(callback: types.CallbackQuery):
             if not is_anon:
                 display_name = author_name
                 if not author_name or author_name.strip() == "" or author_name.strip() == "ㅤ":
-                    try:
-                        user = await callback.bot.get_chat(user_id)  # type: ignore
-                        display_name = user.username and f"@{user.username}" or (user.full_name or f"User {user_id}")
-                    except Exception:
-                        display_name = f"User {user_id}" if user_id else "Неизвестно"
+                    if user_id:
+                        profile = profiles.get(int(user_id)) if str(user_id).isdigit() else None
+                        display_name = profile_cache.display_name(profile, user_id)
                     else:
                         display_name = "Неизвестно"
                 else:
@@ -240,11 +252,10 @@ async def open_room(callback: types.CallbackQuery):
     if members:
         text += "<b>Участники комнаты:</b>\n"
         for uid in members:
-            try:
-                user = await callback.bot.get_chat(uid)  # type: ignore
-                name = user.username and f"@{user.username}" or user.full_name
-                text += f"• {name}\n"
-            except Exception:
+            profile = profiles.get(uid)
+            if profile:
+                text += f"• {profile_cache.display_name(profile, uid)}\n"
+            else:
                 text += f"• 👤 {uid}\n"
         text += "\n"
 
@@ -395,8 +406,8 @@ async def view_track_info(callback: types.CallbackQuery):
     
     # Кнопка прослушать трек
     if file_hash:
-        audio_file = CACHE_DIR / f"{file_hash}.mp3"
-        if audio_file.exists():
+        audio_cache = get_audio_cache()
+        if await audio_cache.get_entry(await audio_cache.resolve(file_hash)):
             kb.button(text="🎧 Прослушать", callback_data=f"play_track:{room_id}:{track_index}")
     
     # Для админов - кнопка изменения статуса
@@ -434,23 +445,19 @@ async def play_track(callback: types.CallbackQuery):
         await callback.answer("⚠️ Файл трека не найден.", show_alert=True)
         return
     
-    audio_file = CACHE_DIR / f"{file_hash}.mp3"
-    if not audio_file.exists():
-        await callback.answer("⚠️ Аудиофайл не найден на сервере.", show_alert=True)
-        return
-    
-    # Отправляем аудио
+    # Отправляем аудио (по сохраненному file_id, иначе загрузкой файла)
     try:
-        with open(audio_file, "rb") as f:
-            audio_data = f.read()
-        input_file = types.BufferedInputFile(audio_data, filename=f"{title}.mp3")
-        
-        await callback.message.answer_audio( # type: ignore
-            audio=input_file,
+        await audio_service.send_audio(
+            callback.bot,
+            callback.message.chat.id,  # type: ignore
+            file_hash,
+            filename=f"{title}.mp3",
             title=title,
             caption=f"🎧 {title}"
         )
         await callback.answer("✅ Трек отправлен")
+    except FileNotFoundError:
+        await callback.answer("⚠️ Аудиофайл не найден на сервере.", show_alert=True)
     except Exception as e:
         print(f"❌ Ошибка при отправке трека: {e}")
         await callback.answer("⚠️ Ошибка при отправке трека.", show_alert=True)
@@ -621,22 +628,21 @@ async def import_list_tracks(callback: types.CallbackQuery):
         title = track.get("title", "Без названия")
         caption = f"🎵 {title} ({i}/{len(tracks_data)})"
 
-        cache_path = CACHE_DIR / f"{file_hash}.mp3"
-        if not cache_path.exists():
+        if not file_hash:
             continue
-        if cache_path.stat().st_size > TG_MAX_FILE_BYTES:
-            continue  # Пропускаем — превышает лимит Telegram (50 МБ)
 
         try:
-            audio_data = cache_path.read_bytes()
-            input_file = types.BufferedInputFile(audio_data, filename=f"{title[:50]}.mp3")
-            msg = await callback.bot.send_audio(  # type: ignore
-                chat_id=chat_id,
-                audio=input_file,
+            msg = await audio_service.send_audio(
+                callback.bot,
+                chat_id,
+                file_hash,
+                filename=f"{title[:50]}.mp3",
                 title=title[:30] if title else None,
                 caption=caption
             )
             msg_ids.append(msg.message_id)
+        except (FileNotFoundError, ValueError):
+            continue  # Нет в кэше или превышает лимит Telegram (50 МБ)
         except Exception as e:
             print(f"❌ Ошибка отправки трека {title}: {e}")
             continue
@@ -710,182 +716,59 @@ def _safe_archive_name(name: str, room_id: str, strip_emoji: bool = False) -> st
         return room_id
 
 
-# ---------- экспорт архива (максимальное сжатие + кэширование) ----------
+# ---------- экспорт архива (части без сжатия из кэша + кэширование) ----------
 @router.callback_query(F.data.startswith("export:"))
 async def export_playlist(callback: types.CallbackQuery):
-    import shutil
-
     await callback.answer("⏳ Архив формируется, подождите...", show_alert=False)
     room_id = callback.data.split(":")[1]  # type: ignore
     room_name = await room_service.get_room_name(room_id) or room_id
     archive_base = _safe_archive_name(room_name, room_id)
 
-    EXPORT_DIR = Path("exports")
-    EXPORT_CACHE_DIR = Path("exports/cache")
-    MUSIC_CACHE = CACHE_DIR  # tmp/music_cache
-
-    # --- Получаем треки и строим хеш контента ---
     tracks = await track_repo.get_all_tracks(room_id)
     if not tracks:
         await callback.answer("Комната пуста — треков нет.", show_alert=True)
         return
 
-    valid = []
-    for t in tracks:
-        fh = t.get("file")
-        if not fh:
-            continue
-        src = MUSIC_CACHE / f"{fh}.mp3"
-        if not src.exists():
-            continue
-        if src.stat().st_size > TG_MAX_FILE_BYTES:
-            continue
-        title = t.get("title", fh)
-        safe = "".join(c for c in title if c.isalnum() or c in " _-").strip() or fh
-        valid.append((fh, safe))
-    valid.sort(key=lambda x: x[1].lower())
-
-    if not valid:
+    items = await export_service.collect_items(tracks)
+    if not items:
         await callback.answer("⚠️ Нет треков для экспорта (файлы не найдены или превышают лимит).", show_alert=True)
         return
 
-    content_hash = hashlib.md5("|".join(fh for fh, _ in valid).encode()).hexdigest()[:16]
-    cache_key = f"{room_id}_{content_hash}"
-    cache_dir = EXPORT_CACHE_DIR / cache_key
-
-    # --- Используем кэш, если архив уже собран ---
-    cached_parts = sorted(cache_dir.glob("part*.zip")) if cache_dir.exists() else []
-    if cached_parts:
-        # Проверяем, что все части не превышают лимит TG (50 MB)
-        oversized = [p for p in cached_parts if p.stat().st_size > TG_MAX_FILE_BYTES]
-        if oversized:
-            print(f"[export] Кэш {cache_key} содержит переразмеренные части, пересобираем")
-            try:
-                shutil.rmtree(cache_dir)
-            except OSError:
-                pass
-            cached_parts = []
-        else:
-            print(f"[export] Кэш-попадание: {cache_key}")
-            total_parts = len(cached_parts)
-            total_files = len(valid)
-            for i, p in enumerate(cached_parts, 1):
-                data = p.read_bytes()
-                tracks_in_part = len(zipfile.ZipFile(io.BytesIO(data), "r").namelist())
-                fname = f"{archive_base}_part{i}.zip" if total_parts > 1 else f"{archive_base}.zip"
-                cap = "📦 Архив комнаты" if total_parts == 1 else f"📦 Часть {i} из {total_parts}"
-                try:
-                    await callback.message.answer_document(  # type: ignore
-                        types.BufferedInputFile(data, filename=fname),
-                        caption=f"{cap} ({tracks_in_part} треков, всего {total_files})"
-                    )
-                except Exception:
-                    archive_fallback = _safe_archive_name(room_name, room_id, strip_emoji=True)
-                    fname_fallback = f"{archive_fallback}_part{i}.zip" if total_parts > 1 else f"{archive_fallback}.zip"
-                    await callback.message.answer_document(  # type: ignore
-                        types.BufferedInputFile(data, filename=fname_fallback),
-                        caption=f"{cap} ({tracks_in_part} треков, всего {total_files})"
-                    )
-            await callback.message.answer(  # type: ignore
-                f"✅ Архив из кэша\n📦 Частей: {total_parts}\n🎵 Треков: {total_files}",
-                parse_mode="HTML"
-            )
-            return
-
-    # --- Собираем архив и сохраняем в кэш ---
-    EXPORT_DIR.mkdir(exist_ok=True)
-    EXPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    room_folder = EXPORT_DIR / room_id
-    if room_folder.exists():
-        shutil.rmtree(room_folder)
-    room_folder.mkdir()
-
-    for fh, safe in valid:
-        src = MUSIC_CACHE / f"{fh}.mp3"
-        dst = room_folder / f"{safe}.mp3"
-        try:
-            shutil.copy2(src, dst)
-        except OSError:
-            pass
-
-    mp3_files = sorted(room_folder.glob("*.mp3"))
-    total_files = len(mp3_files)
-    if total_files == 0:
-        await callback.answer("⚠️ Нет треков для экспорта.", show_alert=True)
-        try:
-            shutil.rmtree(room_folder)
-        except Exception:
-            pass
-        return
-
-    # Лимит Telegram 50 MB. Zip central directory + сжатие — берём запас 35 MB.
-    MAX_SIZE_BYTES = int(35 * 1024 * 1024)  # 35 MB
-
-    def _new_zip():
-        buf = io.BytesIO()
-        zf = zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9)
-        return buf, zf
-
+    parts = []
     try:
-        cache_dir.mkdir(parents=True, exist_ok=True)
-        current_buf, current_zip = _new_zip()
-        tracks_in_part = 0
-        part = 1
-
-        for mp3_path in mp3_files:
-            try:
-                data = mp3_path.read_bytes()
-                current_zip.writestr(mp3_path.name, data, compress_type=zipfile.ZIP_DEFLATED)
-                tracks_in_part += 1
-            except Exception as e:
-                print(f"[export] Ошибка при обработке {mp3_path.name}: {e}")
-                continue
-
-            current_size = current_buf.tell()
-            if current_size >= MAX_SIZE_BYTES:
-                current_zip.close()
-                current_buf.seek(0)
-                data = current_buf.read()
-                if len(data) > TG_MAX_FILE_BYTES:
-                    raise ValueError(f"Часть {part} превысила лимит TG: {len(data) // (1024*1024)} МБ")
-                (cache_dir / f"part{part}.zip").write_bytes(data)
-                part += 1
-                current_buf, current_zip = _new_zip()
-                tracks_in_part = 0
-
-        if tracks_in_part > 0:
-            current_zip.close()
-            current_buf.seek(0)
-            data = current_buf.read()
-            if len(data) > TG_MAX_FILE_BYTES:
-                raise ValueError(f"Часть {part} превысила лимит TG: {len(data) // (1024*1024)} МБ")
-            (cache_dir / f"part{part}.zip").write_bytes(data)
+        # Части собираются в отдельном потоке прямо из аудиокэша (или берутся из кэша экспорта)
+        parts = await export_service.build(room_id, items)
 
-        try:
-            shutil.rmtree(room_folder)
-        except Exception as e:
-            print(f"[export] Не удалось удалить временную папку: {e}")
-
-        # Отправка из кэша (единый путь — знаем total_parts)
-        cached_parts = sorted(cache_dir.glob("part*.zip"))
-        total_parts = len(cached_parts)
-        for i, p in enumerate(cached_parts, 1):
-            data = p.read_bytes()
-            tracks_in_part = len(zipfile.ZipFile(io.BytesIO(data), "r").namelist())
+        total_parts = len(parts)
+        total_files = len(items)
+        archive_fallback = _safe_archive_name(room_name, room_id, strip_emoji=True)
+        for i, part in enumerate(parts, 1):
             fname = f"{archive_base}_part{i}.zip" if total_parts > 1 else f"{archive_base}.zip"
+            fname_fallback = f"{archive_fallback}_part{i}.zip" if total_parts > 1 else f"{archive_fallback}.zip"
             cap = "📦 Архив комнаты" if total_parts == 1 else f"📦 Часть {i} из {total_parts}"
+            caption = f"{cap} ({part['tracks']} треков, всего {total_files})"
+
+            # Часть не менялась с прошлой отправки — отправляем по file_id без загрузки
+            if part["file_id"] and part["filename"] in (fname, fname_fallback):
+                try:
+                    await callback.message.answer_document(part["file_id"], caption=caption)  # type: ignore
+                    continue
+                except TelegramBadRequest as e:
+                    print(f"[export] file_id части {part['name']} не принят: {e}")
+
             try:
-                await callback.message.answer_document(  # type: ignore
-                    types.BufferedInputFile(data, filename=fname),
-                    caption=f"{cap} ({tracks_in_part} треков, всего {total_files})"
+                msg = await callback.message.answer_document(  # type: ignore
+                    types.FSInputFile(part["path"], filename=fname),
+                    caption=caption
                 )
             except Exception:
-                archive_fallback = _safe_archive_name(room_name, room_id, strip_emoji=True)
-                fname_fallback = f"{archive_fallback}_part{i}.zip" if total_parts > 1 else f"{archive_fallback}.zip"
-                await callback.message.answer_document(  # type: ignore
-                    types.BufferedInputFile(data, filename=fname_fallback),
-                    caption=f"{cap} ({tracks_in_part} треков, всего {total_files})"
+                fname = fname_fallback
+                msg = await callback.message.answer_document(  # type: ignore
+                    types.FSInputFile(part["path"], filename=fname),
+                    caption=caption
                 )
+            if msg.document:
+                await export_service.remember_file_id(room_id, part["name"], fname, msg.document.file_id)
 
         await callback.message.answer(  # type: ignore
             f"✅ Архив комнаты готов!\n📦 Частей: {total_parts}\n🎵 Треков: {total_files}",
@@ -895,27 +778,16 @@ async def export_playlist(callback: types.CallbackQuery):
         print(f"[export] Критическая ошибка при создании архива: {e}")
         import traceback
         traceback.print_exc()
-        try:
-            current_zip.close()
-        except Exception:
-            pass
-        try:
-            shutil.rmtree(room_folder)
-        except Exception:
-            pass
-        # Инвалидируем кэш при ошибке (часть могла превысить лимит TG)
-        try:
-            if cache_dir.exists():
-                shutil.rmtree(cache_dir)
-        except Exception:
-            pass
         err_msg = "❌ Ошибка при создании архива."
         if "EntityTooLarge" in str(type(e).__name__) or "Request Entity Too Large" in str(e) or "превысила лимит" in str(e):
-            err_msg = "❌ Часть архива превысила лимит (50 МБ). Кэш сброшен — нажмите «Экспорт» снова."
+            err_msg = "❌ Часть архива превысила лимит (50 МБ). Нажмите «Экспорт» снова."
         try:
             await callback.answer(err_msg, show_alert=True)
         except Exception:
             await callback.message.answer(err_msg)
+    finally:
+        # Части больше не отправляются — выброшенные повторной сборкой можно удалить
+        export_service.release(parts)
 
 # ---------- очистка плейлиста ----------
 @router.callback_query(F.data.startswith("clear_confirm:"))
@@ -948,18 +820,16 @@ async def clear_playlist(callback: types.CallbackQuery):
         await callback.answer("⛔ Только админ может очищать плейлист.", show_alert=True)
         return
 
-    await redis_safe(redis.delete(f"room:{room_id}:tracks"))
+    await track_repo.clear_tracks(room_id)
     await callback.message.edit_text(f"💨 Плейлист комнаты <b>{room_id}</b> успешно очищен!") # type: ignore
 
-    # уведомим участников
-    members = await redis_safe(redis.smembers(f"room:{room_id}:members"))
-    for m in members or []:
-        try:
-            uid = int(m.decode() if isinstance(m, bytes) else m)
-            if uid != callback.from_user.id:
-                await callback.bot.send_message(uid, f"🧹 Плейлист комнаты <b>{room_id}</b> был очищен админом.") # type: ignore
-        except Exception:
-            pass
+    # уведомим участников (в фоне, с учетом лимитов Telegram)
+    members = await room_repo.get_room_members(room_id)
+    await get_fanout_engine().enqueue_many(
+        members,
+        f"🧹 Плейлист комнаты <b>{room_id}</b> был очищен админом.",
+        exclude=callback.from_user.id
+    )
 
 
 # ---------- генерация рефералки ----------
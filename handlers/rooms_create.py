@@ -4,7 +4,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from config import redis
 from utils.redis_helper import redis_safe
-from utils.room_permissions import set_room_moderation
+from utils.room_permissions import set_room_moderation, invalidate_role_cache
 import uuid
 import json
 
@@ -64,6 +64,7 @@ async def create_room_moderation(callback: types.CallbackQuery, state: FSMContex
     await redis_safe(redis.sadd(f"user:{user_id}:admin_rooms", room_id))
     await redis_safe(redis.sadd(f"room:{room_id}:members", user_id))
     await redis_safe(redis.sadd(f"room:{room_id}:admins", user_id))
+    invalidate_role_cache(room_id, user_id)
     
     # Устанавливаем режим модерации
     await set_room_moderation(room_id, moderation_enabled)
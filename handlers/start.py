@@ -3,7 +3,7 @@ from aiogram.filters import CommandStart
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from config import redis
 from utils.redis_helper import redis_safe
-from utils.room_permissions import get_user_role
+from utils.room_permissions import get_user_role, invalidate_role_cache
 
 router = Router()
 
@@ -49,6 +49,7 @@ async def start_ref(message: types.Message, command: CommandStart):
             if not (is_owner or is_admin or is_member):
                 await redis_safe(redis.sadd(f"room:{room_id}:members", str(user_id)))
                 await redis_safe(redis.sadd(f"user:{user_id}:rooms", room_id))
+                invalidate_role_cache(room_id, user_id)
 
             await message.answer(
                 f"🎧 Ты присоединился к комнате <b>{name}</b>!",
@@ -10,13 +10,16 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from handlers.rooms import open_room
-from utils.youtube import download_track, CACHE_DIR
+from utils.youtube import search_candidates, download_candidate
+from utils.download_jobs import get_download_jobs
+from utils.audio_cache import get_audio_cache
 from config import redis, bot as bot_instance, TG_MAX_FILE_BYTES
 from utils.redis_helper import redis_safe
 from services.track_service import TrackService
 from services.moderation_service import ModerationService
 from services.room_service import RoomService
 from services.notification_service import NotificationService
+from services.audio_service import AudioService
 from utils.timezone import iso_now, format_datetime
 
 router = Router()
@@ -27,6 +30,7 @@ track_service = TrackService()
 moderation_service = ModerationService()
 room_service = RoomService()
 notification_service = NotificationService()
+audio_service = AudioService()
 track_repo = TrackRepository()
 
 
@@ -53,6 +57,28 @@ async def add_track_to_room(callback: types.CallbackQuery, state: FSMContext):
     )
 
 
+SEARCH_PICK_TTL = 3600  # секунд можно выбрать трек из результатов поиска
+
+
+def _added_by_name(user: types.User) -> str:
+    """Имя пользователя: full_name или username"""
+    return user.full_name or (f"@{user.username}" if user.username else f"User {user.id}")
+
+
+def _candidate_label(candidate: dict) -> str:
+    """Подпись кнопки кандидата: название, длительность, размер"""
+    info = []
+    if candidate.get("duration"):
+        minutes, seconds = divmod(candidate["duration"], 60)
+        info.append(f"{minutes}:{seconds:02d}")
+    if candidate.get("estimated_size"):
+        size_mb = candidate["estimated_size"] / (1024 * 1024)
+        info.append(f"{size_mb:.1f} МБ" if candidate.get("cached") else f"~{size_mb:.1f} МБ")
+    suffix = f" ({', '.join(info)})" if info else ""
+    prefix = "⚡ " if candidate.get("cached") else "🎵 "
+    return prefix + candidate["title"][:64 - len(prefix) - len(suffix)] + suffix
+
+
 # --- Пользователь вводит запрос ---
 @router.message(TrackAdd.waiting_for_query)
 async def handle_track_query(message: types.Message, state: FSMContext):
@@ -60,92 +86,192 @@ async def handle_track_query(message: types.Message, state: FSMContext):
     data = await state.get_data()
     room_id = data.get("room_id")
 
-    # Отправляем сообщение о начале загрузки
-    loading_msg = await message.answer(f"🔍 Ищу трек <b>{query}</b>...\n⏳ Это может занять некоторое время...", parse_mode="HTML")
+    # Сначала только поиск (без загрузки) — загружается трек, который выберет пользователь
+    loading_msg = await message.answer(f"🔍 Ищу трек <b>{query}</b>...", parse_mode="HTML")
 
     try:
-        result = await download_track(query)
-        if not result:
-            await loading_msg.edit_text("⚠️ Не удалось найти или загрузить трек.")
-            await state.clear()
-            return
-
-        # Получаем данные трека
-        title = result["title"]
-        audio_buf = result["buffer"]
-        file_hash = result["hash"]
-        print(f"🎯 title={title}, hash={file_hash}")
-
-        # Проверка лимита Telegram (50 МБ)
-        audio_buf.seek(0)
-        if len(audio_buf.read()) > TG_MAX_FILE_BYTES:
-            cache_path = CACHE_DIR / f"{file_hash}.mp3"
-            meta_path = CACHE_DIR / f"{file_hash}.json"
-            if cache_path.exists():
-                cache_path.unlink()
-            if meta_path.exists():
-                meta_path.unlink()
-            await loading_msg.edit_text(
-                "⚠️ Файл превышает лимит Telegram (50 МБ). Трек не добавлен.",
-                parse_mode="HTML"
-            )
+        candidates = await search_candidates(query)
+        # Треки, которые заведомо больше лимита Telegram, не предлагаем
+        candidates = [
+            c for c in candidates
+            if not c["estimated_size"] or c["estimated_size"] <= TG_MAX_FILE_BYTES
+        ]
+        if not candidates:
+            await loading_msg.edit_text("⚠️ Не удалось найти трек.")
             await state.clear()
             return
 
-        # Создаём временный ключ в redis
-        token = secrets.token_hex(4)
-        cache_key = f"pending_track:{token}"
-        # Получаем имя пользователя: full_name или username
         user = message.from_user  # type: ignore
-        added_by_name = user.full_name or (f"@{user.username}" if user.username else f"User {user.id}")
-        
-        track_data = {
+        token = secrets.token_hex(4)
+        search_data = {
             "room_id": room_id,
-            "title": title,
-            "file": file_hash,
             "user_id": user.id,
-            "added_by": added_by_name
+            "added_by": _added_by_name(user),
+            "query": query,
+            "candidates": candidates
         }
-        # Убираем ограничение времени - трек хранится без TTL (навсегда, пока не будет подтвержден)
-        await redis_safe(redis.set(cache_key, json.dumps(track_data)))
+        await redis_safe(redis.set(f"track_search:{token}", json.dumps(search_data), ex=SEARCH_PICK_TTL))
 
-        # Создаём кнопки подтверждения / отмены
         kb = InlineKeyboardBuilder()
-        kb.button(text="✅ Добавить", callback_data=f"confirm:{token}:public")
-        kb.button(text="🤫 Анонимно", callback_data=f"confirm:{token}:anon")
+        for i, candidate in enumerate(candidates):
+            kb.button(text=_candidate_label(candidate), callback_data=f"pick:{token}:{i}")
         kb.button(text="❌ Отмена", callback_data="cancel_add")
-        kb.adjust(2)
-
-        # Используем mp3 из памяти (важно: читаем buffer и создаем новый BytesIO)
-        audio_buf.seek(0)  # Возвращаемся в начало буфера
-        audio_data = audio_buf.read()
-        input_file = types.BufferedInputFile(audio_data, filename=f"{title}.mp3")
+        kb.adjust(1)
 
-        # Удаляем сообщение о загрузке и отправляем трек
-        try:
-            await loading_msg.delete()
-        except Exception:
-            pass
-
-        await message.answer_audio(
-            audio=input_file,
-            caption=f"🎧 Это твой трек?",
-            title=title,
-            reply_markup=kb.as_markup()
+        await loading_msg.edit_text(
+            f"🔎 Найдено по запросу <b>{query}</b>:\nВыбери нужный трек.",
+            reply_markup=kb.as_markup(),
+            parse_mode="HTML"
         )
-
         await state.clear()
     except Exception as e:
-        print(f"❌ Ошибка при загрузке трека: {e}")
+        print(f"❌ Ошибка при поиске трека: {e}")
         import traceback
         traceback.print_exc()
         try:
-            await loading_msg.edit_text("⚠️ Произошла ошибка при загрузке трека. Попробуйте еще раз.")
+            await loading_msg.edit_text("⚠️ Произошла ошибка при поиске трека. Попробуйте еще раз.")
         except Exception:
-            await message.answer("⚠️ Произошла ошибка при загрузке трека. Попробуйте еще раз.")
+            await message.answer("⚠️ Произошла ошибка при поиске трека. Попробуйте еще раз.")
         await state.clear()
 
 
+# --- Пользователь выбирает трек из результатов поиска ---
+@router.callback_query(F.data.startswith("pick:"))
+async def pick_candidate(callback: types.CallbackQuery):
+    _, token, index = callback.data.split(":")  # type: ignore
+    search_key = f"track_search:{token}"
+
+    data_raw = await redis_safe(redis.get(search_key))
+    if not data_raw:
+        await callback.answer("⚠️ Результаты поиска устарели. Пожалуйста, найдите трек заново.", show_alert=True)
+        return
+    data = json.loads(data_raw)
+    candidates = data["candidates"]
+    if not index.isdigit() or int(index) >= len(candidates):
+        await callback.answer("⚠️ Трек не найден.", show_alert=True)
+        return
+    candidate = candidates[int(index)]
+    await redis_safe(redis.delete(search_key))
+    await callback.answer()
+
+    delivery = {
+        "chat_id": callback.message.chat.id,  # type: ignore
+        "message_id": callback.message.message_id,  # type: ignore
+        "room_id": data["room_id"],
+        "user_id": data["user_id"],
+        "added_by": data["added_by"]
+    }
+
+    # Файл уже в кэше — отправляем сразу, без очереди
+    if await get_audio_cache().get_entry(candidate["hash"]):
+        result = await download_candidate(candidate)
+        if result:
+            await _offer_track(callback.bot, delivery, result)
+            return
+
+    # Загрузка — фоновой задачей: хендлер не ждет yt-dlp, задача переживает перезапуск бота
+    try:
+        job_id, created = await get_download_jobs().submit(candidate, delivery)
+    except Exception as e:
+        print(f"❌ Ошибка постановки загрузки в очередь: {e}")
+        await callback.message.edit_text("⚠️ Произошла ошибка при загрузке трека. Попробуйте еще раз.")  # type: ignore
+        return
+    print(f"📥 Задача загрузки {job_id} ({'новая' if created else 'уже в работе'}): {candidate['title']}")
+    position = await get_download_jobs().queue_position(job_id)
+    position_text = f"\n📍 Место в очереди: {position}" if position else ""
+    try:
+        await callback.message.edit_text(  # type: ignore
+            f"🕓 <b>{candidate['title']}</b> в очереди на загрузку.{position_text}\n"
+            f"Трек придет сюда, когда будет готов.",
+            parse_mode="HTML"
+        )
+    except Exception:
+        pass
+
+
+async def report_download_progress(delivery: dict, job: dict):
+    """Колбэк задач загрузки: загрузка началась (или повторяется)"""
+    attempt = f" (попытка {job['attempts'] + 1})" if job["attempts"] else ""
+    await bot_instance.edit_message_text(
+        f"⏳ Загружаю <b>{job['title']}</b>{attempt}...",
+        chat_id=delivery["chat_id"],
+        message_id=delivery["message_id"],
+        parse_mode="HTML"
+    )
+
+
+async def deliver_download(delivery: dict, job: dict, result):
+    """Колбэк задач загрузки: результат для получателя (None — загрузка не удалась)"""
+    if result is None:
+        if job.get("error") == "too_large":
+            text = "⚠️ Трек слишком длинный: он не поместится в лимит Telegram (50 МБ)."
+        else:
+            text = "⚠️ Не удалось загрузить трек. Попробуйте еще раз."
+        await bot_instance.edit_message_text(
+            text,
+            chat_id=delivery["chat_id"],
+            message_id=delivery["message_id"]
+        )
+        return
+    await _offer_track(bot_instance, delivery, result)
+
+
+async def _offer_track(bot, delivery: dict, result: dict):
+    """Отправляет загруженный трек с кнопками подтверждения вместо сообщения о загрузке"""
+    title = result["title"]
+    file_hash = result["hash"]
+    print(f"🎯 title={title}, hash={file_hash}, size={result['size']}")
+
+    # Проверка лимита Telegram (50 МБ): битрейт подбирается до загрузки, здесь — страховка
+    # (размер файла по индексу, без чтения в память)
+    if result["size"] > TG_MAX_FILE_BYTES:
+        await get_audio_cache().remove(file_hash)
+        await bot.edit_message_text(
+            "⚠️ Файл превышает лимит Telegram (50 МБ). Трек не добавлен.",
+            chat_id=delivery["chat_id"],
+            message_id=delivery["message_id"],
+            parse_mode="HTML"
+        )
+        return
+
+    # Создаём временный ключ в redis
+    token = secrets.token_hex(4)
+    cache_key = f"pending_track:{token}"
+    track_data = {
+        "room_id": delivery["room_id"],
+        "title": title,
+        "file": file_hash,
+        "user_id": delivery["user_id"],
+        "added_by": delivery["added_by"]
+    }
+    # Убираем ограничение времени - трек хранится без TTL (навсегда, пока не будет подтвержден)
+    await redis_safe(redis.set(cache_key, json.dumps(track_data)))
+
+    # Создаём кнопки подтверждения / отмены
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✅ Добавить", callback_data=f"confirm:{token}:public")
+    kb.button(text="🤫 Анонимно", callback_data=f"confirm:{token}:anon")
+    kb.button(text="❌ Отмена", callback_data="cancel_add")
+    kb.adjust(2)
+
+    # Удаляем сообщение о загрузке и отправляем трек
+    try:
+        await bot.delete_message(delivery["chat_id"], delivery["message_id"])
+    except Exception:
+        pass
+
+    # mp3 отправляется потоком с диска (или по сохраненному file_id)
+    await audio_service.send_audio(
+        bot,
+        delivery["chat_id"],
+        file_hash,
+        filename=f"{title}.mp3",
+        caption=f"🎧 Это твой трек?",
+        title=title,
+        reply_markup=kb.as_markup()
+    )
+
+
 @router.callback_query(F.data.startswith("confirm:"))
 async def confirm_track(callback: types.CallbackQuery):
     parts = callback.data.split(":")  # type: ignore
@@ -210,12 +336,9 @@ async def confirm_track(callback: types.CallbackQuery):
     print(f"🧩 confirm_track: room_id={room_id}, title={title}, file_hash={file_hash}, user_id={user_id}, anon={anon}")
 
     # --- проверка лимита Telegram (50 МБ) ---
-    cache_path = CACHE_DIR / f"{file_hash}.mp3"
-    if cache_path.exists() and cache_path.stat().st_size > TG_MAX_FILE_BYTES:
-        cache_path.unlink()
-        meta_path = CACHE_DIR / f"{file_hash}.json"
-        if meta_path.exists():
-            meta_path.unlink()
+    entry = await get_audio_cache().get_entry(file_hash)
+    if entry and entry["size"] > TG_MAX_FILE_BYTES:
+        await get_audio_cache().remove(file_hash)
         await callback.answer("⚠️ Файл превышает лимит Telegram (50 МБ). Трек не добавлен.", show_alert=True)
         return
 
@@ -254,7 +377,7 @@ async def confirm_track(callback: types.CallbackQuery):
                 pass
             
             # Открываем комнату после отправки на модерацию
-            total_tracks = len(await track_repo.get_all_tracks(room_id))
+            total_tracks = await track_repo.count_tracks(room_id)
             per_page = 10
             last_page = max(0, (total_tracks - 1) // per_page)
             
@@ -300,7 +423,7 @@ async def confirm_track(callback: types.CallbackQuery):
             pass
         
         # Открываем комнату с обновленным списком треков
-        total_tracks = len(await track_repo.get_all_tracks(room_id))
+        total_tracks = await track_repo.count_tracks(room_id)
         per_page = 10
         last_page = max(0, (total_tracks - 1) // per_page)
         
@@ -327,7 +450,7 @@ async def cancel_add(callback: types.CallbackQuery):
     await callback.answer("🚫 Отмена добавления.")
     room_id = await RoomContext.get_active_room(callback.from_user.id)
     if room_id:
-        total_tracks = await redis_safe(redis.llen(f"room:{room_id}:tracks")) or 0
+        total_tracks = await track_repo.count_tracks(room_id)
         per_page = 10
         last_page = max(0, (total_tracks - 1) // per_page)
 
@@ -550,20 +673,21 @@ async def show_my_tracks_list_in_chat(callback: types.CallbackQuery):
         title = track.get("title", "Без названия")
         caption = f"🎵 {title} ({i}/{len(tracks_data)})"
 
-        cache_path = CACHE_DIR / f"{file_hash}.mp3"
-        if not cache_path.exists():
+        if not file_hash:
             continue
 
         try:
-            audio_data = cache_path.read_bytes()
-            input_file = types.BufferedInputFile(audio_data, filename=f"{title[:50]}.mp3")
-            msg = await callback.bot.send_audio(  # type: ignore
-                chat_id=chat_id,
-                audio=input_file,
+            msg = await audio_service.send_audio(
+                callback.bot,
+                chat_id,
+                file_hash,
+                filename=f"{title[:50]}.mp3",
                 title=title[:30] if title else None,
                 caption=caption
             )
             msg_ids.append(msg.message_id)
+        except (FileNotFoundError, ValueError):
+            continue  # Нет в кэше или превышает лимит Telegram (50 МБ)
         except Exception as e:
             print(f"❌ Ошибка отправки трека {title}: {e}")
             continue
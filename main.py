@@ -1,23 +1,50 @@
 import asyncio
 import logging
-from config import bot, dp
-from handlers.tracks import router as tracks_router
+from config import bot, dp, RUN_MODE
+from handlers.tracks import router as tracks_router, deliver_download, report_download_progress
 from handlers.rooms import router as rooms_router
 from handlers.rooms_create import router as create_router
 from handlers.start import router as start_router
 from handlers.room_management import router as management_router
+from middlewares.user_profile import UserProfileMiddleware
+from utils.notification_fanout import stop_fanout_engine
+from utils.youtube import shutdown_download_pool, stop_download_queue
+from utils.audio_cache import get_audio_cache
+from utils.download_jobs import get_download_jobs
+from utils.webhook_server import run_webhook
 logging.basicConfig(level=logging.INFO)
 
 async def main():
     try:
+        # Профили пользователей кэшируются из апдейтов (см. services/user_profile_cache.py)
+        profile_middleware = UserProfileMiddleware()
+        dp.message.outer_middleware(profile_middleware)
+        dp.callback_query.outer_middleware(profile_middleware)
+        
+        # Фоновое вытеснение старых файлов из аудиокэша
+        get_audio_cache().start()
+        # Фоновые загрузки треков (задачи в Redis, см. utils/download_jobs.py)
+        get_download_jobs().start(deliver_download, report_download_progress)
+        
         dp.include_router(start_router)
         dp.include_router(rooms_router)
         dp.include_router(create_router)
         dp.include_router(tracks_router)
         dp.include_router(management_router)
-        await dp.start_polling(bot)
+        if RUN_MODE == "webhook":
+            # Апдейты через aiohttp-сервер (см. utils/webhook_server.py)
+            await run_webhook(bot, dp)
+        else:
+            await dp.start_polling(bot)
     finally:
+        await get_audio_cache().stop()
+        # Прерванные загрузки возвращаются в очередь до закрытия пула процессов
+        await get_download_jobs().stop()
+        await stop_download_queue()
+        # Досылаем накопленные уведомления до закрытия сессии бота
+        await stop_fanout_engine()
         await bot.session.close()
+        shutdown_download_pool()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
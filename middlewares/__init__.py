@@ -0,0 +1,8 @@
+"""
+Middleware бота
+"""
+from .user_profile import UserProfileMiddleware
+
+__all__ = [
+    "UserProfileMiddleware",
+]
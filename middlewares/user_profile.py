@@ -0,0 +1,31 @@
+"""
+Middleware, пополняющий кэш профилей пользователей из входящих апдейтов
+"""
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from services.user_profile_cache import get_user_profile_cache
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfileMiddleware(BaseMiddleware):
+    """Запоминает from_user сообщений и callback-запросов в UserProfileCache"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is not None and not user.is_bot:
+            try:
+                await get_user_profile_cache().remember(user)
+            except Exception as e:
+                # Кэш профилей не должен мешать обработке апдейта
+                logger.warning(f"⚠️ Не удалось обновить профиль {user.id}: {e}")
+        return await handler(event, data)
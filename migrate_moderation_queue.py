@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Переводит очереди модерации комнат со списка токенов
+(room:{id}:moderation_queue) на ZSET по времени добавления трека.
+
+Миграция выполняется на месте: список переименовывается в
+room:{id}:moderation_queue:legacy, токены переносятся в ZSET, затем
+резервная копия удаляется (или остается при --keep-backup).
+
+Заодно во всех очередях (и уже переведенных) треки со статусом
+in_progress возвращаются в pending: взятия трека в обработку больше
+нет, и без этого они остались бы скрыты от модераторов. Удаляется и
+ставший ненужным ZSET moderation:in_progress.
+Перед запуском остановите бота.
+
+Использование:
+    python migrate_moderation_queue.py [--keep-backup] [room_id ...]
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import redis
+from utils.redis_helper import redis_safe
+from repositories.moderation_repository import ModerationRepository
+
+
+async def find_room_ids() -> list[str]:
+    """Находит все комнаты с очередью модерации"""
+    room_ids = []
+    cursor = 0
+    while True:
+        cursor, keys = await redis_safe(redis.scan(cursor, match="room:*:moderation_queue", count=100))
+        for k in keys:
+            key = k.decode() if isinstance(k, bytes) else str(k)
+            parts = key.split(":")
+            if len(parts) == 3 and parts[1] not in room_ids:
+                room_ids.append(parts[1])
+        if cursor == 0:
+            break
+    return room_ids
+
+
+async def main():
+    args = sys.argv[1:]
+    keep_backup = "--keep-backup" in args
+    room_ids = [a for a in args if not a.startswith("--")] or await find_room_ids()
+
+    moderation_repo = ModerationRepository()
+    migrated_rooms = 0
+    migrated_tokens = 0
+    reset_tracks = 0
+
+    print(f"🔍 Комнат с очередью модерации: {len(room_ids)}")
+    for room_id in room_ids:
+        count = await moderation_repo.migrate_queue_from_list(room_id, keep_backup=keep_backup)
+        if count is None:
+            print(f"   ⏭️ {room_id}: уже на новой схеме")
+        else:
+            migrated_rooms += 1
+            migrated_tokens += count
+            print(f"   ✅ {room_id}: перенесено треков: {count}")
+        reset = await moderation_repo.reset_in_progress(room_id)
+        if reset:
+            reset_tracks += reset
+            print(f"   🔄 {room_id}: возвращено в pending треков в обработке: {reset}")
+
+    # Отметки взятия в обработку от старой схемы
+    await redis_safe(redis.delete("moderation:in_progress"))
+
+    print(f"\n✅ Готово: комнат {migrated_rooms}, треков {migrated_tokens}, возвращено в pending: {reset_tracks}.")
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
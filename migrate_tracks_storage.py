@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Переводит плейлисты комнат со старого формата (JSON-список в room:{id}:tracks)
+на хеши треков + ZSET порядка + индексы по хешу файла и названию.
+
+Миграция выполняется на месте: список переименовывается в
+room:{id}:tracks:legacy, треки переносятся в исходном порядке, затем
+резервная копия удаляется (или остается при --keep-backup).
+Прерванную миграцию можно запустить повторно — она продолжится
+с резервной копии.
+Перед запуском остановите бота.
+
+Использование:
+    python migrate_tracks_storage.py [--keep-backup] [room_id ...]
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import redis
+from utils.redis_helper import redis_safe
+from repositories.track_repository import TrackRepository
+
+
+async def find_room_ids() -> list[str]:
+    """Находит все комнаты с плейлистом"""
+    room_ids = []
+    cursor = 0
+    while True:
+        cursor, keys = await redis_safe(redis.scan(cursor, match="room:*:tracks", count=100))
+        for k in keys:
+            key = k.decode() if isinstance(k, bytes) else str(k)
+            parts = key.split(":")
+            if len(parts) == 3 and parts[1] not in room_ids:
+                room_ids.append(parts[1])
+        if cursor == 0:
+            break
+    return room_ids
+
+
+async def main():
+    args = sys.argv[1:]
+    keep_backup = "--keep-backup" in args
+    room_ids = [a for a in args if not a.startswith("--")] or await find_room_ids()
+
+    track_repo = TrackRepository()
+    migrated_rooms = 0
+    migrated_tracks = 0
+
+    print(f"🔍 Комнат с плейлистом: {len(room_ids)}")
+    for room_id in room_ids:
+        count = await track_repo.migrate_room_from_list(room_id, keep_backup=keep_backup)
+        if count is None:
+            print(f"   ⏭️ {room_id}: уже на новой схеме")
+            continue
+        migrated_rooms += 1
+        migrated_tracks += count
+        print(f"   ✅ {room_id}: перенесено треков: {count}")
+
+    print(f"\n✅ Готово: комнат {migrated_rooms}, треков {migrated_tracks}.")
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
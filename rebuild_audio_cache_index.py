@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Перестраивает индекс аудиокэша и счетчики ссылок на файлы.
+
+- переносит mp3 из корня tmp/music_cache (до шардирования) в
+  поддиректории по первым двум символам хеша;
+- индекс файлов (SQLite, tmp/music_cache/index.sqlite3) — по файлам
+  на диске: новые файлы добавляются (название — из старых .json,
+  время доступа = время изменения файла), записи удаленных файлов
+  убираются, известные метаданные сохраняются;
+- audio_cache:refs — по трекам всех комнат.
+
+Нужен один раз для файлов и плейлистов, созданных до появления индекса,
+или после ручных изменений в кэше. Перед запуском остановите бота.
+
+Использование:
+    python rebuild_audio_cache_index.py
+"""
+import asyncio
+import json
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import redis
+from utils.redis_helper import redis_safe
+from utils.audio_cache import CACHE_DIR, INDEX_PATH, path_for
+from utils.audio_index import AudioIndex
+from repositories.audio_cache_repository import AudioCacheRepository
+from repositories.track_repository import TrackRepository
+
+# Ключи Redis, в которых индекс файлов хранился до перехода на SQLite
+LEGACY_INDEX_KEYS = ("audio_cache:access", "audio_cache:sizes", "audio_cache:bytes")
+
+
+def legacy_title(file_hash: str) -> str | None:
+    """Название из старого мета-файла {hash}.json (удаляет его после чтения)"""
+    meta_path = CACHE_DIR / f"{file_hash}.json"
+    if not meta_path.exists():
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            title = json.load(f).get("title")
+    except Exception:
+        title = None
+    meta_path.unlink(missing_ok=True)
+    return title
+
+
+def shard_legacy_files() -> int:
+    """Переносит mp3 из корня кэша в поддиректории. Возвращает число файлов"""
+    moved = 0
+    for p in CACHE_DIR.glob("*.mp3"):
+        dst = path_for(p.stem)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists():
+            p.unlink()
+        else:
+            os.replace(p, dst)
+        moved += 1
+    return moved
+
+
+def rebuild_file_index(index: AudioIndex) -> tuple[int, int, int]:
+    """Сверяет индекс с файлами на диске. Возвращает (файлов, байт, удалено записей)"""
+    known = set(index.all_hashes())
+    on_disk = {}
+    for p in CACHE_DIR.glob("??/*.mp3"):
+        try:
+            stat = p.stat()
+        except OSError:
+            continue
+        on_disk[p.stem] = stat
+        if p.stem in known:
+            continue
+        index.upsert(
+            p.stem,
+            stat.st_size,
+            title=legacy_title(p.stem),
+            created_at=stat.st_mtime,
+            accessed_at=stat.st_mtime
+        )
+
+    stale = known - on_disk.keys()
+    for file_hash in stale:
+        index.delete(file_hash)
+    # Мета-файлы без mp3 больше не нужны
+    for meta_path in CACHE_DIR.glob("*.json"):
+        meta_path.unlink(missing_ok=True)
+    return len(on_disk), sum(st.st_size for st in on_disk.values()), len(stale)
+
+
+async def find_room_ids() -> list[str]:
+    """Находит все комнаты с плейлистом"""
+    room_ids = []
+    cursor = 0
+    while True:
+        cursor, keys = await redis_safe(redis.scan(cursor, match="room:*:tracks", count=100))
+        for k in keys:
+            key = k.decode() if isinstance(k, bytes) else str(k)
+            parts = key.split(":")
+            if len(parts) == 3 and parts[1] not in room_ids:
+                room_ids.append(parts[1])
+        if cursor == 0:
+            break
+    return room_ids
+
+
+async def main():
+    cache_repo = AudioCacheRepository()
+    track_repo = TrackRepository()
+    index = AudioIndex(INDEX_PATH)
+
+    # 1. Файлы кэша
+    moved = await asyncio.to_thread(shard_legacy_files)
+    if moved:
+        print(f"📂 Перенесено в поддиректории: {moved}")
+    files, total, stale = await asyncio.to_thread(rebuild_file_index, index)
+    print(f"💾 Файлов в кэше: {files} ({total / 1024 / 1024:.1f} MB), удалено записей: {stale}")
+    await redis_safe(redis.delete(*LEGACY_INDEX_KEYS))
+
+    # 2. Ссылки из плейлистов комнат
+    refs: Counter = Counter()
+    room_ids = await find_room_ids()
+    for room_id in room_ids:
+        for track in await track_repo.get_all_tracks(room_id):
+            if track.get("file"):
+                refs[track["file"]] += 1
+    await cache_repo.replace_refs(dict(refs))
+    print(f"📌 Комнат: {len(room_ids)}, файлов в плейлистах: {len(refs)}")
+
+    entries = await asyncio.to_thread(index.get_many, list(refs))
+    missing = [h for h in refs if h not in entries]
+    if missing:
+        print(f"⚠️ Файлов из плейлистов нет в кэше: {len(missing)}")
+
+    index.close()
+    print("\n✅ Индекс аудиокэша перестроен.")
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,9 +4,17 @@ Repository слой для работы с данными
 from .track_repository import TrackRepository
 from .room_repository import RoomRepository
 from .moderation_repository import ModerationRepository
+from .user_profile_repository import UserProfileRepository
+from .media_repository import MediaRepository
+from .audio_cache_repository import AudioCacheRepository
+from .download_job_repository import DownloadJobRepository
 
 __all__ = [
     "TrackRepository",
     "RoomRepository",
     "ModerationRepository",
+    "UserProfileRepository",
+    "MediaRepository",
+    "AudioCacheRepository",
+    "DownloadJobRepository",
 ]
@@ -0,0 +1,96 @@
+"""
+Repository для общих индексов аудиокэша (tmp/music_cache)
+
+Метаданные самих файлов (размер, время доступа, название...) хранятся
+локально в SQLite (utils/audio_index.py); в Redis — то, что разделяют
+все процессы бота:
+- audio_cache:refs   — HASH file_hash -> число треков комнат, ссылающихся на файл
+  (ведет TrackRepository; файлы с refs > 0 не вытесняются);
+- audio_cache:queries — HASH md5(нормализованный запрос) -> file_hash;
+- audio_cache:aliases — HASH старый file_hash -> file_hash файла с тем же
+  содержимым (дубликаты, слитые dedup_audio_cache.py);
+- audio_cache:search:{md5 запроса} — кандидаты поиска без загрузки
+  (метаданные видео, с TTL).
+"""
+from typing import Optional, List, Dict, Any
+from repositories.base_repository import BaseRepository
+from utils.redis_helper import redis_safe
+
+
+class AudioCacheRepository(BaseRepository):
+    """Репозиторий индекса аудиокэша"""
+    
+    def _refs_key(self) -> str:
+        return "audio_cache:refs"
+    
+    def _queries_key(self) -> str:
+        return "audio_cache:queries"
+    
+    def _aliases_key(self) -> str:
+        return "audio_cache:aliases"
+    
+    def _search_key(self, query_key: str) -> str:
+        return f"audio_cache:search:{query_key}"
+    
+    async def get_search(self, query_key: str) -> Optional[List[Dict[str, Any]]]:
+        """Кэшированные кандидаты поиска по запросу (None — нет в кэше)"""
+        data = await self._get(self._search_key(query_key))
+        return data.get("candidates") if data else None
+    
+    async def set_search(self, query_key: str, candidates: List[Dict[str, Any]], ttl: int) -> None:
+        """Кэширует кандидатов поиска по запросу"""
+        await self._set(self._search_key(query_key), {"candidates": candidates}, ex=ttl)
+    
+    async def get_query_hash(self, query_key: str) -> Optional[str]:
+        """file_hash, ранее загруженный по запросу"""
+        file_hash = await redis_safe(self.redis.hget(self._queries_key(), query_key))
+        return self._decode(file_hash) if file_hash else None
+    
+    async def set_query_hash(self, query_key: str, file_hash: str) -> None:
+        """Запоминает file_hash для запроса"""
+        await redis_safe(self.redis.hset(self._queries_key(), query_key, file_hash))
+    
+    async def get_aliases(self, file_hashes: List[str]) -> List[Optional[str]]:
+        """Канонические хеши для старых file_hash (None — алиаса нет)"""
+        if not file_hashes:
+            return []
+        aliases_raw = await redis_safe(self.redis.hmget(self._aliases_key(), file_hashes))
+        return [self._decode(a) if a else None for a in (aliases_raw or [])]
+    
+    async def set_alias(self, file_hash: str, canonical_hash: str) -> None:
+        """
+        Делает file_hash алиасом canonical_hash: переносит ссылки плейлистов
+        и перенаправляет запросы, указывавшие на старый хеш.
+        Используется только обслуживающими скриптами (читает индексы целиком).
+        """
+        refs_raw = await redis_safe(self.redis.hget(self._refs_key(), file_hash))
+        queries_raw = await redis_safe(self.redis.hgetall(self._queries_key()))
+        aliases_raw = await redis_safe(self.redis.hgetall(self._aliases_key()))
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.hset(self._aliases_key(), file_hash, canonical_hash)
+            # Цепочки алиасов не допускаем: старые алиасы file_hash -> canonical_hash
+            for old_hash, target in (aliases_raw or {}).items():
+                if self._decode(target) == file_hash:
+                    pipe.hset(self._aliases_key(), old_hash, canonical_hash)
+            if refs_raw and int(refs_raw):
+                pipe.hincrby(self._refs_key(), canonical_hash, int(refs_raw))
+            pipe.hdel(self._refs_key(), file_hash)
+            for query_key, target in (queries_raw or {}).items():
+                if self._decode(target) == file_hash:
+                    pipe.hset(self._queries_key(), query_key, canonical_hash)
+            await pipe.execute()
+    
+    async def get_refs(self, file_hashes: List[str]) -> List[int]:
+        """Количество ссылок треков комнат на каждый файл"""
+        if not file_hashes:
+            return []
+        refs_raw = await redis_safe(self.redis.hmget(self._refs_key(), file_hashes))
+        return [int(r) if r else 0 for r in (refs_raw or [])]
+    
+    async def replace_refs(self, refs: Dict[str, int]) -> None:
+        """Перестраивает счетчики ссылок целиком"""
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.delete(self._refs_key())
+            if refs:
+                pipe.hset(self._refs_key(), mapping=refs)
+            await pipe.execute()
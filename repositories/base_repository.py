@@ -2,7 +2,7 @@
 Базовый класс для репозиториев
 """
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Awaitable, Sequence
 from config import redis
 from utils.redis_helper import redis_safe
 import json
@@ -11,12 +11,15 @@ import json
 class BaseRepository(ABC):
     """Базовый класс для всех репозиториев"""
     
+    # Зарегистрированные Lua-скрипты: исходный текст -> Script (общие для всех репозиториев)
+    _scripts: Dict[str, Any] = {}
+    
     def __init__(self):
         self.redis = redis
     
-    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
-        """Получает JSON объект из Redis"""
-        data_raw = await redis_safe(self.redis.get(key))
+    @staticmethod
+    def _loads(data_raw: Any) -> Optional[Dict[str, Any]]:
+        """Декодирует JSON значение, полученное из Redis"""
         if not data_raw:
             return None
         try:
@@ -26,6 +29,87 @@ class BaseRepository(ABC):
         except Exception:
             return None
     
+    @staticmethod
+    def _decode(value: Any) -> str:
+        """Приводит значение из Redis к строке"""
+        return value.decode() if isinstance(value, bytes) else str(value)
+    
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получает JSON объект из Redis"""
+        data_raw = await redis_safe(self.redis.get(key))
+        return self._loads(data_raw)
+    
+    async def _mget(self, keys: Sequence[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Получает несколько JSON объектов за один round trip (MGET).
+        
+        Returns:
+            Список той же длины, что и keys; None для отсутствующих ключей
+        """
+        if not keys:
+            return []
+        items_raw = await redis_safe(self.redis.mget(list(keys)))
+        return [self._loads(item_raw) for item_raw in (items_raw or [])]
+    
+    async def _mset(self, items: Dict[str, Dict[str, Any]], ex: Optional[int] = None) -> bool:
+        """
+        Сохраняет несколько JSON объектов за один round trip.
+        
+        MSET не поддерживает TTL, поэтому при ex используется пайплайн из SET.
+        """
+        if not items:
+            return True
+        try:
+            payload = {key: json.dumps(data, ensure_ascii=False) for key, data in items.items()}
+            if not ex:
+                return bool(await redis_safe(self.redis.mset(payload)))
+            async with self._pipeline() as pipe:
+                for key, json_str in payload.items():
+                    pipe.set(key, json_str, ex=ex)
+                results = await pipe.execute()
+            return all(results)
+        except Exception as e:
+            print(f"❌ Ошибка пакетного сохранения в Redis ({len(items)} ключей): {e}")
+            return False
+    
+    def _pipeline(self, transaction: bool = False):
+        """
+        Пайплайн для отправки нескольких команд одним round trip.
+        
+        Использование:
+            async with self._pipeline() as pipe:
+                pipe.get(key1)
+                pipe.sadd(key2, value)
+                results = await pipe.execute()
+        
+        transaction=True оборачивает команды в MULTI/EXEC.
+        """
+        return self.redis.pipeline(transaction=transaction)
+    
+    async def _transaction(self, func: Callable[[Any], Awaitable[Any]], *watch_keys: str) -> Any:
+        """
+        Выполняет оптимистичную транзакцию WATCH/MULTI/EXEC.
+        
+        func получает пайплайн в режиме WATCH: может читать ключи напрямую
+        (await pipe.get(...)), затем вызывает pipe.multi() и ставит команды
+        в очередь. При изменении наблюдаемых ключей другим клиентом func
+        вызывается повторно. Возвращает результат func.
+        """
+        return await self.redis.transaction(func, *watch_keys, value_from_callable=True)
+    
+    def _script(self, source: str) -> Any:
+        """
+        Lua-скрипт для атомарных операций (регистрируется один раз,
+        вызывается через EVALSHA).
+        
+        Использование:
+            await self._script(LUA_SOURCE)(keys=[...], args=[...])
+        """
+        script = BaseRepository._scripts.get(source)
+        if script is None:
+            script = BaseRepository._scripts[source] = self.redis.register_script(source)
+        return script
+    
     async def _set(self, key: str, data: Dict[str, Any], ex: Optional[int] = None) -> bool:
         """Сохраняет JSON объект в Redis"""
         try:
@@ -52,14 +136,16 @@ class BaseRepository(ABC):
         for item_raw in (items_raw or []):
             if item_raw == "__deleted__":
                 continue
-            try:
-                if isinstance(item_raw, bytes):
-                    item_raw = item_raw.decode()
-                result.append(json.loads(item_raw))
-            except Exception:
-                pass
+            item = self._loads(item_raw)
+            if item is not None:
+                result.append(item)
         return result
     
+    async def _list_tokens(self, key: str, start: int = 0, end: int = -1) -> List[str]:
+        """Получает список строковых значений (токенов) из Redis list"""
+        items_raw = await redis_safe(self.redis.lrange(key, start, end))
+        return [self._decode(t) for t in (items_raw or [])]
+    
     async def _list_add(self, key: str, data: Dict[str, Any]) -> int:
         """Добавляет JSON объект в Redis list"""
         json_str = json.dumps(data, ensure_ascii=False)
@@ -86,10 +172,7 @@ class BaseRepository(ABC):
     async def _set_members(self, key: str) -> List[str]:
         """Получает все элементы из Redis set"""
         members_raw = await redis_safe(self.redis.smembers(key))
-        return [
-            m.decode() if isinstance(m, bytes) else str(m)
-            for m in (members_raw or [])
-        ]
+        return [self._decode(m) for m in (members_raw or [])]
     
     async def _set_contains(self, key: str, value: str) -> bool:
         """Проверяет наличие значения в Redis set"""
@@ -0,0 +1,271 @@
+"""
+Repository для задач загрузки треков
+
+Задачи хранятся в Redis и переживают перезапуск бота:
+- download_job:{job_id} — данные задачи (JSON: url, title, hash, status,
+  attempts, error...); у завершенных задач — TTL;
+- download_job:{job_id}:deliveries — LIST получателей результата
+  (чат, сообщение, данные для добавления трека в комнату);
+- download_jobs:queue:{user_id} — ZSET job_id -> время, не раньше
+  которого задачу можно взять (повторы с задержкой); очередь у каждого
+  пользователя своя;
+- download_jobs:flows — ZSET user_id -> pass пользователей с задачами,
+  download_jobs:vtime — виртуальное время (справедливая очередь, см.
+  CLAIM_JOB_LUA);
+- download_quota:{user_id} — HASH лимитов пользователя (concurrency,
+  rate — загрузок в минуту, weight), download_quota:room:{room_id} —
+  HASH лимита комнаты (concurrency); без полей — лимиты по умолчанию;
+- download_jobs:running — ZSET job_id -> конец аренды воркера; задачи
+  с истекшей арендой возвращаются в очередь;
+- download_jobs:dedup:{cache_key} — job_id активной задачи для ключа кэша.
+"""
+import json
+import math
+import time
+from typing import Optional, List, Dict, Any, Tuple
+from repositories.base_repository import BaseRepository
+from repositories.scripts import ENQUEUE_JOB_LUA, CLAIM_JOB_LUA
+from utils.redis_helper import redis_safe
+from utils.timezone import iso_now
+
+
+class DownloadJobRepository(BaseRepository):
+    """Репозиторий задач загрузки"""
+
+    JOB_PREFIX = "download_job:"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.JOB_PREFIX}{job_id}"
+
+    def _deliveries_key(self, job_id: str) -> str:
+        return f"{self.JOB_PREFIX}{job_id}:deliveries"
+
+    QUEUE_PREFIX = "download_jobs:queue:"
+    QUOTA_PREFIX = "download_quota:"
+
+    def _queue_key(self, user_id: Any) -> str:
+        return f"{self.QUEUE_PREFIX}{user_id if user_id is not None else 0}"
+
+    def _legacy_queue_key(self) -> str:
+        # Общая очередь задач до появления очередей пользователей
+        return "download_jobs:queue"
+
+    def _flows_key(self) -> str:
+        return "download_jobs:flows"
+
+    def _vtime_key(self) -> str:
+        return "download_jobs:vtime"
+
+    def _user_quota_key(self, user_id: int) -> str:
+        return f"{self.QUOTA_PREFIX}{user_id}"
+
+    def _room_quota_key(self, room_id: str) -> str:
+        return f"{self.QUOTA_PREFIX}room:{room_id}"
+
+    def _running_key(self) -> str:
+        return "download_jobs:running"
+
+    def _dedup_key(self, cache_key: str) -> str:
+        return f"download_jobs:dedup:{cache_key}"
+
+    async def enqueue(self, job: Dict[str, Any], delivery: Dict[str, Any]) -> Tuple[str, bool]:
+        """
+        Ставит задачу в очередь. Если активная задача с тем же cache_key
+        уже есть, получатель добавляется к ней.
+
+        Returns:
+            (job_id, True — создана новая задача)
+        """
+        result = await self._script(ENQUEUE_JOB_LUA)(
+            keys=[
+                self._dedup_key(job["cache_key"]),
+                self._job_key(job["id"]),
+                self._queue_key(job.get("user_id")),
+                self._deliveries_key(job["id"]),
+                self._flows_key(),
+                self._vtime_key(),
+            ],
+            args=[
+                job["id"],
+                json.dumps(job, ensure_ascii=False),
+                time.time(),
+                json.dumps(delivery, ensure_ascii=False),
+                self.JOB_PREFIX,
+                job.get("user_id") if job.get("user_id") is not None else 0,
+            ]
+        )
+        return self._decode(result[0]), bool(int(result[1]))
+
+    async def claim(self, lease: float, limits: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Берет задачу в работу на lease секунд — по очереди у пользователей,
+        с учетом их лимитов (None — готовых задач в пределах лимитов нет).
+
+        Args:
+            limits: Лимиты по умолчанию: user_concurrency, user_rate,
+                weight, room_concurrency, scan (сколько пользователей проверять)
+        """
+        now = time.time()
+        raw = await self._script(CLAIM_JOB_LUA)(
+            keys=[self._flows_key(), self._running_key(), self._vtime_key(), self._legacy_queue_key()],
+            args=[
+                now,
+                now + lease,
+                iso_now(),
+                self.JOB_PREFIX,
+                self.QUEUE_PREFIX,
+                self.QUOTA_PREFIX,
+                limits["user_concurrency"],
+                limits["user_rate"],
+                limits["weight"],
+                limits["room_concurrency"],
+                int(now // 60),
+                limits["scan"],
+            ]
+        )
+        return self._loads(raw)
+
+    async def renew(self, job_id: str, lease: float) -> None:
+        """Продлевает аренду задачи (только если она еще в работе)"""
+        await redis_safe(self.redis.zadd(self._running_key(), {job_id: time.time() + lease}, xx=True))
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Получает задачу по id"""
+        return await self._get(self._job_key(job_id))
+
+    async def get_deliveries(self, job_id: str) -> List[Dict[str, Any]]:
+        """Получатели результата задачи"""
+        items_raw = await redis_safe(self.redis.lrange(self._deliveries_key(job_id), 0, -1))
+        return [d for d in (self._loads(raw) for raw in (items_raw or [])) if d is not None]
+
+    async def pop_delivery(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Забирает следующего получателя результата"""
+        return self._loads(await redis_safe(self.redis.lpop(self._deliveries_key(job_id))))
+
+    async def finish(self, job: Dict[str, Any], ttl: int) -> List[Dict[str, Any]]:
+        """
+        Завершает задачу (status done/failed) и снимает дедупликацию.
+
+        Returns:
+            Получатели, добавленные после последнего pop_delivery
+        """
+        job["updated_at"] = iso_now()
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.set(self._job_key(job["id"]), json.dumps(job, ensure_ascii=False), ex=ttl)
+            pipe.zrem(self._running_key(), job["id"])
+            pipe.delete(self._dedup_key(job["cache_key"]))
+            pipe.lrange(self._deliveries_key(job["id"]), 0, -1)
+            pipe.delete(self._deliveries_key(job["id"]))
+            results = await pipe.execute()
+        return [d for d in (self._loads(raw) for raw in results[3]) if d is not None]
+
+    async def retry(self, job: Dict[str, Any], delay: float) -> None:
+        """Возвращает задачу в очередь пользователя через delay секунд"""
+        await self._requeue([job], delay)
+
+    async def _requeue(self, jobs: List[Dict[str, Any]], delay: float = 0) -> None:
+        """Возвращает задачи из работы в очереди их пользователей"""
+        vtime = float(await redis_safe(self.redis.get(self._vtime_key())) or 0)
+        ready_at = time.time() + delay
+        async with self._pipeline(transaction=True) as pipe:
+            for job in jobs:
+                job["status"] = "queued"
+                job["updated_at"] = iso_now()
+                user_id = job.get("user_id") if job.get("user_id") is not None else 0
+                pipe.set(self._job_key(job["id"]), json.dumps(job, ensure_ascii=False))
+                pipe.zrem(self._running_key(), job["id"])
+                pipe.zadd(self._queue_key(user_id), {job["id"]: ready_at})
+                pipe.zadd(self._flows_key(), {str(user_id): vtime}, nx=True)
+            await pipe.execute()
+
+    async def release(self, jobs: List[Dict[str, Any]]) -> None:
+        """Возвращает незавершенные задачи в очередь без увеличения числа попыток"""
+        if jobs:
+            await self._requeue(jobs)
+
+    async def queue_position(self, job_id: str, default_weight: float) -> Optional[int]:
+        """
+        Оценка места задачи в очереди (1 — следующая), None — задача не в очереди.
+
+        Задачи пользователя идут по порядку, а пользователи — по очереди
+        пропорционально весам: перед k-й задачей пользователя с весом w
+        другой пользователь с весом w' успеет загрузить около k * w' / w
+        своих задач (но не больше, чем у него в очереди). Лимиты
+        и задачи в работе не учитываются.
+        """
+        job = await self.get_job(job_id)
+        if not job or job.get("status") != "queued":
+            return None
+        user_id = str(job.get("user_id") if job.get("user_id") is not None else 0)
+        rank = await redis_safe(self.redis.zrank(self._queue_key(user_id), job_id))
+        if rank is None:
+            return None
+
+        flows = [self._decode(u) for u in (await redis_safe(self.redis.zrange(self._flows_key(), 0, -1)) or [])]
+        if user_id not in flows:
+            flows.append(user_id)
+        async with self._pipeline() as pipe:
+            for uid in flows:
+                pipe.zcard(self._queue_key(uid))
+                pipe.hget(self._user_quota_key(uid), "weight")  # type: ignore
+            results = await pipe.execute()
+        lengths = dict(zip(flows, results[0::2]))
+        weights = {uid: float(w) if w else default_weight for uid, w in zip(flows, results[1::2])}
+
+        ahead = rank
+        for uid in flows:
+            if uid != user_id:
+                share = math.ceil((rank + 1) * weights[uid] / weights[user_id])
+                ahead += min(int(lengths[uid] or 0), share)
+        return ahead + 1
+
+    async def count_queued(self) -> int:
+        """Количество задач в очередях пользователей (включая ожидающие повтора)"""
+        flows = await redis_safe(self.redis.zrange(self._flows_key(), 0, -1)) or []
+        if not flows:
+            return 0
+        async with self._pipeline() as pipe:
+            for uid in flows:
+                pipe.zcard(self._queue_key(self._decode(uid)))
+            return sum(int(n or 0) for n in await pipe.execute())
+
+    async def get_user_quota(self, user_id: int) -> Dict[str, float]:
+        """Лимиты пользователя, заданные в Redis (только заданные поля)"""
+        quota_raw = await redis_safe(self.redis.hgetall(self._user_quota_key(user_id)))
+        return {self._decode(k): float(v) for k, v in (quota_raw or {}).items()}
+
+    async def set_user_quota(
+        self,
+        user_id: int,
+        concurrency: Optional[int] = None,
+        rate: Optional[int] = None,
+        weight: Optional[float] = None
+    ) -> None:
+        """
+        Задает лимиты пользователя (действуют во всех процессах бота).
+
+        Args:
+            concurrency: Одновременных загрузок
+            rate: Загрузок в минуту
+            weight: Доля в очереди относительно других пользователей (> 0)
+        """
+        if weight is not None and weight <= 0:
+            raise ValueError("weight должен быть больше 0")
+        quota = {
+            name: value
+            for name, value in (("concurrency", concurrency), ("rate", rate), ("weight", weight))
+            if value is not None
+        }
+        if quota:
+            await redis_safe(self.redis.hset(self._user_quota_key(user_id), mapping=quota))  # type: ignore
+
+    async def reset_user_quota(self, user_id: int) -> None:
+        """Возвращает лимиты пользователя по умолчанию"""
+        await self._delete(self._user_quota_key(user_id))
+
+    async def set_room_quota(self, room_id: str, concurrency: Optional[int]) -> None:
+        """Задает лимит одновременных загрузок комнаты (None — по умолчанию)"""
+        if concurrency is None:
+            await self._delete(self._room_quota_key(room_id))
+        else:
+            await redis_safe(self.redis.hset(self._room_quota_key(room_id), "concurrency", concurrency))  # type: ignore
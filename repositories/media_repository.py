@@ -0,0 +1,29 @@
+"""
+Repository для Telegram file_id аудиофайлов
+"""
+from typing import Optional
+from repositories.base_repository import BaseRepository
+from utils.redis_helper import redis_safe
+
+
+class MediaRepository(BaseRepository):
+    """Репозиторий соответствий file_hash -> Telegram file_id"""
+    
+    def _file_ids_key(self) -> str:
+        return "audio_file_ids"
+    
+    async def get_file_id(self, file_hash: str) -> Optional[str]:
+        """Получает сохраненный file_id для хеша файла"""
+        file_id_raw = await redis_safe(self.redis.hget(self._file_ids_key(), file_hash))
+        if not file_id_raw:
+            return None
+        return self._decode(file_id_raw)
+    
+    async def set_file_id(self, file_hash: str, file_id: str) -> bool:
+        """Сохраняет file_id для хеша файла"""
+        await redis_safe(self.redis.hset(self._file_ids_key(), file_hash, file_id))
+        return True
+    
+    async def delete_file_id(self, file_hash: str) -> bool:
+        """Удаляет file_id (например, если Telegram его больше не принимает)"""
+        return bool(await redis_safe(self.redis.hdel(self._file_ids_key(), file_hash)))
@@ -1,16 +1,40 @@
 """
 Repository для работы с модерацией
+
+Очередь модерации комнаты — ZSET room:{room_id}:moderation_queue
+(token -> время добавления): количество треков — ZCARD, страница —
+ZRANGE по рангу, порядок поддерживает Redis. Старые очереди-списки
+переводит migrate_moderation_queue.py.
+
+Изменения безопасны при нескольких процессах бота: токен добавляется
+в очередь ZADD NX, а трек, который одновременно обрабатывают два админа,
+достается первому — второй получает 'missing'.
+
+Переходы трека (одобрение, отклонение, возврат из отклоненных) — по
+одному Lua-скрипту (repositories/scripts.py): проверка дубликата по
+индексу by_file, запись в плейлист, очередь и статус трека пользователя
+меняются атомарно за один round trip.
 """
-from typing import Optional, List, Dict, Any
+import json
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 from repositories.base_repository import BaseRepository
+from repositories.track_repository import TrackRepository
+from repositories.scripts import PUSH_UNIQUE_LUA, APPROVE_LUA, REJECT_LUA, RESTORE_LUA
 from utils.timezone import iso_now, now_tyumen, parse_iso
 from utils.redis_helper import redis_safe
 
+SELECTION_TTL = 3600  # секунд хранится выбор треков на экране пакетной модерации
+
 
 class ModerationRepository(BaseRepository):
     """Репозиторий для работы с модерацией"""
     
+    def __init__(self):
+        super().__init__()
+        # Ключи плейлиста для скриптов одобрения/возврата
+        self.track_repo = TrackRepository()
+    
     def _moderation_queue_key(self, room_id: str) -> str:
         return f"room:{room_id}:moderation_queue"
     
@@ -23,178 +47,298 @@ class ModerationRepository(BaseRepository):
     def _rejected_track_key(self, room_id: str, token: str) -> str:
         return f"rejected_tracks:{room_id}:{token}"
     
+    def _user_track_key(self, user_id: Any, room_id: str, token: str) -> str:
+        return f"user_track:{user_id}:{room_id}:{token}"
+    
+    def _selection_key(self, room_id: str, admin_id: int) -> str:
+        return f"mod_selection:{room_id}:{admin_id}"
+    
+    def _pending_index_key(self, room_id: str) -> str:
+        # Индекс ведет TrackRepository при сохранении треков пользователей
+        return f"room:{room_id}:pending_user_tracks"
+    
+    async def _pending_index(self, room_id: str) -> Dict[str, str]:
+        """Индекс pending-треков комнаты: {token: user_id}"""
+        index_raw = await redis_safe(self.redis.hgetall(self._pending_index_key(room_id)))
+        return {self._decode(k): self._decode(v) for k, v in (index_raw or {}).items()}
+    
+    @staticmethod
+    def _queue_score(track_data: Dict[str, Any]) -> float:
+        """Позиция трека в очереди — время добавления"""
+        try:
+            return parse_iso(track_data.get("added_at")).timestamp()
+        except Exception:
+            return now_tyumen().timestamp()
+    
     async def add_to_moderation_queue(self, room_id: str, token: str, track_data: Dict[str, Any]) -> bool:
-        """Добавляет трек в очередь модерации"""
+        """Добавляет трек в очередь модерации (повторное добавление токена не дублирует его)"""
         if "status" not in track_data:
             track_data["status"] = "pending"
         if "added_at" not in track_data:
             track_data["added_at"] = iso_now()
+        if "title_key" not in track_data:
+            # Ключ индекса by_title (Lua не приводит к нижнему регистру кириллицу)
+            track_data["title_key"] = (track_data.get("title") or "").lower()
         
-        # Сохраняем трек
+        # Сохраняем трек и добавляем в очередь одной транзакцией
         key = self._moderation_track_key(room_id, token)
-        result = await self._set(key, track_data, ex=86400)  # 24 часа
-        
-        # Добавляем в очередь
-        if result:
-            await redis_safe(self.redis.rpush(self._moderation_queue_key(room_id), token))
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.set(key, json.dumps(track_data, ensure_ascii=False), ex=86400)  # 24 часа
+            pipe.zadd(self._moderation_queue_key(room_id), {token: self._queue_score(track_data)}, nx=True)
+            results = await pipe.execute()
         
-        return result
+        return bool(results[0])
     
     async def get_moderation_track(self, room_id: str, token: str) -> Optional[Dict[str, Any]]:
         """Получает трек из очереди модерации"""
         key = self._moderation_track_key(room_id, token)
         return await self._get(key)
     
+    async def count_moderation_queue(self, room_id: str) -> int:
+        """Количество треков в очереди модерации (ZCARD)"""
+        return await redis_safe(self.redis.zcard(self._moderation_queue_key(room_id))) or 0
+    
+    async def count_pending_by_user(self, room_id: str, user_id: Any) -> int:
+        """
+        Количество треков пользователя в очереди модерации комнаты: токены
+        из множества треков пользователя, которые есть в очереди (ZMSCORE).
+        Токены с истекшим треком модерации не учитываются — их уже нет в очереди.
+        """
+        tokens_raw = await redis_safe(self.redis.smembers(self.track_repo._user_tracks_set_key(user_id, room_id)))
+        if not tokens_raw:
+            return 0
+        scores = await redis_safe(self.redis.zmscore(self._moderation_queue_key(room_id), list(tokens_raw)))
+        return sum(1 for score in (scores or []) if score is not None)
+    
+    async def _queue_tracks(self, room_id: str, start: int = 0, end: int = -1) -> List[Dict[str, Any]]:
+        """
+        Треки очереди в диапазоне рангов (включительно), с полем token.
+        Токены, данные которых истекли, удаляются из очереди.
+        """
+        tokens_raw = await redis_safe(self.redis.zrange(self._moderation_queue_key(room_id), start, end))
+        tokens = [self._decode(t) for t in (tokens_raw or [])]
+        tracks = await self._mget([self._moderation_track_key(room_id, token) for token in tokens])
+        
+        result = []
+        expired = []
+        for token, track in zip(tokens, tracks):
+            if not track:
+                expired.append(token)
+                continue
+            track["token"] = token
+            result.append(track)
+        if expired:
+            await redis_safe(self.redis.zrem(self._moderation_queue_key(room_id), *expired))
+        return result
+    
+    async def get_moderation_page(self, room_id: str, offset: int = 0, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Страница очереди модерации (старые первыми): ZRANGE + MGET только
+        для limit треков. В каждом треке есть token.
+        """
+        if limit <= 0:
+            return []
+        return await self._queue_tracks(room_id, offset, offset + limit - 1)
+    
     async def get_pending_tracks(self, room_id: str) -> List[Dict[str, Any]]:
-        """Получает список треков со статусом pending"""
-        queue_tokens = await redis_safe(self.redis.lrange(self._moderation_queue_key(room_id), 0, -1))
-        tokens = [
-            t.decode() if isinstance(t, bytes) else str(t)
-            for t in (queue_tokens or [])
+        """
+        Получает все треки очереди со статусом pending (старые первыми).
+        
+        Читает всю очередь — для экранов используйте count_moderation_queue
+        и get_moderation_page. Потерянные треки возвращает в очередь
+        restore_all_pending_from_user_tracks.
+        """
+        tracks = await self._queue_tracks(room_id)
+        return [t for t in tracks if t.get("status", "pending") == "pending"]
+    
+    def _transition_args(self, token: str, admin_id: int) -> List[Any]:
+        return [token, admin_id, iso_now()]
+    
+    def _approve_params(self, room_id: str, token: str, admin_id: int) -> Tuple[List[str], List[Any]]:
+        keys = self.track_repo._playlist_keys(room_id) + [
+            self._moderation_track_key(room_id, token),
+            self._moderation_queue_key(room_id),
+            self._pending_index_key(room_id),
+        ]
+        args = self._transition_args(token, admin_id) + [self.track_repo._track_data_key(room_id, ""), room_id]
+        return keys, args
+    
+    def _approve_result(self, result: List[Any]) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+        status = self._decode(result[0])
+        if status not in ("added", "exists"):
+            return status, None, None
+        return status, self._decode(result[1]), self._loads(result[2])
+    
+    def _reject_params(self, room_id: str, token: str, admin_id: int) -> Tuple[List[str], List[Any]]:
+        keys = [
+            self._moderation_track_key(room_id, token),
+            self._moderation_queue_key(room_id),
+            self._rejected_track_key(room_id, token),
+            self._rejected_tracks_key(room_id),
+            self._pending_index_key(room_id),
         ]
+        return keys, self._transition_args(token, admin_id) + [room_id]
+    
+    def _reject_result(self, result: List[Any]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        status = self._decode(result[0])
+        if status != "rejected":
+            return status, None
+        return status, self._loads(result[1])
+    
+    async def approve(
+        self,
+        room_id: str,
+        token: str,
+        admin_id: int
+    ) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Одобряет трек одним Lua-скриптом: проверка дубликата по файлу,
+        добавление в плейлист, удаление из очереди, статус трека пользователя.
         
-        now = now_tyumen()
-        pending_tracks = []
-        found_tokens = set()
+        Returns:
+            (результат, track_id, данные трека из модерации):
+            "added" — трек добавлен; "exists" — трек с этим файлом уже
+            в плейлисте (track_id существующего, pending-треки пользователя
+            с этим файлом одобрены); "missing" — трека нет в очереди
+        """
+        keys, args = self._approve_params(room_id, token, admin_id)
+        return self._approve_result(await redis_safe(self._script(APPROVE_LUA)(keys=keys, args=args)))
+    
+    async def approve_many(
+        self,
+        room_id: str,
+        tokens: List[str],
+        admin_id: int
+    ) -> List[Tuple[str, Optional[str], Optional[Dict[str, Any]]]]:
+        """
+        Одобряет несколько треков одной транзакцией MULTI/EXEC
+        (скрипт одобрения на каждый токен, один round trip).
         
-        # Обрабатываем треки из очереди
-        for token in tokens:
-            track = await self.get_moderation_track(room_id, token)
-            if not track:
-                continue
-            
-            status = track.get("status", "pending")
-            
-            # Если трек в обработке, проверяем время (5 минут)
-            if status == "in_progress":
-                moderated_at_str = track.get("moderated_at")
-                if moderated_at_str:
-                    try:
-                        moderated_at = parse_iso(moderated_at_str)
-                        if (now - moderated_at).total_seconds() > 300:
-                            # Возвращаем в pending
-                            track["status"] = "pending"
-                            track["moderated_by"] = None
-                            track["moderated_at"] = None
-                            await self._set(self._moderation_track_key(room_id, token), track, ex=86400)
-                            status = "pending"
-                    except Exception:
-                        track["status"] = "pending"
-                        track["moderated_by"] = None
-                        track["moderated_at"] = None
-                        await self._set(self._moderation_track_key(room_id, token), track, ex=86400)
-                        status = "pending"
-            
-            if status == "pending":
-                track["token"] = token
-                pending_tracks.append(track)
-                found_tokens.add(token)
+        Returns:
+            Результаты в порядке tokens (как у approve)
+        """
+        if not tokens:
+            return []
+        script = self._script(APPROVE_LUA)
+        async with self._pipeline(transaction=True) as pipe:
+            for token in tokens:
+                keys, args = self._approve_params(room_id, token, admin_id)
+                await script(keys=keys, args=args, client=pipe)
+            results = await pipe.execute()
+        return [self._approve_result(result) for result in results]
+    
+    async def reject(self, room_id: str, token: str, admin_id: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Отклоняет трек одним Lua-скриптом: перенос в отклоненные, удаление
+        из очереди, статус трека пользователя.
         
-        # Восстанавливаем треки из user_tracks, которые не в очереди
-        # Ищем все user_track ключи для этой комнаты
-        pattern = f"user_track:*:{room_id}:*"
-        try:
-            # Используем SCAN вместо KEYS для больших баз данных
-            all_keys = []
-            cursor = 0
-            while True:
-                cursor, keys = await redis_safe(self.redis.scan(cursor, match=pattern, count=100))
-                all_keys.extend(keys)
-                if cursor == 0:
-                    break
-            
-            restored_count = 0
-            
-            for key_bytes in all_keys:
-                key = key_bytes.decode() if isinstance(key_bytes, bytes) else str(key_bytes)
-                parts = key.split(":")
-                if len(parts) >= 4:
-                    user_id = parts[1]
-                    token = parts[3]
-                    
-                    # Пропускаем, если уже в очереди
-                    if token in found_tokens:
-                        continue
-                    
-                    # Получаем трек пользователя
-                    track_data = await self._get(key)
-                    if not track_data:
-                        continue
-                    
-                    # Проверяем статус
-                    status = track_data.get("status", "approved")
-                    if status == "pending":
-                        # Восстанавливаем в очередь модерации
-                        moderation_track = {
-                            "title": track_data.get("title"),
-                            "file": track_data.get("file"),
-                            "added_by": track_data.get("added_by"),
-                            "user_id": int(user_id) if user_id.isdigit() else None,
-                            "token": token,
-                            "status": "pending",
-                            "anon": track_data.get("anon", False),
-                            "added_at": track_data.get("added_at")
-                        }
-                        
-                        # Сохраняем в очередь модерации
-                        mod_key = self._moderation_track_key(room_id, token)
-                        await self._set(mod_key, moderation_track, ex=86400)
-                        
-                        # Добавляем в очередь, если еще нет
-                        queue_key = self._moderation_queue_key(room_id)
-                        existing_tokens = await redis_safe(self.redis.lrange(queue_key, 0, -1))
-                        existing = [t.decode() if isinstance(t, bytes) else str(t) for t in (existing_tokens or [])]
-                        if token not in existing:
-                            await redis_safe(self.redis.rpush(queue_key, token))
-                        
-                        moderation_track["token"] = token
-                        pending_tracks.append(moderation_track)
-                        found_tokens.add(token)
-                        restored_count += 1
-            
-            if restored_count > 0:
-                print(f"✅ Восстановлено {restored_count} треков в очередь модерации для комнаты {room_id}")
-        except Exception as e:
-            print(f"⚠️ Ошибка при восстановлении треков из user_tracks: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        # Сортируем по дате добавления (старые первыми)
-        pending_tracks.sort(key=lambda x: x.get("added_at", ""))
-        
-        return pending_tracks
-    
-    async def set_track_in_progress(self, room_id: str, token: str, admin_id: int) -> bool:
-        """Устанавливает статус трека как 'в обработке'"""
-        track = await self.get_moderation_track(room_id, token)
-        if not track:
-            return False
+        Returns:
+            (результат, данные трека): "rejected" | "missing"
+        """
+        keys, args = self._reject_params(room_id, token, admin_id)
+        return self._reject_result(await redis_safe(self._script(REJECT_LUA)(keys=keys, args=args)))
+    
+    async def reject_many(
+        self,
+        room_id: str,
+        tokens: List[str],
+        admin_id: int
+    ) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        """Отклоняет несколько треков одной транзакцией MULTI/EXEC (результаты как у reject)"""
+        if not tokens:
+            return []
+        script = self._script(REJECT_LUA)
+        async with self._pipeline(transaction=True) as pipe:
+            for token in tokens:
+                keys, args = self._reject_params(room_id, token, admin_id)
+                await script(keys=keys, args=args, client=pipe)
+            results = await pipe.execute()
+        return [self._reject_result(result) for result in results]
+    
+    async def restore_rejected(
+        self,
+        room_id: str,
+        token: str
+    ) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Возвращает отклоненный трек в плейлист одним Lua-скриптом.
         
-        track["status"] = "in_progress"
-        track["moderated_by"] = admin_id
-        track["moderated_at"] = iso_now()
+        Returns:
+            (результат, track_id, данные трека): "added" | "exists"
+            (трек с этим файлом уже в плейлисте) | "missing"
+        """
+        keys = self.track_repo._playlist_keys(room_id) + [
+            self._rejected_track_key(room_id, token),
+            self._rejected_tracks_key(room_id),
+            self._pending_index_key(room_id),
+        ]
+        args = [token, iso_now(), self.track_repo._track_data_key(room_id, ""), room_id]
+        result = await redis_safe(self._script(RESTORE_LUA)(keys=keys, args=args))
+        status = self._decode(result[0])
+        if status == "missing":
+            return status, None, None
+        if status == "exists":
+            return status, self._decode(result[1]), None
+        return status, self._decode(result[1]), self._loads(result[2])
+    
+    async def get_selection(self, room_id: str, admin_id: int) -> List[str]:
+        """Токены треков, выбранных админом на экране пакетной модерации"""
+        return await self._set_members(self._selection_key(room_id, admin_id))
+    
+    async def toggle_selection(self, room_id: str, admin_id: int, token: str) -> bool:
+        """
+        Выбирает трек или снимает выбор.
         
-        key = self._moderation_track_key(room_id, token)
-        return await self._set(key, track, ex=86400)
+        Returns:
+            True, если трек теперь выбран
+        """
+        key = self._selection_key(room_id, admin_id)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.srem(key, token)
+            pipe.expire(key, SELECTION_TTL)
+            removed, _ = await pipe.execute()
+        if removed:
+            return False
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.sadd(key, token)
+            pipe.expire(key, SELECTION_TTL)
+            await pipe.execute()
+        return True
+    
+    async def add_to_selection(self, room_id: str, admin_id: int, tokens: List[str]) -> None:
+        """Добавляет треки в выбор админа"""
+        if not tokens:
+            return
+        key = self._selection_key(room_id, admin_id)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.sadd(key, *tokens)
+            pipe.expire(key, SELECTION_TTL)
+            await pipe.execute()
+    
+    async def clear_selection(self, room_id: str, admin_id: int) -> None:
+        """Сбрасывает выбор админа"""
+        await self._delete(self._selection_key(room_id, admin_id))
     
     async def remove_from_moderation_queue(self, room_id: str, token: str) -> bool:
         """Удаляет трек из очереди модерации"""
-        # Удаляем из списка
-        await redis_safe(self.redis.lrem(self._moderation_queue_key(room_id), 1, token))
-        # Удаляем данные
+        # Удаляем из списка и удаляем данные одной транзакцией
         key = self._moderation_track_key(room_id, token)
-        return await self._delete(key)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.zrem(self._moderation_queue_key(room_id), token)
+            pipe.delete(key)
+            results = await pipe.execute()
+        return bool(results[1])
     
     async def add_to_rejected(self, room_id: str, token: str, track_data: Dict[str, Any]) -> bool:
         """Добавляет трек в список отклоненных"""
         track_data["moderated_at"] = iso_now()
         key = self._rejected_track_key(room_id, token)
-        result = await self._set(key, track_data, ex=2592000)  # 30 дней
-        
-        if result:
-            await redis_safe(self.redis.rpush(self._rejected_tracks_key(room_id), token))
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.set(key, json.dumps(track_data, ensure_ascii=False), ex=2592000)  # 30 дней
+            await self._script(PUSH_UNIQUE_LUA)(keys=[self._rejected_tracks_key(room_id)], args=[token], client=pipe)
+            results = await pipe.execute()
         
-        return result
+        return bool(results[0])
     
     async def get_rejected_track(self, room_id: str, token: str) -> Optional[Dict[str, Any]]:
         """Получает отклоненный трек"""
@@ -203,15 +347,11 @@ class ModerationRepository(BaseRepository):
     
     async def get_rejected_tracks(self, room_id: str) -> List[Dict[str, Any]]:
         """Получает все отклоненные треки"""
-        tokens_raw = await redis_safe(self.redis.lrange(self._rejected_tracks_key(room_id), 0, -1))
-        tokens = [
-            t.decode() if isinstance(t, bytes) else str(t)
-            for t in (tokens_raw or [])
-        ]
+        tokens = await self._list_tokens(self._rejected_tracks_key(room_id))
+        rejected = await self._mget([self._rejected_track_key(room_id, token) for token in tokens])
         
         tracks = []
-        for token in tokens:
-            track = await self.get_rejected_track(room_id, token)
+        for token, track in zip(tokens, rejected):
             if track:
                 track["token"] = token
                 tracks.append(track)
@@ -220,92 +360,193 @@ class ModerationRepository(BaseRepository):
     
     async def remove_from_rejected(self, room_id: str, token: str) -> bool:
         """Удаляет трек из списка отклоненных"""
-        await redis_safe(self.redis.lrem(self._rejected_tracks_key(room_id), 1, token))
         key = self._rejected_track_key(room_id, token)
-        return await self._delete(key)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.lrem(self._rejected_tracks_key(room_id), 1, token)
+            pipe.delete(key)
+            results = await pipe.execute()
+        return bool(results[1])
     
     async def restore_all_pending_from_user_tracks(self, room_id: str = None) -> int:
         """
-        Восстанавливает все треки со статусом pending из user_tracks в очередь модерации.
-        Если room_id не указан, проверяет все комнаты.
+        Восстанавливает треки со статусом pending из user_tracks в очередь модерации.
+        
+        Для комнаты работает по индексу room:{room_id}:pending_user_tracks
+        (его ведет TrackRepository) без SCAN по всей базе; устаревшие записи
+        индекса удаляются. Без room_id — офлайн-сверка: SCAN всех user_track,
+        заполнение индексов и восстановление очередей всех комнат
+        (см. restore_moderation_tracks.py).
         
         Returns:
             Количество восстановленных треков
         """
-        import json
+        if room_id is None:
+            return await self._reconcile_all_pending()
         
-        restored_count = 0
+        index = await self._pending_index(room_id)
+        if not index:
+            return 0
+        
+        tokens = list(index.keys())
+        user_keys = [self._user_track_key(index[token], room_id, token) for token in tokens]
+        user_tracks = await self._mget(user_keys)
         
-        # Определяем паттерн поиска
-        if room_id:
-            pattern = f"user_track:*:{room_id}:*"
-        else:
-            pattern = "user_track:*"
+        pending = []
+        stale = []
+        for token, track_data in zip(tokens, user_tracks):
+            if track_data and track_data.get("status") == "pending":
+                pending.append((index[token], room_id, token, track_data))
+            else:
+                stale.append(token)
         
-        # Ищем все ключи
+        if stale:
+            await redis_safe(self.redis.hdel(self._pending_index_key(room_id), *stale))
+        
+        return await self._restore_pending(pending)
+    
+    async def _reconcile_all_pending(self) -> int:
+        """Офлайн-сверка: SCAN всех user_track, заполнение индексов pending и очередей"""
         all_keys = []
         cursor = 0
         while True:
-            cursor, keys = await redis_safe(self.redis.scan(cursor, match=pattern, count=100))
-            all_keys.extend(keys)
+            cursor, keys = await redis_safe(self.redis.scan(cursor, match="user_track:*", count=500))
+            all_keys.extend(self._decode(k) for k in keys)
             if cursor == 0:
                 break
         
-        for key_bytes in all_keys:
-            key = key_bytes.decode() if isinstance(key_bytes, bytes) else str(key_bytes)
-            parts = key.split(":")
-            if len(parts) < 4:
-                continue
-            
-            user_id = parts[1]
-            track_room_id = parts[2]
-            token = parts[3]
-            
-            # Если указана комната, проверяем совпадение
-            if room_id and track_room_id != room_id:
-                continue
-            
-            # Получаем трек
-            track_data = await self._get(key)
-            if not track_data:
-                continue
+        keys = [key for key in all_keys if len(key.split(":")) >= 4]
+        pending = []
+        for key, track_data in zip(keys, await self._mget(keys)):
+            if track_data and track_data.get("status") == "pending":
+                _, user_id, track_room_id, token = key.split(":")[:4]
+                pending.append((user_id, track_room_id, token, track_data))
+        
+        if not pending:
+            return 0
+        
+        # Заполняем индексы pending (могли отсутствовать у старых треков)
+        async with self._pipeline() as pipe:
+            for user_id, track_room_id, token, _ in pending:
+                pipe.hset(self._pending_index_key(track_room_id), token, user_id)
+            await pipe.execute()
+        
+        return await self._restore_pending(pending)
+    
+    async def _restore_pending(self, pending: List[tuple]) -> int:
+        """
+        Возвращает в очередь модерации pending-треки, которых там нет.
+        
+        pending — список (user_id, room_id, token, track_data).
+        """
+        if not pending:
+            return 0
+        
+        # Очереди затронутых комнат — по одному запросу на комнату
+        queue_tokens: Dict[str, set] = {}
+        for _, track_room_id, _, _ in pending:
+            if track_room_id not in queue_tokens:
+                tokens_raw = await redis_safe(self.redis.zrange(self._moderation_queue_key(track_room_id), 0, -1))
+                queue_tokens[track_room_id] = {self._decode(t) for t in (tokens_raw or [])}
+        mod_keys = [self._moderation_track_key(track_room_id, token) for _, track_room_id, token, _ in pending]
+        mod_data = await self._mget(mod_keys)
+        
+        restored_count = 0
+        to_save = {}
+        to_queue: Dict[str, Dict[str, float]] = {}
+        for (user_id, track_room_id, token, track_data), mod_key, existing in zip(pending, mod_keys, mod_data):
+            queued = token in queue_tokens[track_room_id]
             
-            # Проверяем статус
-            if track_data.get("status") != "pending":
+            # Уже в очереди и с данными
+            if queued and existing:
                 continue
             
-            # Проверяем, есть ли уже в очереди
-            queue_key = self._moderation_queue_key(track_room_id)
-            queue_tokens_raw = await redis_safe(self.redis.lrange(queue_key, 0, -1))
-            queue_tokens = [t.decode() if isinstance(t, bytes) else str(t) for t in (queue_tokens_raw or [])]
-            
-            if token in queue_tokens:
-                # Проверяем данные
-                mod_key = self._moderation_track_key(track_room_id, token)
-                mod_data = await self._get(mod_key)
-                if mod_data:
-                    continue
-            
             # Восстанавливаем трек
-            moderation_track = {
+            to_save[mod_key] = {
                 "title": track_data.get("title"),
+                "title_key": (track_data.get("title") or "").lower(),
                 "file": track_data.get("file"),
                 "added_by": track_data.get("added_by"),
-                "user_id": int(user_id) if user_id.isdigit() else track_data.get("user_id"),
+                "user_id": int(user_id) if str(user_id).isdigit() else track_data.get("user_id"),
                 "token": token,
                 "status": "pending",
                 "anon": track_data.get("anon", False),
                 "added_at": track_data.get("added_at")
             }
             
-            # Сохраняем данные
-            mod_key = self._moderation_track_key(track_room_id, token)
-            await self._set(mod_key, moderation_track, ex=86400)
-            
             # Добавляем в очередь
-            if token not in queue_tokens:
-                await redis_safe(self.redis.rpush(queue_key, token))
+            if not queued:
+                to_queue.setdefault(track_room_id, {})[token] = self._queue_score(track_data)
+                queue_tokens[track_room_id].add(token)
             
             restored_count += 1
         
-        return restored_count
\ No newline at end of file
+        if to_save:
+            await self._mset(to_save, ex=86400)
+        if to_queue:
+            # ZADD NX: токен, который другой процесс уже вернул в очередь, не сдвигается
+            async with self._pipeline() as pipe:
+                for track_room_id, tokens in to_queue.items():
+                    pipe.zadd(self._moderation_queue_key(track_room_id), tokens, nx=True)
+                await pipe.execute()
+        
+        return restored_count
+    
+    async def migrate_queue_from_list(self, room_id: str, keep_backup: bool = False) -> Optional[int]:
+        """
+        Переводит очередь модерации комнаты со списка токенов на ZSET
+        по времени добавления.
+        
+        Список переименовывается в room:{room_id}:moderation_queue:legacy.
+        
+        Returns:
+            Количество перенесенных токенов или None, если очередь уже
+            на новой схеме (или ее нет)
+        """
+        key = self._moderation_queue_key(room_id)
+        key_type = self._decode(await redis_safe(self.redis.type(key)))
+        if key_type != "list":
+            return None
+        
+        legacy_key = f"{key}:legacy"
+        await redis_safe(self.redis.rename(key, legacy_key))
+        tokens = list(dict.fromkeys(await self._list_tokens(legacy_key)))
+        tracks = await self._mget([self._moderation_track_key(room_id, token) for token in tokens])
+        
+        queue = {token: self._queue_score(track) for token, track in zip(tokens, tracks) if track}
+        async with self._pipeline(transaction=True) as pipe:
+            if queue:
+                pipe.zadd(key, queue, nx=True)
+            if not keep_backup:
+                pipe.delete(legacy_key)
+            await pipe.execute()
+        return len(queue)
+    
+    async def reset_in_progress(self, room_id: str) -> int:
+        """
+        Возвращает в pending треки очереди со статусом in_progress,
+        оставшиеся от старой схемы взятия трека в обработку (сейчас
+        трек одобряется или отклоняется сразу, и этот статус никто
+        не снимает).
+        
+        Returns:
+            Количество возвращенных треков
+        """
+        stale = [t for t in await self._queue_tracks(room_id) if t.get("status") == "in_progress"]
+        if not stale:
+            return 0
+        
+        async with self._pipeline() as pipe:
+            for track in stale:
+                token = track.pop("token")
+                track["status"] = "pending"
+                for field in ("moderated_by", "moderated_at", "moderated_ts"):
+                    track.pop(field, None)
+                # XX: трек, который уже одобрили или отклонили, не воскрешается
+                pipe.set(
+                    self._moderation_track_key(room_id, token),
+                    json.dumps(track, ensure_ascii=False),
+                    keepttl=True,
+                    xx=True
+                )
+            await pipe.execute()
+        return len(stale)
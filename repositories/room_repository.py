@@ -4,6 +4,7 @@ Repository для работы с комнатами
 from typing import Optional, List, Dict, Any
 from repositories.base_repository import BaseRepository
 from utils.redis_helper import redis_safe
+from utils.room_permissions import invalidate_role_cache
 
 
 class RoomRepository(BaseRepository):
@@ -45,6 +46,16 @@ class RoomRepository(BaseRepository):
             return name_raw.decode()
         return str(name_raw)
     
+    async def get_room_names(self, room_ids: List[str]) -> Dict[str, Optional[str]]:
+        """Получает названия нескольких комнат одним MGET"""
+        if not room_ids:
+            return {}
+        names_raw = await redis_safe(self.redis.mget([self._room_name_key(rid) for rid in room_ids]))
+        return {
+            rid: (self._decode(name_raw) if name_raw else None)
+            for rid, name_raw in zip(room_ids, names_raw or [])
+        }
+    
     async def set_room_name(self, room_id: str, name: str) -> bool:
         """Устанавливает название комнаты"""
         return await redis_safe(self.redis.set(self._room_name_key(room_id), name))
@@ -63,7 +74,9 @@ class RoomRepository(BaseRepository):
     
     async def set_room_owner(self, room_id: str, user_id: int) -> bool:
         """Устанавливает владельца комнаты"""
-        return await redis_safe(self.redis.set(self._room_owner_key(room_id), str(user_id)))
+        result = await redis_safe(self.redis.set(self._room_owner_key(room_id), str(user_id)))
+        invalidate_role_cache(room_id)
+        return result
     
     async def get_room_members(self, room_id: str) -> List[int]:
         """Получает список участников комнаты"""
@@ -72,14 +85,20 @@ class RoomRepository(BaseRepository):
     
     async def add_room_member(self, room_id: str, user_id: int) -> bool:
         """Добавляет участника в комнату"""
-        await self._set_add(self._room_members_key(room_id), str(user_id))
-        await self._set_add(self._user_rooms_key(user_id), room_id)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.sadd(self._room_members_key(room_id), str(user_id))
+            pipe.sadd(self._user_rooms_key(user_id), room_id)
+            await pipe.execute()
+        invalidate_role_cache(room_id, user_id)
         return True
     
     async def remove_room_member(self, room_id: str, user_id: int) -> bool:
         """Удаляет участника из комнаты"""
-        await self._set_remove(self._room_members_key(room_id), str(user_id))
-        await self._set_remove(self._user_rooms_key(user_id), room_id)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.srem(self._room_members_key(room_id), str(user_id))
+            pipe.srem(self._user_rooms_key(user_id), room_id)
+            await pipe.execute()
+        invalidate_role_cache(room_id, user_id)
         return True
     
     async def get_room_admins(self, room_id: str) -> List[int]:
@@ -89,16 +108,22 @@ class RoomRepository(BaseRepository):
     
     async def add_room_admin(self, room_id: str, user_id: int) -> bool:
         """Добавляет админа в комнату"""
-        await self._set_add(self._room_admins_key(room_id), str(user_id))
-        await self._set_add(self._room_members_key(room_id), str(user_id))
-        await self._set_add(self._user_admin_rooms_key(user_id), room_id)
-        await self._set_add(self._user_rooms_key(user_id), room_id)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.sadd(self._room_admins_key(room_id), str(user_id))
+            pipe.sadd(self._room_members_key(room_id), str(user_id))
+            pipe.sadd(self._user_admin_rooms_key(user_id), room_id)
+            pipe.sadd(self._user_rooms_key(user_id), room_id)
+            await pipe.execute()
+        invalidate_role_cache(room_id, user_id)
         return True
     
     async def remove_room_admin(self, room_id: str, user_id: int) -> bool:
         """Удаляет админа из комнаты"""
-        await self._set_remove(self._room_admins_key(room_id), str(user_id))
-        await self._set_remove(self._user_admin_rooms_key(user_id), room_id)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.srem(self._room_admins_key(room_id), str(user_id))
+            pipe.srem(self._user_admin_rooms_key(user_id), room_id)
+            await pipe.execute()
+        invalidate_role_cache(room_id, user_id)
         return True
     
     async def get_room_banned(self, room_id: str) -> List[int]:
@@ -108,14 +133,20 @@ class RoomRepository(BaseRepository):
     
     async def ban_user(self, room_id: str, user_id: int) -> bool:
         """Блокирует пользователя"""
-        await self._set_add(self._room_banned_key(room_id), str(user_id))
-        await self.remove_room_member(room_id, user_id)
-        await self.remove_room_admin(room_id, user_id)
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.sadd(self._room_banned_key(room_id), str(user_id))
+            pipe.srem(self._room_members_key(room_id), str(user_id))
+            pipe.srem(self._user_rooms_key(user_id), room_id)
+            pipe.srem(self._room_admins_key(room_id), str(user_id))
+            pipe.srem(self._user_admin_rooms_key(user_id), room_id)
+            await pipe.execute()
+        invalidate_role_cache(room_id, user_id)
         return True
     
     async def unban_user(self, room_id: str, user_id: int) -> bool:
         """Разблокирует пользователя"""
         await self._set_remove(self._room_banned_key(room_id), str(user_id))
+        invalidate_role_cache(room_id, user_id)
         return True
     
     async def is_moderation_enabled(self, room_id: str) -> bool:
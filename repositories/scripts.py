@@ -0,0 +1,370 @@
+"""
+Lua-скрипты репозиториев
+
+Переходы, которые раньше делались несколькими последовательными
+запросами (проверка дубликата, добавление в плейлист, удаление из
+очереди модерации, статус трека пользователя), выполняются одним
+скриптом на сервере Redis: один round trip, и падение процесса
+посреди операции не оставляет ее выполненной наполовину.
+
+Ключи данных трека и треков пользователя зависят от прочитанных
+данных (track_id, user_id), поэтому строятся внутри скриптов по
+префиксам из ARGV (бот использует один инстанс Redis, без Cluster).
+Форматы ключей — см. TrackRepository и ModerationRepository.
+"""
+
+# Добавляет токен в конец списка, если его там еще нет. Возвращает 1, если добавлен
+PUSH_UNIQUE_LUA = """
+if redis.call('LPOS', KEYS[1], ARGV[1]) then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Общие функции скриптов плейлиста и модерации
+_HELPERS_LUA = """
+local unpack = unpack or table.unpack
+
+local function val(v)
+    if v == cjson.null then return nil end
+    return v
+end
+
+local function id_str(v)
+    if type(v) == 'number' then return string.format('%d', v) end
+    return tostring(v)
+end
+
+local function encode(v)
+    if v == nil then return 'null' end
+    return cjson.encode(v)
+end
+
+-- Статус трека пользователя user_track:{uid}:{room}:{token} (+ индекс pending комнаты)
+local function set_user_track_status(user_key, pending_key, token, status, now_iso)
+    local raw = redis.call('GET', user_key)
+    if not raw then return end
+    local t = cjson.decode(raw)
+    t.status = status
+    t.moderated_at = now_iso
+    redis.call('SET', user_key, cjson.encode(t), 'EX', 604800)
+    if status == 'pending' then return end
+    redis.call('HDEL', pending_key, token)
+end
+
+-- Добавляет трек в конец плейлиста: данные (поля уже в JSON), порядок,
+-- индексы по файлу и названию, счетчик ссылок на канонический файл.
+-- k = {tracks, seq, by_file, by_title, refs, aliases}
+local function insert_track(k, data_prefix, fields, file, title_key)
+    local seq = redis.call('INCR', k[2])
+    local track_id = tostring(seq)
+    redis.call('HSET', data_prefix .. track_id, unpack(fields))
+    redis.call('ZADD', k[1], seq, track_id)
+    if file then
+        redis.call('HSETNX', k[3], file, track_id)
+        local canonical = redis.call('HGET', k[6], file) or file
+        redis.call('HINCRBY', k[5], canonical, 1)
+    end
+    if title_key and title_key ~= '' then
+        redis.call('HSETNX', k[4], title_key, track_id)
+    end
+    return track_id
+end
+
+-- Поля одобренного трека из данных модерации (admin_id — кто одобрил, если известно)
+local function approved_fields(track, now_iso, admin_id)
+    local fields = {
+        'title', encode(val(track.title)),
+        'file', encode(val(track.file)),
+        'added_by', encode(val(track.added_by)),
+        'user_id', encode(val(track.user_id)),
+        'status', '"approved"',
+        'added_at', encode(now_iso),
+        'moderated_at', encode(now_iso),
+    }
+    if admin_id then
+        fields[#fields + 1] = 'moderated_by'
+        fields[#fields + 1] = admin_id
+    end
+    return fields
+end
+
+local function title_key(track)
+    local key = val(track.title_key)
+    if key then return key end
+    -- Треки, поставленные в очередь до появления title_key (string.lower — только латиница)
+    local title = val(track.title)
+    if title then return string.lower(title) end
+    return nil
+end
+"""
+
+# Добавление трека без дубликатов по файлу и названию.
+# KEYS: tracks, seq, by_file, by_title, refs, aliases
+# ARGV: префикс данных трека, file, title_key, затем пары поле/значение (JSON)
+# Возвращает {'added', track_id} | {'exists_file', track_id} | {'exists_title', track_id}
+ADD_TRACK_UNIQUE_LUA = _HELPERS_LUA + """
+local file = ARGV[2] ~= '' and ARGV[2] or nil
+local tkey = ARGV[3] ~= '' and ARGV[3] or nil
+if file then
+    local existing = redis.call('HGET', KEYS[3], file)
+    if existing then return {'exists_file', existing} end
+end
+if tkey then
+    local existing = redis.call('HGET', KEYS[4], tkey)
+    if existing then return {'exists_title', existing} end
+end
+local fields = {}
+for i = 4, #ARGV do fields[#fields + 1] = ARGV[i] end
+return {'added', insert_track(KEYS, ARGV[1], fields, file, tkey)}
+"""
+
+# Одобрение трека из очереди модерации.
+# KEYS: tracks, seq, by_file, by_title, refs, aliases, трек модерации, очередь (ZSET),
+#       индекс pending
+# ARGV: token, admin_id, now_iso, префикс данных трека, room_id
+# Возвращает {'missing'} | {'exists', track_id, data} | {'added', track_id, data}
+APPROVE_LUA = _HELPERS_LUA + """
+local raw = redis.call('GET', KEYS[7])
+if not raw then return {'missing'} end
+local track = cjson.decode(raw)
+
+local token, admin_id, now_iso, room_id = ARGV[1], ARGV[2], ARGV[3], ARGV[5]
+local file = val(track.file)
+local user_id = val(track.user_id)
+redis.call('ZREM', KEYS[8], token)
+redis.call('DEL', KEYS[7])
+
+local existing = file and redis.call('HGET', KEYS[3], file)
+if existing then
+    -- Трек уже в плейлисте: одобряем pending-треки пользователя с этим файлом
+    if user_id then
+        local uid = id_str(user_id)
+        local prefix = 'user_track:' .. uid .. ':' .. room_id .. ':'
+        for _, t in ipairs(redis.call('SMEMBERS', 'user:' .. uid .. ':tracks:' .. room_id)) do
+            local ut_raw = redis.call('GET', prefix .. t)
+            if ut_raw then
+                local ut = cjson.decode(ut_raw)
+                if val(ut.file) == file and ut.status == 'pending' then
+                    set_user_track_status(prefix .. t, KEYS[9], t, 'approved', now_iso)
+                end
+            end
+        end
+    end
+    return {'exists', existing, raw}
+end
+
+local track_id = insert_track(KEYS, ARGV[4], approved_fields(track, now_iso, admin_id), file, title_key(track))
+if user_id then
+    local user_key = 'user_track:' .. id_str(user_id) .. ':' .. room_id .. ':' .. token
+    set_user_track_status(user_key, KEYS[9], token, 'approved', now_iso)
+end
+return {'added', track_id, raw}
+"""
+
+# Отклонение трека из очереди модерации.
+# KEYS: трек модерации, очередь (ZSET), отклоненный трек, список отклоненных,
+#       индекс pending
+# ARGV: token, admin_id, now_iso, room_id
+# Возвращает {'missing'} | {'rejected', data}
+REJECT_LUA = _HELPERS_LUA + """
+local raw = redis.call('GET', KEYS[1])
+if not raw then return {'missing'} end
+local track = cjson.decode(raw)
+
+local token, now_iso, room_id = ARGV[1], ARGV[3], ARGV[4]
+track.moderated_at = now_iso
+track.moderated_by = tonumber(ARGV[2]) or ARGV[2]
+redis.call('SET', KEYS[3], cjson.encode(track), 'EX', 2592000)
+if not redis.call('LPOS', KEYS[4], token) then
+    redis.call('RPUSH', KEYS[4], token)
+end
+redis.call('ZREM', KEYS[2], token)
+redis.call('DEL', KEYS[1])
+
+local user_id = val(track.user_id)
+if user_id then
+    local user_key = 'user_track:' .. id_str(user_id) .. ':' .. room_id .. ':' .. token
+    set_user_track_status(user_key, KEYS[5], token, 'rejected', now_iso)
+end
+return {'rejected', raw}
+"""
+
+# Возврат отклоненного трека в плейлист.
+# KEYS: tracks, seq, by_file, by_title, refs, aliases, отклоненный трек, список отклоненных, индекс pending
+# ARGV: token, now_iso, префикс данных трека, room_id
+# Возвращает {'missing'} | {'exists', track_id} | {'added', track_id, data}
+RESTORE_LUA = _HELPERS_LUA + """
+local raw = redis.call('GET', KEYS[7])
+if not raw then return {'missing'} end
+local track = cjson.decode(raw)
+local file = val(track.file)
+if file then
+    local existing = redis.call('HGET', KEYS[3], file)
+    if existing then return {'exists', existing} end
+end
+
+local token, now_iso, room_id = ARGV[1], ARGV[2], ARGV[4]
+local track_id = insert_track(KEYS, ARGV[3], approved_fields(track, now_iso), file, title_key(track))
+redis.call('LREM', KEYS[8], 1, token)
+redis.call('DEL', KEYS[7])
+
+local user_id = val(track.user_id)
+if user_id then
+    local user_key = 'user_track:' .. id_str(user_id) .. ':' .. room_id .. ':' .. token
+    set_user_track_status(user_key, KEYS[9], token, 'approved', now_iso)
+end
+return {'added', track_id, raw}
+"""
+
+# Общие функции скриптов задач загрузки: справедливая очередь — у каждого
+# пользователя своя очередь задач, пользователи с задачами — в ZSET flows
+# со значением pass (stride scheduling); новый пользователь встает
+# с текущим виртуальным временем (pass последней взятой задачи)
+_JOB_HELPERS_LUA = _HELPERS_LUA + """
+local function job_owner(job)
+    local uid = val(job.user_id)
+    if uid == nil then return '0' end
+    return id_str(uid)
+end
+
+local function join_flow(flows_key, vtime_key, uid)
+    if not redis.call('ZSCORE', flows_key, uid) then
+        redis.call('ZADD', flows_key, redis.call('GET', vtime_key) or 0, uid)
+    end
+end
+"""
+
+# Постановка задачи загрузки с дедупликацией по ключу кэша.
+# KEYS: ключ дедупликации, задача, очередь пользователя (ZSET), получатели задачи (LIST),
+#       пользователи с задачами (ZSET flows), виртуальное время
+# ARGV: job_id, данные задачи (JSON), now_ts, получатель (JSON), префикс ключа задачи, user_id
+# Возвращает {job_id, 1} для новой задачи | {job_id, 0}, если получатель
+# добавлен к активной задаче с тем же ключом
+ENQUEUE_JOB_LUA = _JOB_HELPERS_LUA + """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    local raw = redis.call('GET', ARGV[5] .. existing)
+    if raw then
+        local status = cjson.decode(raw).status
+        if status == 'queued' or status == 'running' then
+            redis.call('RPUSH', ARGV[5] .. existing .. ':deliveries', ARGV[4])
+            return {existing, 0}
+        end
+    end
+end
+redis.call('SET', KEYS[2], ARGV[2])
+redis.call('RPUSH', KEYS[4], ARGV[4])
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+join_flow(KEYS[5], KEYS[6], ARGV[6])
+return {ARGV[1], 1}
+"""
+
+# Взятие задачи загрузки в работу: пользователь с наименьшим pass, у
+# которого есть готовая задача и не исчерпаны лимиты (параллельные
+# загрузки пользователя и комнаты, загрузки пользователя в минуту).
+# После взятия pass пользователя растет на 1 / weight — пользователи
+# получают загрузки по очереди пропорционально весу.
+# Задачи с истекшей арендой (процесс упал или перезапущен посреди
+# загрузки) сначала возвращаются в очереди пользователей.
+# KEYS: flows (ZSET user_id -> pass), задачи в работе (ZSET job_id -> конец аренды),
+#       виртуальное время, общая очередь старого формата (ZSET)
+# ARGV: now_ts, конец аренды, now_iso, префикс ключа задачи, префикс очередей пользователей,
+#       префикс лимитов, лимит пользователя по умолчанию, загрузок в минуту по умолчанию,
+#       вес по умолчанию, лимит комнаты по умолчанию, номер минуты, сколько пользователей проверять
+# Возвращает данные задачи (JSON) или nil
+CLAIM_JOB_LUA = _JOB_HELPERS_LUA + """
+local now_ts, prefix, qprefix, lprefix = tonumber(ARGV[1]), ARGV[4], ARGV[5], ARGV[6]
+
+local function requeue(id)
+    local raw = redis.call('GET', prefix .. id)
+    if not raw then return end
+    local job = cjson.decode(raw)
+    job.status = 'queued'
+    job.updated_at = ARGV[3]
+    redis.call('SET', prefix .. id, cjson.encode(job))
+    local uid = job_owner(job)
+    redis.call('ZADD', qprefix .. uid, now_ts, id)
+    join_flow(KEYS[1], KEYS[3], uid)
+end
+
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now_ts, 'LIMIT', 0, 100)) do
+    redis.call('ZREM', KEYS[2], id)
+    requeue(id)
+end
+-- Задачи, поставленные до появления очередей пользователей
+for _, id in ipairs(redis.call('ZRANGE', KEYS[4], 0, 99)) do
+    redis.call('ZREM', KEYS[4], id)
+    requeue(id)
+end
+
+-- Загрузки в работе по пользователям и комнатам
+local user_running, room_running = {}, {}
+for _, id in ipairs(redis.call('ZRANGE', KEYS[2], 0, -1)) do
+    local raw = redis.call('GET', prefix .. id)
+    if raw then
+        local job = cjson.decode(raw)
+        local uid = job_owner(job)
+        user_running[uid] = (user_running[uid] or 0) + 1
+        local room = val(job.room_id)
+        if room then
+            room = tostring(room)
+            room_running[room] = (room_running[room] or 0) + 1
+        end
+    end
+end
+
+local flows = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[12]) - 1, 'WITHSCORES')
+for i = 1, #flows, 2 do
+    local uid, pass = flows[i], tonumber(flows[i + 1])
+    local queue_key = qprefix .. uid
+    local head = redis.call('ZRANGEBYSCORE', queue_key, '-inf', now_ts, 'LIMIT', 0, 1)[1]
+    if redis.call('ZCARD', queue_key) == 0 then
+        redis.call('ZREM', KEYS[1], uid)
+    elseif head then
+        local quota = redis.call('HMGET', lprefix .. uid, 'concurrency', 'rate', 'weight')
+        local concurrency = tonumber(quota[1]) or tonumber(ARGV[7])
+        local rate = tonumber(quota[2]) or tonumber(ARGV[8])
+        local weight = tonumber(quota[3]) or tonumber(ARGV[9])
+        local rate_key = lprefix .. 'rate:' .. uid .. ':' .. ARGV[11]
+        local raw = redis.call('GET', prefix .. head)
+        if not raw then
+            redis.call('ZREM', queue_key, head)
+        elseif (user_running[uid] or 0) < concurrency
+                and tonumber(redis.call('GET', rate_key) or 0) < rate then
+            local job = cjson.decode(raw)
+            local room = val(job.room_id)
+            local room_ok = true
+            if room then
+                room = tostring(room)
+                local room_cap = tonumber(redis.call('HGET', lprefix .. 'room:' .. room, 'concurrency'))
+                    or tonumber(ARGV[10])
+                room_ok = (room_running[room] or 0) < room_cap
+            end
+            if room_ok then
+                redis.call('ZREM', queue_key, head)
+                redis.call('INCR', rate_key)
+                redis.call('EXPIRE', rate_key, 120)
+                job.status = 'running'
+                job.updated_at = ARGV[3]
+                raw = cjson.encode(job)
+                redis.call('SET', prefix .. head, raw)
+                redis.call('ZADD', KEYS[2], tonumber(ARGV[2]), head)
+
+                -- Пользователь, долго ждавший повтора, не получает загрузок вне очереди
+                pass = math.max(pass, tonumber(redis.call('GET', KEYS[3]) or 0))
+                redis.call('SET', KEYS[3], string.format('%.6f', pass))
+                if redis.call('ZCARD', queue_key) == 0 then
+                    redis.call('ZREM', KEYS[1], uid)
+                else
+                    redis.call('ZADD', KEYS[1], string.format('%.6f', pass + 1 / weight), uid)
+                end
+                return raw
+            end
+        end
+    end
+end
+return nil
+"""
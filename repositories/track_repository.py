@@ -1,41 +1,171 @@
 """
 Repository для работы с треками
+
+Плейлист комнаты хранится так:
+    room:{room_id}:tracks            ZSET  track_id -> порядковый номер (score)
+    room:{room_id}:track:{track_id}  HASH  поля трека (значения в JSON)
+    room:{room_id}:tracks:seq        счетчик для новых track_id
+    room:{room_id}:tracks:by_file    HASH  file_hash -> track_id
+    room:{room_id}:tracks:by_title   HASH  title.lower() -> track_id
+
+Кроме того, в audio_cache:refs (HASH file_hash -> количество треков)
+ведется глобальный счетчик ссылок на файлы: такие файлы не вытесняются
+из аудиокэша (см. utils/audio_cache.py). Ссылки считаются по каноническому
+хешу (алиасы слитых дубликатов — audio_cache:aliases).
+
+Индекс трека в плейлисте (используется в callback_data) — это ранг в ZSET.
+
+Добавление с проверкой дубликатов (add_track_if_absent) — один
+Lua-скрипт (repositories/scripts.py): проверка индексов by_file/by_title
+и запись трека выполняются атомарно за один round trip.
+Изменения, зависящие от прочитанных данных (удаление, обновление,
+статусы треков пользователей), выполняются транзакциями WATCH/MULTI:
+при параллельной записи из другого процесса бота транзакция
+повторяется, счетчики ссылок и индексы не расходятся.
+Старые комнаты со списком JSON в room:{room_id}:tracks переводятся
+на новую схему скриптом migrate_tracks_storage.py.
 """
-from typing import Optional, List, Dict, Any
+import json
+from typing import Optional, List, Dict, Any, Tuple
 from repositories.base_repository import BaseRepository
+from repositories.scripts import ADD_TRACK_UNIQUE_LUA
 from utils.timezone import iso_now
+from utils.redis_helper import redis_safe
 
 
 class TrackRepository(BaseRepository):
     """Репозиторий для работы с треками"""
     
     def _track_key(self, room_id: str, index: int = None) -> str:
-        """Генерирует ключ для трека"""
-        if index is not None:
-            return f"room:{room_id}:tracks"
+        """Генерирует ключ упорядоченного множества треков комнаты"""
         return f"room:{room_id}:tracks"
     
-    def _user_track_key(self, user_id: int, room_id: str, token: str) -> str:
-        """Генерирует ключ для трека пользователя"""
-        return f"user_track:{user_id}:{room_id}:{token}"
+    def _track_data_key(self, room_id: str, track_id: str) -> str:
+        """Генерирует ключ хеша с данными трека"""
+        return f"room:{room_id}:track:{track_id}"
     
-    def _user_tracks_set_key(self, user_id: int, room_id: str) -> str:
-        """Генерирует ключ для множества треков пользователя"""
-        return f"user:{user_id}:tracks:{room_id}"
+    def _track_seq_key(self, room_id: str) -> str:
+        return f"room:{room_id}:tracks:seq"
+    
+    def _track_file_index_key(self, room_id: str) -> str:
+        return f"room:{room_id}:tracks:by_file"
+    
+    def _track_title_index_key(self, room_id: str) -> str:
+        return f"room:{room_id}:tracks:by_title"
+    
+    def _file_refs_key(self) -> str:
+        # Счетчики ссылок читает AudioCacheRepository
+        return "audio_cache:refs"
+    
+    def _file_aliases_key(self) -> str:
+        return "audio_cache:aliases"
+    
+    def _playlist_keys(self, room_id: str) -> List[str]:
+        """Ключи плейлиста для Lua-скриптов (порядок — см. repositories/scripts.py)"""
+        return [
+            self._track_key(room_id),
+            self._track_seq_key(room_id),
+            self._track_file_index_key(room_id),
+            self._track_title_index_key(room_id),
+            self._file_refs_key(),
+            self._file_aliases_key(),
+        ]
+    
+    async def _canonical_files(self, file_hashes: List[str]) -> Dict[str, str]:
+        """Канонические хеши файлов с учетом алиасов: {file_hash: canonical}"""
+        file_hashes = [h for h in dict.fromkeys(file_hashes) if h]
+        if not file_hashes:
+            return {}
+        aliases = await redis_safe(self.redis.hmget(self._file_aliases_key(), file_hashes))
+        return {
+            h: (self._decode(alias) if alias else h)
+            for h, alias in zip(file_hashes, aliases or [None] * len(file_hashes))
+        }
+    
+    @staticmethod
+    def _encode_track(track_data: Dict[str, Any]) -> Dict[str, str]:
+        """Кодирует поля трека для HSET (каждое значение — JSON)"""
+        return {
+            field: json.dumps(value, ensure_ascii=False)
+            for field, value in track_data.items()
+            if field != "id"
+        }
+    
+    def _decode_track(self, track_id: str, fields_raw: Dict[Any, Any]) -> Optional[Dict[str, Any]]:
+        """Декодирует результат HGETALL в словарь трека"""
+        if not fields_raw:
+            return None
+        track: Dict[str, Any] = {}
+        for field, value in fields_raw.items():
+            value = self._decode(value)
+            try:
+                track[self._decode(field)] = json.loads(value)
+            except Exception:
+                track[self._decode(field)] = value
+        track["id"] = track_id
+        return track
+    
+    async def _get_tracks_by_ids(self, room_id: str, track_ids: List[str]) -> List[Dict[str, Any]]:
+        """Получает данные нескольких треков одним пайплайном HGETALL"""
+        if not track_ids:
+            return []
+        async with self._pipeline() as pipe:
+            for track_id in track_ids:
+                pipe.hgetall(self._track_data_key(room_id, track_id))
+            results = await pipe.execute()
+        tracks = []
+        for track_id, fields_raw in zip(track_ids, results):
+            track = self._decode_track(track_id, fields_raw)
+            if track:
+                tracks.append(track)
+        return tracks
+    
+    async def get_track_id(self, room_id: str, index: int) -> Optional[str]:
+        """Получает track_id по индексу в плейлисте (O(log n))"""
+        if index < 0:
+            return None
+        ids_raw = await redis_safe(self.redis.zrange(self._track_key(room_id), index, index))
+        if not ids_raw:
+            return None
+        return self._decode(ids_raw[0])
+    
+    async def get_track_index(self, room_id: str, track_id: str) -> Optional[int]:
+        """Получает индекс трека в плейлисте по track_id (O(log n))"""
+        return await redis_safe(self.redis.zrank(self._track_key(room_id), track_id))
+    
+    async def get_track_by_id(self, room_id: str, track_id: str) -> Optional[Dict[str, Any]]:
+        """Получает трек по track_id (O(1))"""
+        fields_raw = await redis_safe(self.redis.hgetall(self._track_data_key(room_id, track_id)))
+        return self._decode_track(track_id, fields_raw)
     
     async def get_track(self, room_id: str, index: int) -> Optional[Dict[str, Any]]:
         """Получает трек по индексу"""
-        tracks = await self._list_get(self._track_key(room_id))
-        if 0 <= index < len(tracks):
-            return tracks[index]
-        return None
+        track_id = await self.get_track_id(room_id, index)
+        if track_id is None:
+            return None
+        return await self.get_track_by_id(room_id, track_id)
+    
+    async def get_tracks_range(self, room_id: str, start: int = 0, end: int = -1) -> List[Dict[str, Any]]:
+        """Получает треки комнаты в диапазоне индексов (включительно)"""
+        ids_raw = await redis_safe(self.redis.zrange(self._track_key(room_id), start, end))
+        track_ids = [self._decode(t) for t in (ids_raw or [])]
+        return await self._get_tracks_by_ids(room_id, track_ids)
     
     async def get_all_tracks(self, room_id: str) -> List[Dict[str, Any]]:
-        """Получает все треки комнаты"""
-        return await self._list_get(self._track_key(room_id))
+        """Получает все треки комнаты (ZRANGE + пайплайн HGETALL)"""
+        return await self.get_tracks_range(room_id)
+    
+    async def count_tracks(self, room_id: str) -> int:
+        """Количество треков в комнате"""
+        return await redis_safe(self.redis.zcard(self._track_key(room_id))) or 0
     
     async def add_track(self, room_id: str, track_data: Dict[str, Any]) -> int:
-        """Добавляет трек в комнату"""
+        """
+        Добавляет трек в комнату
+        
+        Returns:
+            Количество треков в комнате после добавления
+        """
         # Добавляем даты если их нет
         if "added_at" not in track_data:
             track_data["added_at"] = iso_now()
@@ -44,57 +174,293 @@ class TrackRepository(BaseRepository):
         if "status" not in track_data:
             track_data["status"] = "approved"
         
-        return await self._list_add(self._track_key(room_id), track_data)
+        return await self._insert_track(room_id, track_data)
+    
+    async def add_track_if_absent(self, room_id: str, track_data: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Добавляет трек, если в плейлисте нет трека с тем же файлом или
+        названием (проверка и запись — один Lua-скрипт).
+        
+        Returns:
+            (результат, track_id): "added" — трек добавлен с track_id,
+            "exists_file" / "exists_title" — track_id уже существующего трека
+        """
+        if "added_at" not in track_data:
+            track_data["added_at"] = iso_now()
+        if "moderated_at" not in track_data:
+            track_data["moderated_at"] = iso_now()
+        if "status" not in track_data:
+            track_data["status"] = "approved"
+        
+        args = [
+            self._track_data_key(room_id, ""),
+            track_data.get("file") or "",
+            (track_data.get("title") or "").lower(),
+        ]
+        for field, value in self._encode_track(track_data).items():
+            args.extend((field, value))
+        result = await redis_safe(self._script(ADD_TRACK_UNIQUE_LUA)(keys=self._playlist_keys(room_id), args=args))
+        status, track_id = self._decode(result[0]), self._decode(result[1])
+        if status == "added":
+            track_data["id"] = track_id
+        return status, track_id
+    
+    async def _insert_track(self, room_id: str, track_data: Dict[str, Any]) -> int:
+        """Записывает трек в конец плейлиста и обновляет индексы"""
+        seq = await redis_safe(self.redis.incr(self._track_seq_key(room_id)))
+        track_id = str(seq)
+        canonical = await self._canonical_files([track_data.get("file")])
+        
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.hset(self._track_data_key(room_id, track_id), mapping=self._encode_track(track_data))
+            pipe.zadd(self._track_key(room_id), {track_id: seq})
+            if track_data.get("file"):
+                pipe.hsetnx(self._track_file_index_key(room_id), track_data["file"], track_id)
+                pipe.hincrby(self._file_refs_key(), canonical[track_data["file"]], 1)
+            if track_data.get("title"):
+                pipe.hsetnx(self._track_title_index_key(room_id), track_data["title"].lower(), track_id)
+            pipe.zcard(self._track_key(room_id))
+            results = await pipe.execute()
+        
+        track_data["id"] = track_id
+        return results[-1]
+    
+    async def remove_track_by_id(self, room_id: str, track_id: str) -> bool:
+        """
+        Удаляет трек из комнаты по track_id.
+        
+        При одновременном удалении одного трека из нескольких процессов
+        трек удаляется (и ссылка на файл снимается) ровно один раз.
+        """
+        data_key = self._track_data_key(room_id, track_id)
+        
+        async def _remove(pipe) -> bool:
+            track = self._decode_track(track_id, await pipe.hgetall(data_key))
+            if not track:
+                return False
+            
+            # Индексы чистим, только если они указывают на этот трек
+            file_hash = track.get("file")
+            title_lower = (track.get("title") or "").lower()
+            indexed_file_id = await pipe.hget(self._track_file_index_key(room_id), file_hash) if file_hash else None
+            indexed_title_id = await pipe.hget(self._track_title_index_key(room_id), title_lower) if title_lower else None
+            canonical = await self._canonical_files([file_hash])
+            
+            pipe.multi()
+            pipe.zrem(self._track_key(room_id), track_id)
+            pipe.delete(data_key)
+            if file_hash and indexed_file_id and self._decode(indexed_file_id) == track_id:
+                pipe.hdel(self._track_file_index_key(room_id), file_hash)
+            if file_hash:
+                pipe.hincrby(self._file_refs_key(), canonical[file_hash], -1)
+            if title_lower and indexed_title_id and self._decode(indexed_title_id) == track_id:
+                pipe.hdel(self._track_title_index_key(room_id), title_lower)
+            return True
+        
+        return await self._transaction(_remove, data_key)
     
     async def remove_track(self, room_id: str, index: int) -> bool:
         """Удаляет трек из комнаты"""
-        # Помечаем как удаленный
-        await self._list_set(self._track_key(room_id), index, {"__deleted__": True})
-        # Удаляем из списка
-        await self._list_remove(self._track_key(room_id), {"__deleted__": True})
-        return True
+        track_id = await self.get_track_id(room_id, index)
+        if track_id is None:
+            return False
+        return await self.remove_track_by_id(room_id, track_id)
+    
+    async def clear_tracks(self, room_id: str) -> int:
+        """
+        Удаляет все треки комнаты
+        
+        Returns:
+            Количество удаленных треков
+        """
+        tracks_key = self._track_key(room_id)
+        
+        async def _clear(pipe) -> int:
+            ids_raw = await pipe.zrange(tracks_key, 0, -1)
+            track_ids = [self._decode(t) for t in (ids_raw or [])]
+            # Данные треков читаем одним пайплайном (WATCH на ZSET защищает от добавлений)
+            tracks = await self._get_tracks_by_ids(room_id, track_ids)
+            files = [t["file"] for t in tracks if t.get("file")]
+            canonical = await self._canonical_files(files)
+            
+            pipe.multi()
+            for track_id in track_ids:
+                pipe.delete(self._track_data_key(room_id, track_id))
+            for file_hash in files:
+                pipe.hincrby(self._file_refs_key(), canonical[file_hash], -1)
+            pipe.delete(
+                tracks_key,
+                self._track_file_index_key(room_id),
+                self._track_title_index_key(room_id),
+            )
+            return len(track_ids)
+        
+        # Трек, добавленный во время очистки, меняет ZSET — транзакция повторится
+        return await self._transaction(_clear, tracks_key)
     
     async def update_track(self, room_id: str, index: int, track_data: Dict[str, Any]) -> bool:
-        """Обновляет трек"""
-        return await self._list_set(self._track_key(room_id), index, track_data)
+        """
+        Обновляет трек.
+        
+        При смене файла или названия вместе с данными обновляются ссылка
+        на файл и индексы by_file / by_title (в той же транзакции).
+        """
+        track_id = await self.get_track_id(room_id, index)
+        if track_id is None:
+            return False
+        data_key = self._track_data_key(room_id, track_id)
+        file_index_key = self._track_file_index_key(room_id)
+        title_index_key = self._track_title_index_key(room_id)
+        
+        async def _update(pipe) -> bool:
+            # Трек мог быть удален другим процессом — не воскрешаем его
+            track = self._decode_track(track_id, await pipe.hgetall(data_key))
+            if not track:
+                return False
+            old_file = track.get("file")
+            new_file = track_data.get("file", old_file)
+            old_title = (track.get("title") or "").lower()
+            new_title = (track_data.get("title", track.get("title")) or "").lower()
+            # Старые записи индексов снимаем, только если они указывают на этот трек
+            indexed_file_id = await pipe.hget(file_index_key, old_file) if old_file and new_file != old_file else None
+            indexed_title_id = await pipe.hget(title_index_key, old_title) if old_title and new_title != old_title else None
+            canonical = await self._canonical_files([old_file, new_file])
+            
+            pipe.multi()
+            pipe.hset(data_key, mapping=self._encode_track(track_data))
+            # Если у трека сменился файл — переносим ссылку и запись by_file
+            if new_file != old_file:
+                if old_file:
+                    pipe.hincrby(self._file_refs_key(), canonical[old_file], -1)
+                    if indexed_file_id and self._decode(indexed_file_id) == track_id:
+                        pipe.hdel(file_index_key, old_file)
+                if new_file:
+                    pipe.hincrby(self._file_refs_key(), canonical[new_file], 1)
+                    pipe.hsetnx(file_index_key, new_file, track_id)
+            if new_title != old_title:
+                if indexed_title_id and self._decode(indexed_title_id) == track_id:
+                    pipe.hdel(title_index_key, old_title)
+                if new_title:
+                    pipe.hsetnx(title_index_key, new_title, track_id)
+            return True
+        
+        return await self._transaction(_update, data_key)
+    
+    async def find_track_id_by_hash(self, room_id: str, file_hash: str) -> Optional[str]:
+        """Находит track_id по хешу файла (O(1))"""
+        if not file_hash:
+            return None
+        track_id = await redis_safe(self.redis.hget(self._track_file_index_key(room_id), file_hash))
+        return self._decode(track_id) if track_id else None
+    
+    async def find_track_id_by_title(self, room_id: str, title: str) -> Optional[str]:
+        """Находит track_id по названию без учета регистра (O(1))"""
+        if not title:
+            return None
+        track_id = await redis_safe(self.redis.hget(self._track_title_index_key(room_id), title.lower()))
+        return self._decode(track_id) if track_id else None
     
     async def find_track_by_hash(self, room_id: str, file_hash: str) -> Optional[int]:
         """Находит индекс трека по хешу файла"""
-        tracks = await self.get_all_tracks(room_id)
-        for i, track in enumerate(tracks):
-            # Пропускаем удаленные треки
-            if track.get("__deleted__") is True:
-                continue
-            if track.get("file") == file_hash:
-                return i
-        return None
+        track_id = await self.find_track_id_by_hash(room_id, file_hash)
+        if track_id is None:
+            return None
+        return await self.get_track_index(room_id, track_id)
     
     async def find_track_by_title(self, room_id: str, title: str) -> Optional[int]:
         """Находит индекс трека по названию"""
-        tracks = await self.get_all_tracks(room_id)
-        title_lower = title.lower()
-        for i, track in enumerate(tracks):
-            # Пропускаем удаленные треки
-            if track.get("__deleted__") is True:
-                continue
-            if track.get("title", "").lower() == title_lower:
-                return i
-        return None
+        track_id = await self.find_track_id_by_title(room_id, title)
+        if track_id is None:
+            return None
+        return await self.get_track_index(room_id, track_id)
+    
+    async def migrate_room_from_list(self, room_id: str, keep_backup: bool = False) -> Optional[int]:
+        """
+        Переводит плейлист комнаты со старого JSON-списка на хеши + ZSET.
+        
+        Список переименовывается в room:{room_id}:tracks:legacy, затем треки
+        записываются по новой схеме в исходном порядке одной транзакцией
+        (вместе с удалением резервной копии). Записи-маркеры "__deleted__"
+        пропускаются. Если прошлый запуск упал после переименования,
+        миграция продолжается с резервной копии.
+        
+        Returns:
+            Количество перенесенных треков или None, если комната уже
+            на новой схеме (или плейлиста нет)
+        """
+        key = self._track_key(room_id)
+        legacy_key = f"{key}:legacy"
+        seq_key = self._track_seq_key(room_id)
+        key_type = self._decode(await redis_safe(self.redis.type(key)))
+        if key_type == "list":
+            await redis_safe(self.redis.rename(key, legacy_key))
+        elif key_type != "none" or not await self._exists(legacy_key) or await self._exists(seq_key):
+            # Треки уже записаны (транзакция прошла) — резервная копия оставлена keep_backup
+            return None
+        
+        tracks = [
+            track for track in await self._list_get(legacy_key)
+            if isinstance(track, dict) and track.get("__deleted__") is not True
+        ]
+        seq = int(await redis_safe(self.redis.get(seq_key)) or 0)
+        canonical = await self._canonical_files([track.get("file") for track in tracks])
+        
+        async with self._pipeline(transaction=True) as pipe:
+            for offset, track in enumerate(tracks, 1):
+                track_id = str(seq + offset)
+                pipe.hset(self._track_data_key(room_id, track_id), mapping=self._encode_track(track))
+                pipe.zadd(key, {track_id: seq + offset})
+                if track.get("file"):
+                    pipe.hsetnx(self._track_file_index_key(room_id), track["file"], track_id)
+                    pipe.hincrby(self._file_refs_key(), canonical[track["file"]], 1)
+                if track.get("title"):
+                    pipe.hsetnx(self._track_title_index_key(room_id), track["title"].lower(), track_id)
+            if tracks:
+                pipe.incrby(seq_key, len(tracks))
+            if not keep_backup:
+                pipe.delete(legacy_key)
+            await pipe.execute()
+        return len(tracks)
+    
+    def _user_track_key(self, user_id: int, room_id: str, token: str) -> str:
+        """Генерирует ключ для трека пользователя"""
+        return f"user_track:{user_id}:{room_id}:{token}"
+    
+    def _user_tracks_set_key(self, user_id: int, room_id: str) -> str:
+        """Генерирует ключ для множества треков пользователя"""
+        return f"user:{user_id}:tracks:{room_id}"
+    
+    def _pending_index_key(self, room_id: str) -> str:
+        """Индекс треков пользователей на модерации: token -> user_id"""
+        return f"room:{room_id}:pending_user_tracks"
+    
+    def _queue_pending_index(self, pipe, user_id: int, room_id: str, token: str, status: Optional[str]) -> None:
+        """Ставит в пайплайн обновление индекса pending для трека пользователя"""
+        if status == "pending":
+            pipe.hset(self._pending_index_key(room_id), token, str(user_id))
+        else:
+            pipe.hdel(self._pending_index_key(room_id), token)
+    
+    async def get_pending_index(self, room_id: str) -> Dict[str, str]:
+        """Получает индекс pending-треков комнаты: {token: user_id}"""
+        index_raw = await redis_safe(self.redis.hgetall(self._pending_index_key(room_id)))
+        return {self._decode(k): self._decode(v) for k, v in (index_raw or {}).items()}
     
     async def save_user_track(self, user_id: int, room_id: str, token: str, track_data: Dict[str, Any]) -> bool:
         """Сохраняет трек пользователя"""
         if "added_at" not in track_data:
             track_data["added_at"] = iso_now()
         
-        # Сохраняем трек
+        # Сохраняем трек, добавляем токен в множество треков пользователя
+        # и поддерживаем индекс pending-треков комнаты
         key = self._user_track_key(user_id, room_id, token)
-        result = await self._set(key, track_data, ex=604800)  # 7 дней
+        async with self._pipeline(transaction=True) as pipe:
+            pipe.set(key, json.dumps(track_data, ensure_ascii=False), ex=604800)  # 7 дней
+            pipe.sadd(self._user_tracks_set_key(user_id, room_id), token)
+            self._queue_pending_index(pipe, user_id, room_id, token, track_data.get("status"))
+            results = await pipe.execute()
         
-        # Добавляем токен в множество треков пользователя
-        if result:
-            await self._set_add(self._user_tracks_set_key(user_id, room_id), token)
-        
-        return result
+        return bool(results[0])
     
     async def get_user_track(self, user_id: int, room_id: str, token: str) -> Optional[Dict[str, Any]]:
         """Получает трек пользователя"""
@@ -104,12 +470,8 @@ class TrackRepository(BaseRepository):
     async def get_user_tracks(self, user_id: int, room_id: str) -> List[Dict[str, Any]]:
         """Получает все треки пользователя в комнате"""
         tokens = await self._set_members(self._user_tracks_set_key(user_id, room_id))
-        tracks = []
-        for token in tokens:
-            track = await self.get_user_track(user_id, room_id, token)
-            if track:
-                tracks.append(track)
-        return tracks
+        keys = [self._user_track_key(user_id, room_id, token) for token in tokens]
+        return [track for track in await self._mget(keys) if track]
     
     async def update_user_track_status(
         self, 
@@ -119,15 +481,45 @@ class TrackRepository(BaseRepository):
         status: str,
         moderated_at: Optional[str] = None
     ) -> bool:
-        """Обновляет статус трека пользователя"""
-        track = await self.get_user_track(user_id, room_id, token)
-        if not track:
-            return False
+        """Обновляет статус трека пользователя (WATCH/MULTI — без потери параллельных изменений)"""
+        return await self.update_user_tracks_status(
+            user_id, room_id, [token], status, moderated_at=moderated_at
+        ) == 1
+    
+    async def update_user_tracks_status(
+        self,
+        user_id: int,
+        room_id: str,
+        tokens: List[str],
+        status: str,
+        moderated_at: Optional[str] = None
+    ) -> int:
+        """
+        Обновляет статус нескольких треков пользователя одной транзакцией
+        (WATCH + MGET + MULTI/SET; при параллельном изменении повторяется)
+        
+        Returns:
+            Количество обновленных треков
+        """
+        if not tokens:
+            return 0
+        keys = [self._user_track_key(user_id, room_id, token) for token in tokens]
+        if not moderated_at and status in ("approved", "rejected"):
+            moderated_at = iso_now()
         
-        track["status"] = status
-        if moderated_at:
-            track["moderated_at"] = moderated_at
-        elif status in ("approved", "rejected"):
-            track["moderated_at"] = iso_now()
+        async def _update(pipe) -> int:
+            tracks = [self._loads(raw) for raw in await pipe.mget(keys)]
+            pipe.multi()
+            updated = 0
+            for token, key, track in zip(tokens, keys, tracks):
+                if not track:
+                    continue
+                track["status"] = status
+                if moderated_at:
+                    track["moderated_at"] = moderated_at
+                pipe.set(key, json.dumps(track, ensure_ascii=False), ex=604800)  # 7 дней
+                self._queue_pending_index(pipe, user_id, room_id, token, status)
+                updated += 1
+            return updated
         
-        return await self.save_user_track(user_id, room_id, token, track)
+        return await self._transaction(_update, *keys)
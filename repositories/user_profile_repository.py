@@ -0,0 +1,28 @@
+"""
+Repository для кэша профилей пользователей Telegram
+"""
+from typing import Optional, List, Dict, Any
+from repositories.base_repository import BaseRepository
+
+
+class UserProfileRepository(BaseRepository):
+    """Репозиторий профилей пользователей (username / full_name)"""
+    
+    def _profile_key(self, user_id: int) -> str:
+        return f"user_profile:{user_id}"
+    
+    async def get_profiles(self, user_ids: List[int]) -> Dict[int, Optional[Dict[str, Any]]]:
+        """Получает профили нескольких пользователей одним MGET"""
+        if not user_ids:
+            return {}
+        profiles = await self._mget([self._profile_key(uid) for uid in user_ids])
+        return dict(zip(user_ids, profiles))
+    
+    async def save_profiles(self, profiles: Dict[int, Dict[str, Any]], ex: int) -> bool:
+        """Сохраняет профили пользователей с TTL (обновляет TTL существующих)"""
+        if not profiles:
+            return True
+        return await self._mset(
+            {self._profile_key(uid): profile for uid, profile in profiles.items()},
+            ex=ex
+        )
@@ -8,6 +8,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from config import redis
 from utils.redis_helper import redis_safe
+from repositories.moderation_repository import ModerationRepository
 
 async def restore_missing():
     print("🔍 Ищу потерянные треки...\n")
@@ -48,15 +49,14 @@ async def restore_missing():
             if track.get("status") == "pending":
                 # Проверяем очередь модерации
                 queue_key = f"room:{room_id}:moderation_queue"
-                queue_raw = await redis_safe(redis.lrange(queue_key, 0, -1))
-                queue_tokens = [t.decode() if isinstance(t, bytes) else str(t) for t in (queue_raw or [])]
+                queued = await redis_safe(redis.zscore(queue_key, token)) is not None
                 
                 # Проверяем данные трека
                 mod_key = f"moderation_queue:{room_id}:{token}"
                 mod_data = await redis_safe(redis.get(mod_key))
                 
                 # Если нет ни в очереди, ни в данных - трек потерян
-                if token not in queue_tokens and not mod_data:
+                if not queued and not mod_data:
                     room_name_raw = await redis_safe(redis.get(f"room:{room_id}:name"))
                     room_name = room_name_raw.decode() if isinstance(room_name_raw, bytes) else str(room_name_raw) if room_name_raw else "Неизвестно"
                     
@@ -81,6 +81,7 @@ async def restore_missing():
             print(f"   Token: {m['token']}\n")
         
         print("🔄 Восстанавливаю...\n")
+        moderation_repo = ModerationRepository()
         
         for m in missing:
             mod_track = {
@@ -94,13 +95,8 @@ async def restore_missing():
                 "added_at": m["track"].get("added_at")
             }
             
-            # Сохраняем данные
-            mod_key = f"moderation_queue:{m['room_id']}:{m['token']}"
-            await redis_safe(redis.set(mod_key, json.dumps(mod_track), ex=86400))
-            
-            # Добавляем в очередь
-            queue_key = f"room:{m['room_id']}:moderation_queue"
-            await redis_safe(redis.rpush(queue_key, m["token"]))
+            # Сохраняем данные и добавляем в очередь (ZSET по времени добавления)
+            await moderation_repo.add_to_moderation_queue(m["room_id"], m["token"], mod_track)
             
             print(f"✅ Восстановлен: {m['title'][:50]}")
         
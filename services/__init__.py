@@ -5,10 +5,18 @@ from .track_service import TrackService
 from .room_service import RoomService
 from .moderation_service import ModerationService
 from .notification_service import NotificationService
+from .user_profile_cache import UserProfileCache, get_user_profile_cache
+from .audio_service import AudioService
+from .export_service import ExportService, get_export_service
 
 __all__ = [
     "TrackService",
     "RoomService",
     "ModerationService",
     "NotificationService",
+    "UserProfileCache",
+    "get_user_profile_cache",
+    "AudioService",
+    "ExportService",
+    "get_export_service",
 ]
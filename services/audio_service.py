@@ -0,0 +1,70 @@
+"""
+Service для отправки аудиофайлов в Telegram
+
+Первая отправка файла загружает mp3 с диска (FSInputFile, без чтения
+в память), file_id из ответа Telegram сохраняется по хешу файла.
+Повторные отправки передают file_id и не загружают файл заново.
+"""
+import logging
+from typing import Any
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from config import TG_MAX_FILE_BYTES
+from repositories.media_repository import MediaRepository
+from utils.audio_cache import path_for, get_audio_cache
+
+logger = logging.getLogger(__name__)
+
+
+class AudioService:
+    """Сервис отправки аудио с переиспользованием Telegram file_id"""
+    
+    def __init__(self):
+        self.media_repo = MediaRepository()
+    
+    async def send_audio(
+        self,
+        bot: Any,
+        chat_id: int,
+        file_hash: str,
+        filename: str,
+        **kwargs: Any
+    ) -> types.Message:
+        """
+        Отправляет аудио по хешу файла.
+        
+        kwargs передаются в bot.send_audio (title, caption, reply_markup, ...).
+        
+        Raises:
+            FileNotFoundError: file_id не сохранен и файла нет в кэше
+            ValueError: файл превышает лимит Telegram
+        """
+        audio_cache = get_audio_cache()
+        # Старые хеши слитых дубликатов указывают на канонический файл
+        file_hash = await audio_cache.resolve(file_hash)
+        await audio_cache.touch(file_hash)
+        file_id = await self.media_repo.get_file_id(file_hash)
+        if file_id:
+            try:
+                return await bot.send_audio(chat_id=chat_id, audio=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                # file_id устарел — забываем его и загружаем файл заново
+                logger.warning(f"⚠️ file_id для {file_hash} не принят Telegram: {e}")
+                await self.media_repo.delete_file_id(file_hash)
+        
+        entry = await audio_cache.get_entry(file_hash)
+        if entry is None:
+            raise FileNotFoundError(f"Аудиофайл {file_hash} не найден в кэше")
+        if entry["size"] > TG_MAX_FILE_BYTES:
+            raise ValueError(f"Аудиофайл {file_hash} превышает лимит Telegram")
+        
+        msg = await bot.send_audio(
+            chat_id=chat_id,
+            audio=types.FSInputFile(path_for(file_hash), filename=filename),
+            **kwargs
+        )
+        if msg.audio:
+            await self.media_repo.set_file_id(file_hash, msg.audio.file_id)
+        return msg
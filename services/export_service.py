@@ -0,0 +1,315 @@
+"""
+Service для экспорта плейлиста комнаты в zip-архивы
+
+Части архива пишутся прямо из файлов аудиокэша в zip-файлы на диске
+в отдельном потоке: event loop не блокируется, треки не копируются
+во временную папку и не читаются в память целиком. mp3 почти не
+сжимается, поэтому файлы кладутся без сжатия (ZIP_STORED) — размер
+части известен заранее, и треки раскладываются по частям до лимита
+Telegram по размерам из индекса кэша.
+
+Кэш экспорта инкрементальный: exports/cache/{room_id}/manifest.json
+хранит части комнаты (треки каждой части, запечатана ли она, file_id
+отправленной части). При повторном экспорте:
+- части, все треки которых по-прежнему в плейлисте, переиспользуются
+  (вместе с file_id — повторная отправка без загрузки);
+- часть, из которой удален трек, пересобирается из оставшихся треков;
+- новые треки дописываются в последнюю (незапечатанную) часть,
+  а когда она заполнена — в новые части.
+Поэтому новые треки попадают в конец архива, а не по алфавиту.
+"""
+import asyncio
+import json
+import os
+import shutil
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import TG_MAX_FILE_BYTES
+from util_types.export_types import ExportItem, ExportPart
+from utils.audio_cache import path_for, get_audio_cache
+
+EXPORT_CACHE_DIR = Path("exports/cache")
+PART_LIMIT = TG_MAX_FILE_BYTES - 64 * 1024   # запас на заголовки multipart-запроса
+MAX_CONCURRENT_EXPORTS = 2                    # одновременно собираемых архивов
+MANIFEST_NAME = "manifest.json"
+
+# Служебные структуры zip (без сжатия): локальный заголовок и запись
+# центрального каталога на каждый файл + имя файла дважды, конец архива
+_LOCAL_HEADER = 30
+_CENTRAL_HEADER = 46
+_END_RECORD = 22
+_ENTRY_SLACK = 32
+
+
+def _safe_filename(title: str, fallback: str) -> str:
+    return "".join(c for c in title if c.isalnum() or c in " _-").strip() or fallback
+
+
+def entry_size(item: ExportItem) -> int:
+    """Сколько байт трек займет в архиве без сжатия"""
+    name_len = len(item["arcname"].encode("utf-8"))
+    return item["size"] + _LOCAL_HEADER + _CENTRAL_HEADER + 2 * name_len + _ENTRY_SLACK
+
+
+def plan_parts(items: List[ExportItem], limit: int = PART_LIMIT) -> List[List[ExportItem]]:
+    """Раскладывает треки по частям (в исходном порядке) так, чтобы каждая часть не превышала limit"""
+    parts: List[List[ExportItem]] = []
+    current: List[ExportItem] = []
+    current_size = _END_RECORD
+    for item in items:
+        size = entry_size(item)
+        if current and current_size + size > limit:
+            parts.append(current)
+            current, current_size = [], _END_RECORD
+        current.append(item)
+        current_size += size
+    if current:
+        parts.append(current)
+    return parts
+
+
+def write_part(path: Path, items: List[ExportItem], limit: int = PART_LIMIT) -> None:
+    """
+    Пишет часть архива из файлов кэша (блоками, через временный файл).
+
+    Raises:
+        ValueError: часть превысила лимит
+    """
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as zf:
+            for item in items:
+                zf.write(path_for(item["file_hash"]), item["arcname"])
+        size = tmp_path.stat().st_size
+        if size > limit:
+            raise ValueError(f"Часть {path.name} превысила лимит TG: {size // (1024*1024)} МБ")
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class ExportService:
+    """Сервис сборки архивов плейлиста"""
+
+    def __init__(self, cache_dir: Path = EXPORT_CACHE_DIR, part_limit: int = PART_LIMIT):
+        self.cache_dir = cache_dir
+        self.part_limit = part_limit
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_EXPORTS)
+        # Сборки одной комнаты выполняются по очереди (общий манифест);
+        # повторное нажатие «Экспорт» дождется сборки и получит готовые части
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Части, которые сейчас отправляются (путь -> число отправок): часть,
+        # выброшенную сборкой во время отправки, удаляет последний release
+        self._in_use: Dict[Path, int] = {}
+        self._dropped: Set[Path] = set()
+
+    async def collect_items(self, tracks: List[Dict[str, Any]]) -> List[ExportItem]:
+        """
+        Треки плейлиста, которые можно экспортировать: файл есть в кэше
+        и не превышает лимит. Отсортированы по имени, имена в архиве уникальны.
+        """
+        audio_cache = get_audio_cache()
+        canonical = await audio_cache.resolve_many([t.get("file") for t in tracks])
+        # Наличие и размеры файлов — одним запросом к индексу кэша
+        entries = await audio_cache.get_entries(list(canonical.values()))
+
+        candidates = []
+        for t in tracks:
+            fh = canonical.get(t.get("file"))
+            if not fh or fh not in entries:
+                continue
+            if entries[fh]["size"] > TG_MAX_FILE_BYTES:
+                continue
+            candidates.append((_safe_filename(t.get("title", fh), fh), fh, entries[fh]["size"]))
+        candidates.sort(key=lambda x: x[0].lower())
+
+        items: List[ExportItem] = []
+        used_names = set()
+        for safe, fh, size in candidates:
+            arcname = f"{safe}.mp3"
+            n = 2
+            while arcname.lower() in used_names:
+                arcname = f"{safe} ({n}).mp3"
+                n += 1
+            used_names.add(arcname.lower())
+            items.append({"file_hash": fh, "arcname": arcname, "size": size})
+        return items
+
+    async def build(self, room_id: str, items: List[ExportItem]) -> List[ExportPart]:
+        """
+        Возвращает части архива: переиспользует собранные части и
+        собирает только недостающие. Файлы возвращенных частей не удаляются
+        до вызова release (после отправки).
+
+        Raises:
+            ValueError: часть превысила лимит Telegram
+        """
+        async with self._room_lock(room_id):
+            room_dir = self.cache_dir / room_id
+            manifest = await asyncio.to_thread(self._load_manifest, room_dir)
+            parts, to_write, dropped = self._plan_update(room_dir, manifest["parts"], items)
+
+            if to_write:
+                async with self._semaphore:
+                    await asyncio.to_thread(self._write_parts, room_id, room_dir, to_write)
+                manifest["parts"] = parts
+                await asyncio.to_thread(self._save_manifest, room_dir, manifest)
+                print(
+                    f"[export] {room_id}: собрано частей {len(to_write)}, "
+                    f"переиспользовано {len(parts) - len(to_write)}, треков {len(items)}"
+                )
+            elif dropped:
+                manifest["parts"] = parts
+                await asyncio.to_thread(self._save_manifest, room_dir, manifest)
+            else:
+                print(f"[export] Кэш-попадание: {room_id}")
+
+            # Файлы выброшенных частей удаляются после сохранения манифеста
+            # (отправляемые другим экспортом — после их отправки)
+            for name in dropped:
+                path = room_dir / name
+                if path in self._in_use:
+                    self._dropped.add(path)
+                else:
+                    path.unlink(missing_ok=True)
+
+            result: List[ExportPart] = []
+            for part in parts:
+                path = room_dir / part["name"]
+                self._in_use[path] = self._in_use.get(path, 0) + 1
+                result.append({
+                    "name": part["name"],
+                    "path": path,
+                    "tracks": len(part["items"]),
+                    "file_id": part.get("file_id"),
+                    "filename": part.get("filename"),
+                })
+        return result
+
+    def release(self, parts: List[ExportPart]) -> None:
+        """Отмечает части, полученные от build, отправленными"""
+        for part in parts:
+            path = part["path"]
+            count = self._in_use.get(path, 0) - 1
+            if count > 0:
+                self._in_use[path] = count
+                continue
+            self._in_use.pop(path, None)
+            if path in self._dropped:
+                self._dropped.discard(path)
+                path.unlink(missing_ok=True)
+
+    async def remember_file_id(self, room_id: str, part_name: str, filename: str, file_id: str) -> None:
+        """Запоминает file_id отправленной части (повторно отправляется без загрузки)"""
+        async with self._room_lock(room_id):
+            room_dir = self.cache_dir / room_id
+            manifest = await asyncio.to_thread(self._load_manifest, room_dir)
+            for part in manifest["parts"]:
+                if part["name"] == part_name:
+                    part["file_id"] = file_id
+                    part["filename"] = filename
+                    await asyncio.to_thread(self._save_manifest, room_dir, manifest)
+                    return
+
+    def _room_lock(self, room_id: str) -> asyncio.Lock:
+        lock = self._locks.get(room_id)
+        if lock is None:
+            lock = self._locks[room_id] = asyncio.Lock()
+        return lock
+
+    def _plan_update(
+        self,
+        room_dir: Path,
+        old_parts: List[Dict[str, Any]],
+        items: List[ExportItem]
+    ) -> Tuple[List[Dict[str, Any]], List[Tuple[str, List[ExportItem]]], List[str]]:
+        """
+        Сопоставляет части манифеста с текущими треками.
+
+        Returns:
+            (части нового манифеста, [(имя части, треки)] для сборки, имена выброшенных частей)
+        """
+        current = {(i["file_hash"], i["arcname"]): i for i in items}
+        used = set()
+        parts = []
+        dropped = []
+        for part in old_parts:
+            keys = [(fh, arcname) for fh, arcname, _ in part["items"]]
+            if all(k in current and k not in used for k in keys) and (room_dir / part["name"]).exists():
+                parts.append(part)
+                used.update(keys)
+            else:
+                # Трек удален или переименован — часть пересобирается из оставшихся треков
+                dropped.append(part["name"])
+
+        leftovers = [i for i in items if (i["file_hash"], i["arcname"]) not in used]
+        to_write = []
+        if leftovers:
+            # Дописываем в последнюю незапечатанную часть, остальное — в новые
+            if parts and not parts[-1]["sealed"]:
+                tail = parts.pop()
+                dropped.append(tail["name"])
+                leftovers = [current[(fh, arcname)] for fh, arcname, _ in tail["items"]] + leftovers
+            plan = plan_parts(leftovers, self.part_limit)
+            for n, part_items in enumerate(plan, 1):
+                name = f"part_{uuid.uuid4().hex[:12]}.zip"
+                parts.append({
+                    "name": name,
+                    "items": [[i["file_hash"], i["arcname"], i["size"]] for i in part_items],
+                    "sealed": n < len(plan),
+                    "file_id": None,
+                    "filename": None,
+                })
+                to_write.append((name, part_items))
+        return parts, to_write, dropped
+
+    def _write_parts(self, room_id: str, room_dir: Path, to_write: List[Tuple[str, List[ExportItem]]]) -> None:
+        room_dir.mkdir(parents=True, exist_ok=True)
+        for name, part_items in to_write:
+            write_part(room_dir / name, part_items, self.part_limit)
+        # Архивы старого формата ({room_id}_{хеш содержимого}) больше не используются
+        for old_dir in self.cache_dir.glob(f"{room_id}_*"):
+            if old_dir.is_dir() and old_dir.name.rsplit("_", 1)[0] == room_id:
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+    @staticmethod
+    def _load_manifest(room_dir: Path) -> Dict[str, Any]:
+        try:
+            with open(room_dir / MANIFEST_NAME, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get("parts"), list):
+                return manifest
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[export] Манифест {room_dir} поврежден, архив будет пересобран: {e}")
+        return {"parts": []}
+
+    @staticmethod
+    def _save_manifest(room_dir: Path, manifest: Dict[str, Any]) -> None:
+        room_dir.mkdir(parents=True, exist_ok=True)
+        path = room_dir / MANIFEST_NAME
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+
+# Глобальный сервис экспорта (общие ограничение параллелизма и блокировки комнат)
+_global_export_service: Optional[ExportService] = None
+
+
+def get_export_service() -> ExportService:
+    """Получает глобальный сервис экспорта."""
+    global _global_export_service
+    if _global_export_service is None:
+        _global_export_service = ExportService()
+    return _global_export_service
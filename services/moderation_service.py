@@ -1,11 +1,18 @@
 """
 Service для работы с модерацией
+
+Бот может работать в нескольких процессах: одобрение, отклонение и
+возврат трека выполняются одним Lua-скриптом каждое (см.
+ModerationRepository) — трек не будет одобрен или отклонен повторно,
+дубликат не попадет в плейлист.
 """
 from typing import Optional, List, Dict, Any
 from repositories.moderation_repository import ModerationRepository
 from repositories.track_repository import TrackRepository
 from repositories.room_repository import RoomRepository
 from utils.timezone import iso_now
+from utils.audio_cache import get_audio_cache
+from util_types.moderation_types import BatchModerationResult
 
 
 class ModerationService:
@@ -74,60 +81,28 @@ class ModerationService:
         Returns:
             Информация об одобренном треке
         """
-        # Получаем трек из модерации
-        track_data = await self.moderation_repo.get_moderation_track(room_id, token)
-        if not track_data:
+        status, track_id, track_data = await self.moderation_repo.approve(room_id, token, admin_id)
+        if status == "missing":
             raise ValueError("Трек не найден в очереди модерации")
         
-        # Проверяем на дубликаты
-        file_hash = track_data.get("file")
-        existing_index = await self.track_repo.find_track_by_hash(room_id, file_hash)
-        if existing_index is not None:
-            # Трек уже существует в плейлисте - просто удаляем из модерации и обновляем статус
-            await self.moderation_repo.remove_from_moderation_queue(room_id, token)
-            
-            # Обновляем статус трека пользователя на approved (если он был pending)
-            user_id = track_data.get("user_id")
-            if user_id:
-                # Находим все user_tracks с этим хешем и обновляем их статус
-                user_tracks = await self.track_repo.get_user_tracks(user_id, room_id)
-                for user_track in user_tracks:
-                    if user_track.get("file") == file_hash and user_track.get("status") == "pending":
-                        await self.track_repo.update_user_track_status(
-                            user_id, room_id, user_track.get("token"), "approved"
-                        )
-            
-            # Возвращаем информацию о существующем треке
-            tracks = await self.track_repo.get_all_tracks(room_id)
-            existing_track = tracks[existing_index] if existing_index < len(tracks) else None
-            
+        user_id = track_data.get("user_id")
+        if status == "exists":
+            # Трек уже существует в плейлисте - возвращаем информацию о нем
+            existing_track = await self.track_repo.get_track_by_id(room_id, track_id)
             return {
                 "track": existing_track or track_data,
                 "user_id": user_id,
                 "already_exists": True
             }
         
-        # Устанавливаем статус in_progress
-        await self.moderation_repo.set_track_in_progress(room_id, token, admin_id)
-        
-        # Добавляем трек в плейлист
         track_obj = {
             "title": track_data.get("title"),
-            "file": file_hash,
+            "file": track_data.get("file"),
             "added_by": track_data.get("added_by"),
-            "user_id": track_data.get("user_id"),
-            "status": "approved"
+            "user_id": user_id,
+            "status": "approved",
+            "id": track_id
         }
-        await self.track_repo.add_track(room_id, track_obj)
-        
-        # Удаляем из очереди модерации
-        await self.moderation_repo.remove_from_moderation_queue(room_id, token)
-        
-        # Обновляем статус трека пользователя
-        user_id = track_data.get("user_id")
-        if user_id:
-            await self.track_repo.update_user_track_status(user_id, room_id, token, "approved")
-        
         return {
             "track": track_obj,
             "user_id": user_id
@@ -145,30 +120,59 @@ class ModerationService:
         Returns:
             Информация об отклоненном треке
         """
-        # Получаем трек из модерации
-        track_data = await self.moderation_repo.get_moderation_track(room_id, token)
-        if not track_data:
+        status, track_data = await self.moderation_repo.reject(room_id, token, admin_id)
+        if status == "missing":
             raise ValueError("Трек не найден в очереди модерации")
         
-        # Устанавливаем статус in_progress
-        await self.moderation_repo.set_track_in_progress(room_id, token, admin_id)
-        
-        # Добавляем в список отклоненных
-        await self.moderation_repo.add_to_rejected(room_id, token, track_data)
-        
-        # Удаляем из очереди модерации
-        await self.moderation_repo.remove_from_moderation_queue(room_id, token)
-        
-        # Обновляем статус трека пользователя
-        user_id = track_data.get("user_id")
-        if user_id:
-            await self.track_repo.update_user_track_status(user_id, room_id, token, "rejected")
-        
         return {
             "track": track_data,
-            "user_id": user_id
+            "user_id": track_data.get("user_id")
         }
     
+    async def approve_many(self, room_id: str, tokens: List[str], admin_id: int) -> BatchModerationResult:
+        """
+        Одобряет несколько треков одной транзакцией.
+        
+        Returns:
+            Итог пакета; by_user — добавленные треки по пользователям
+            (дубликаты в уведомления не попадают)
+        """
+        results = await self.moderation_repo.approve_many(room_id, tokens, admin_id)
+        batch: BatchModerationResult = {"processed": 0, "duplicates": 0, "skipped": 0, "by_user": {}}
+        for status, _, track_data in results:
+            if status == "added":
+                batch["processed"] += 1
+                self._group_by_user(batch, track_data)
+            elif status == "exists":
+                batch["duplicates"] += 1
+            else:
+                batch["skipped"] += 1
+        return batch
+    
+    async def reject_many(self, room_id: str, tokens: List[str], admin_id: int) -> BatchModerationResult:
+        """Отклоняет несколько треков одной транзакцией"""
+        results = await self.moderation_repo.reject_many(room_id, tokens, admin_id)
+        batch: BatchModerationResult = {"processed": 0, "duplicates": 0, "skipped": 0, "by_user": {}}
+        for status, track_data in results:
+            if status == "rejected":
+                batch["processed"] += 1
+                self._group_by_user(batch, track_data)
+            else:
+                batch["skipped"] += 1
+        return batch
+    
+    async def approve_all_from_user(self, room_id: str, user_id: int, admin_id: int) -> BatchModerationResult:
+        """Одобряет все треки пользователя из очереди модерации"""
+        pending = await self.moderation_repo.get_pending_tracks(room_id)
+        tokens = [t["token"] for t in pending if str(t.get("user_id")) == str(user_id)]
+        return await self.approve_many(room_id, tokens, admin_id)
+    
+    @staticmethod
+    def _group_by_user(batch: BatchModerationResult, track_data: Optional[Dict[str, Any]]):
+        user_id = (track_data or {}).get("user_id")
+        if user_id:
+            batch["by_user"].setdefault(user_id, []).append(track_data.get("title") or "Без названия")
+    
     async def get_rejected_tracks(self, room_id: str) -> List[Dict[str, Any]]:
         """Получает список отклоненных треков"""
         return await self.moderation_repo.get_rejected_tracks(room_id)
@@ -181,41 +185,39 @@ class ModerationService:
         """
         Восстанавливает отклоненный трек в плейлист
         
+        Файлы отклоненных треков не защищены от вытеснения из аудиокэша
+        (защищены только треки плейлистов), поэтому трек без файла
+        в кэше не восстанавливается.
+        
         Returns:
             Информация о восстановленном треке
         """
-        # Получаем трек из отклоненных
-        track_data = await self.moderation_repo.get_rejected_track(room_id, token)
-        if not track_data:
+        rejected = await self.moderation_repo.get_rejected_track(room_id, token)
+        if not rejected:
             raise ValueError("Трек не найден в списке отклоненных")
-        
-        # Проверяем на дубликаты
-        file_hash = track_data.get("file")
-        existing_index = await self.track_repo.find_track_by_hash(room_id, file_hash)
-        if existing_index is not None:
+        file_hash = rejected.get("file")
+        if file_hash:
+            audio_cache = get_audio_cache()
+            if not await audio_cache.get_entry(await audio_cache.resolve(file_hash)):
+                raise ValueError("Файл трека уже удален из кэша — добавьте трек заново")
+        
+        status, track_id, track_data = await self.moderation_repo.restore_rejected(room_id, token)
+        if status == "missing":
+            raise ValueError("Трек не найден в списке отклоненных")
+        if status == "exists":
             raise ValueError("Трек уже существует в плейлисте")
         
-        # Добавляем трек в плейлист
         track_obj = {
             "title": track_data.get("title"),
-            "file": file_hash,
+            "file": track_data.get("file"),
             "added_by": track_data.get("added_by"),
             "user_id": track_data.get("user_id"),
-            "status": "approved"
+            "status": "approved",
+            "id": track_id
         }
-        await self.track_repo.add_track(room_id, track_obj)
-        
-        # Удаляем из списка отклоненных
-        await self.moderation_repo.remove_from_rejected(room_id, token)
-        
-        # Обновляем статус трека пользователя
-        user_id = track_data.get("user_id")
-        if user_id:
-            await self.track_repo.update_user_track_status(user_id, room_id, token, "approved")
-        
         return {
             "track": track_obj,
-            "user_id": user_id
+            "user_id": track_data.get("user_id")
         }
     
     def _generate_token(self) -> str:
@@ -1,13 +1,16 @@
 """
 Service для отправки уведомлений
 """
-from typing import List, Optional
+from typing import Dict, List, Optional
 from config import bot as bot_instance
 from repositories.room_repository import RoomRepository
+from utils.notification_fanout import get_fanout_engine
 import logging
 
 logger = logging.getLogger(__name__)
 
+BATCH_NOTIFY_TITLES = 20  # сколько названий треков перечислять в групповом уведомлении
+
 
 class NotificationService:
     """Сервис для отправки уведомлений"""
@@ -60,6 +63,45 @@ class NotificationService:
             logger.error(f"⚠️ Не удалось отправить уведомление пользователю {user_id}: {e}")
             return False
     
+    async def notify_tracks_moderated(
+        self,
+        by_user: Dict[int, List[str]],
+        room_id: str,
+        approved: bool
+    ) -> int:
+        """
+        Групповые уведомления о пакетной модерации: одно сообщение
+        на пользователя со списком его треков (через фоновую рассылку).
+        
+        Returns:
+            Количество поставленных в очередь сообщений
+        """
+        if not by_user:
+            return 0
+        room_name = await self.room_repo.get_room_name(room_id) or room_id
+        fanout = get_fanout_engine()
+        
+        queued_count = 0
+        for user_id, titles in by_user.items():
+            if len(titles) == 1:
+                if approved:
+                    header = f"✅ Трек одобрен администратором в комнате <b>{room_name}</b>:"
+                else:
+                    header = f"❌ Трек отклонен администратором в комнате <b>{room_name}</b>:"
+            elif approved:
+                header = f"✅ Одобрено треков: <b>{len(titles)}</b> в комнате <b>{room_name}</b>:"
+            else:
+                header = f"❌ Отклонено треков: <b>{len(titles)}</b> в комнате <b>{room_name}</b>:"
+            lines = [f"• <b>{title}</b>" for title in titles[:BATCH_NOTIFY_TITLES]]
+            if len(titles) > BATCH_NOTIFY_TITLES:
+                lines.append(f"... и еще {len(titles) - BATCH_NOTIFY_TITLES}")
+            message = header + "\n" + "\n".join(lines)
+            if await fanout.enqueue(user_id, message, parse_mode="HTML"):
+                queued_count += 1
+        
+        logger.info(f"📨 Поставлено в очередь уведомлений о пакетной модерации: {queued_count}/{len(by_user)}")
+        return queued_count
+    
     async def notify_new_track(
         self,
         room_id: str,
@@ -80,17 +122,13 @@ class NotificationService:
             f"<b>{track_title}</b> от {added_by}"
         )
         
-        sent_count = 0
-        for member_id in members:
-            if member_id != exclude_user_id:
-                try:
-                    await bot_instance.send_message(member_id, message, parse_mode="HTML")
-                    sent_count += 1
-                except Exception as e:
-                    logger.error(f"⚠️ Не удалось отправить уведомление участнику {member_id}: {e}")
+        # Отправку выполняет фоновый движок рассылки с учетом лимитов Telegram
+        queued_count = await get_fanout_engine().enqueue_many(
+            members, message, exclude=exclude_user_id, parse_mode="HTML"
+        )
         
-        logger.info(f"📨 Отправлено уведомлений о новом треке: {sent_count}/{len(members)}")
-        return sent_count
+        logger.info(f"📨 Поставлено в очередь уведомлений о новом треке: {queued_count}/{len(members)}")
+        return queued_count
     
     async def notify_admins_new_moderation(
         self,
@@ -114,14 +152,9 @@ class NotificationService:
             f"🏠 Комната: <b>{room_name}</b>"
         )
         
-        sent_count = 0
-        for admin_id in admins:
-            if admin_id != exclude_user_id:
-                try:
-                    await bot_instance.send_message(admin_id, message, parse_mode="HTML")
-                    sent_count += 1
-                except Exception as e:
-                    logger.error(f"⚠️ Не удалось отправить уведомление админу {admin_id}: {e}")
+        queued_count = await get_fanout_engine().enqueue_many(
+            admins, message, exclude=exclude_user_id, parse_mode="HTML"
+        )
         
-        logger.info(f"📨 Отправлено уведомлений админам: {sent_count}/{len(admins)}")
-        return sent_count
+        logger.info(f"📨 Поставлено в очередь уведомлений админам: {queued_count}/{len(admins)}")
+        return queued_count
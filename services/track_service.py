@@ -29,15 +29,6 @@ class TrackService:
         Returns:
             Словарь с информацией о добавленном треке
         """
-        # Проверяем на дубликаты
-        existing_index = await self.track_repo.find_track_by_hash(room_id, file_hash)
-        if existing_index is not None:
-            raise ValueError("Трек уже существует в плейлисте")
-        
-        existing_index = await self.track_repo.find_track_by_title(room_id, title)
-        if existing_index is not None:
-            raise ValueError("Трек с таким названием уже существует")
-        
         # Создаем данные трека
         track_data = {
             "title": title,
@@ -47,8 +38,13 @@ class TrackService:
             "status": "approved"
         }
         
-        # Добавляем трек
-        await self.track_repo.add_track(room_id, track_data)
+        # Проверка дубликатов и добавление — один Lua-скрипт
+        # (параллельный процесс не добавит тот же трек между ними)
+        status, _ = await self.track_repo.add_track_if_absent(room_id, track_data)
+        if status == "exists_file":
+            raise ValueError("Трек уже существует в плейлисте")
+        if status == "exists_title":
+            raise ValueError("Трек с таким названием уже существует")
         
         # Сохраняем трек пользователя
         token = self._generate_token()
@@ -0,0 +1,182 @@
+"""
+Кэш профилей пользователей Telegram (username / full_name)
+
+Два уровня: LRU в памяти процесса и Redis (user_profile:{user_id}) с TTL.
+Кэш пополняется бесплатно из входящих апдейтов (см. middlewares/user_profile.py),
+а при промахе профили запрашиваются через bot.get_chat параллельно
+с ограничением числа одновременных запросов.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Iterable, Tuple
+
+from repositories.user_profile_repository import UserProfileRepository
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TTL = 7 * 24 * 3600       # TTL профиля в Redis
+PROFILE_REFRESH_AFTER = 24 * 3600  # через сколько продлевать TTL профиля в Redis
+MEMORY_TTL = 10 * 60               # TTL записи в памяти процесса
+MEMORY_MAX_SIZE = 5000             # размер LRU в памяти
+FETCH_CONCURRENCY = 8              # одновременных запросов get_chat при промахе
+
+
+class UserProfileCache:
+    """Кэш профилей пользователей: LRU в памяти + Redis"""
+    
+    def __init__(
+        self,
+        max_size: int = MEMORY_MAX_SIZE,
+        memory_ttl: int = MEMORY_TTL,
+        redis_ttl: int = PROFILE_TTL,
+        refresh_after: int = PROFILE_REFRESH_AFTER,
+        concurrency: int = FETCH_CONCURRENCY
+    ):
+        self.repo = UserProfileRepository()
+        self.max_size = max_size
+        self.memory_ttl = memory_ttl
+        self.redis_ttl = redis_ttl
+        self.refresh_after = refresh_after
+        self.concurrency = concurrency
+        # user_id -> (профиль, истекает_в_памяти, записан_в_redis_в)
+        self._memory: "OrderedDict[int, Tuple[Dict[str, Any], float, float]]" = OrderedDict()
+    
+    @staticmethod
+    def _profile_from(user: Any) -> Dict[str, Any]:
+        """Профиль из объекта User / Chat"""
+        full_name = getattr(user, "full_name", None)
+        if not full_name:
+            parts = [getattr(user, "first_name", None), getattr(user, "last_name", None)]
+            full_name = " ".join(p for p in parts if p) or None
+        return {
+            "username": getattr(user, "username", None),
+            "full_name": full_name
+        }
+    
+    @staticmethod
+    def display_name(profile: Optional[Dict[str, Any]], user_id: Any) -> str:
+        """Отображаемое имя: @username, иначе полное имя, иначе User {id}"""
+        if profile:
+            if profile.get("username"):
+                return f"@{profile['username']}"
+            if profile.get("full_name"):
+                return profile["full_name"]
+        return f"User {user_id}"
+    
+    def _memory_get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(user_id)
+        if not entry:
+            return None
+        profile, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._memory.pop(user_id, None)
+            return None
+        self._memory.move_to_end(user_id)
+        return profile
+    
+    def _memory_put(self, user_id: int, profile: Dict[str, Any], stored_at: float) -> None:
+        self._memory[user_id] = (profile, time.monotonic() + self.memory_ttl, stored_at)
+        self._memory.move_to_end(user_id)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+    
+    async def remember(self, user: Any) -> None:
+        """
+        Запоминает профиль из апдейта.
+        
+        В Redis пишет только при изменении профиля или когда пора продлить TTL,
+        поэтому на каждый апдейт обычно нет ни одного запроса к Redis.
+        """
+        user_id = getattr(user, "id", None)
+        if user_id is None:
+            return
+        profile = self._profile_from(user)
+        now = time.monotonic()
+        
+        entry = self._memory.get(user_id)
+        if entry and entry[0] == profile and now - entry[2] < self.refresh_after:
+            self._memory_put(user_id, profile, entry[2])
+            return
+        
+        await self.repo.save_profiles({user_id: profile}, ex=self.redis_ttl)
+        self._memory_put(user_id, profile, now)
+    
+    async def get(self, bot: Any, user_id: int) -> Optional[Dict[str, Any]]:
+        """Получает профиль одного пользователя"""
+        return (await self.resolve_many(bot, [user_id])).get(user_id)
+    
+    async def resolve_many(self, bot: Any, user_ids: Iterable[Any]) -> Dict[int, Optional[Dict[str, Any]]]:
+        """
+        Получает профили пользователей: память -> Redis (MGET) -> bot.get_chat.
+        
+        Промахи запрашиваются параллельно, не более concurrency запросов
+        одновременно. Для недоступных пользователей возвращается None.
+        """
+        ids = []
+        for uid in user_ids:
+            try:
+                uid = int(uid)
+            except (TypeError, ValueError):
+                continue
+            if uid not in ids:
+                ids.append(uid)
+        
+        result: Dict[int, Optional[Dict[str, Any]]] = {}
+        missing = []
+        for uid in ids:
+            profile = self._memory_get(uid)
+            if profile is not None:
+                result[uid] = profile
+            else:
+                missing.append(uid)
+        
+        if missing:
+            now = time.monotonic()
+            # Точное время записи в Redis неизвестно — считаем свежим до следующего апдейта
+            for uid, profile in (await self.repo.get_profiles(missing)).items():
+                if profile is not None:
+                    self._memory_put(uid, profile, now)
+                    result[uid] = profile
+            missing = [uid for uid in missing if uid not in result]
+        
+        if missing and bot is not None:
+            fetched = await self._fetch(bot, missing)
+            if fetched:
+                await self.repo.save_profiles(fetched, ex=self.redis_ttl)
+                now = time.monotonic()
+                for uid, profile in fetched.items():
+                    self._memory_put(uid, profile, now)
+                result.update(fetched)
+        
+        for uid in ids:
+            result.setdefault(uid, None)
+        return result
+    
+    async def _fetch(self, bot: Any, user_ids: list) -> Dict[int, Dict[str, Any]]:
+        """Запрашивает профили через Bot API с ограничением параллелизма"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def fetch_one(uid: int):
+            async with semaphore:
+                try:
+                    chat = await bot.get_chat(uid)
+                    return uid, self._profile_from(chat)
+                except Exception as e:
+                    logger.debug(f"⚠️ Не удалось получить профиль {uid}: {e}")
+                    return uid, None
+        
+        results = await asyncio.gather(*(fetch_one(uid) for uid in user_ids))
+        return {uid: profile for uid, profile in results if profile is not None}
+
+
+_global_cache: Optional[UserProfileCache] = None
+
+
+def get_user_profile_cache() -> UserProfileCache:
+    """Получает глобальный кэш профилей пользователей."""
+    global _global_cache
+    if _global_cache is None:
+        _global_cache = UserProfileCache()
+    return _global_cache
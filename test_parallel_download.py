@@ -62,7 +62,7 @@ async def test_parallel_download():
     
     for query, result in results.items():
         if result:
-            size = len(result["buffer"].getvalue()) / 1024 / 1024
+            size = result["size"] / 1024 / 1024
             print(f"✅ {query}: {result['title'][:50]}... ({size:.2f} MB)")
         else:
             print(f"❌ {query}: Ошибка загрузки")
@@ -104,7 +104,7 @@ async def test_download_queue():
     for query, task_id in task_ids:
         result = await queue.get_result(task_id, timeout=300.0)
         if result:
-            size = len(result["buffer"].getvalue()) / 1024 / 1024
+            size = result["size"] / 1024 / 1024
             print(f"✅ {query}: {result['title'][:50]}... ({size:.2f} MB)")
         else:
             print(f"❌ {query}: Ошибка или таймаут")
@@ -24,20 +24,19 @@ async def test_download(query: str):
         print(f"📝 Название: {result['title']}")
         print(f"🔑 Хеш: {result['hash']}")
         
-        buffer = result['buffer']
-        size = len(buffer.getvalue())
+        size = result['size']
         print(f"📦 Размер файла: {size:,} байт ({size / 1024 / 1024:.2f} MB)")
         
         # Проверяем, что это действительно MP3
-        buffer.seek(0)
-        header = buffer.read(3)
+        with open(result['path'], "rb") as f:
+            header = f.read(3)
         if header == b'ID3' or header == b'\xff\xfb' or header == b'\xff\xf3':
             print("✅ Файл похож на MP3 (проверка заголовка)")
         else:
             print(f"⚠️  Необычный заголовок: {header}")
         
         # Проверяем кэш
-        cache_path = Path("tmp/music_cache") / f"{result['hash']}.mp3"
+        cache_path = Path(result['path'])
         if cache_path.exists():
             cache_size = cache_path.stat().st_size
             print(f"💾 Файл сохранён в кэш: {cache_path} ({cache_size:,} байт)")
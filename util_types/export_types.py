@@ -0,0 +1,14 @@
+from pathlib import Path
+from typing import TypedDict, Optional
+
+class ExportItem(TypedDict):
+    file_hash: str   # канонический хеш файла в аудиокэше
+    arcname: str     # имя файла внутри архива
+    size: int        # размер mp3 в байтах (из индекса кэша)
+
+class ExportPart(TypedDict):
+    name: str                  # имя части в манифесте экспорта
+    path: Path                 # zip-файл части на диске (отправляется через FSInputFile)
+    tracks: int                # количество треков в части
+    file_id: Optional[str]     # file_id ранее отправленной части
+    filename: Optional[str]    # имя, с которым часть была отправлена (file_id хранит его)
@@ -0,0 +1,7 @@
+from typing import TypedDict, Dict, List
+
+class BatchModerationResult(TypedDict):
+    processed: int                   # треков одобрено (добавлено в плейлист) или отклонено
+    duplicates: int                  # одобренных треков, которые уже были в плейлисте
+    skipped: int                     # уже нет в очереди (обработан другим админом)
+    by_user: Dict[int, List[str]]    # user_id -> названия треков (для группового уведомления)
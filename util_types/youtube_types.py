@@ -1,4 +1,5 @@
-from typing import TypedDict, Literal, Any, Callable
+from pathlib import Path
+from typing import TypedDict, Literal, Any, Callable, Optional
 
 class FFmpegExtractAudioPP(TypedDict, total=False):
     key: Literal["FFmpegExtractAudio"]
@@ -12,4 +13,19 @@ class YdlParams(TypedDict, total=False):
     quiet: bool
     outtmpl: str
     postprocessors: list[FFmpegExtractAudioPP]
-    progress_hooks: list[Callable[[dict[str, Any]], None]]
\ No newline at end of file
+    progress_hooks: list[Callable[[dict[str, Any]], None]]
+
+class DownloadResult(TypedDict):
+    title: str
+    path: Path   # mp3 в кэше (CACHE_DIR); содержимое не читается в память
+    size: int    # размер файла в байтах (из индекса кэша)
+    hash: str    # хеш-файл (имя в кэше без расширения)
+
+class SearchCandidate(TypedDict):
+    video_id: str
+    title: str
+    duration: Optional[int]         # длительность в секундах (если известна)
+    estimated_size: Optional[int]   # оценка размера mp3 в байтах (по длительности и битрейту)
+    url: str                        # ссылка на видео (загружается только выбранный кандидат)
+    hash: str                       # file_hash файла этого видео в кэше (blob_hash)
+    cached: bool                    # файл уже есть в кэше (size тогда точный)
@@ -0,0 +1,229 @@
+"""
+Управление аудиокэшем (tmp/music_cache)
+
+Файлы лежат в поддиректориях по первым двум символам хеша
+(tmp/music_cache/ab/ab12....mp3), метаданные всех файлов (название,
+длительность, размер, битрейт, id видео, время создания и доступа) —
+в локальном SQLite-индексе (см. utils/audio_index.py). Проверки
+наличия и размера файлов делаются по индексу, без stat() и JSON.
+
+Кэш ограничен по объему (AUDIO_CACHE_MAX_BYTES) и по возрасту
+(AUDIO_CACHE_MAX_AGE_DAYS): фоновая задача понемногу вытесняет
+самые давно использованные файлы по индексу, без обхода директории.
+
+Файлы, на которые ссылаются треки комнат (audio_cache:refs), не
+вытесняются. Свежие файлы (моложе AUDIO_CACHE_MIN_AGE) тоже не
+трогаются — они могут ждать подтверждения или модерации. Файлы
+отклоненных треков не защищены: вернуть такой трек в плейлист можно,
+только пока файл в кэше (ModerationService.restore_rejected_track).
+Старые файлы (без поддиректорий) переносит и индексирует
+rebuild_audio_cache_index.py.
+
+Хранилище адресуется по содержимому: новые файлы называются по хешу
+id видео (blob_hash), а запрос -> file_hash запоминается в индексе
+запросов, поэтому разные запросы одного видео не качают его повторно.
+Старые file_hash (md5 запроса) продолжают работать; слитые дубликаты
+разрешаются через таблицу алиасов (resolve / resolve_many). Индексы
+запросов, алиасов и ссылок плейлистов общие для всех процессов бота
+и хранятся в Redis (repositories/audio_cache_repository.py).
+"""
+import asyncio
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+from repositories.audio_cache_repository import AudioCacheRepository
+from utils.audio_index import AudioIndex
+
+CACHE_DIR = Path("tmp/music_cache")
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+INDEX_PATH = CACHE_DIR / "index.sqlite3"
+
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES") or 20 * 1024 ** 3)  # 20 ГБ
+AUDIO_CACHE_MAX_AGE = int(os.getenv("AUDIO_CACHE_MAX_AGE_DAYS") or 90) * 24 * 3600
+AUDIO_CACHE_MIN_AGE = 24 * 3600      # не вытесняем файлы, использованные за последние сутки
+EVICTION_BATCH = 50                  # файлов за один шаг вытеснения
+EVICTION_INTERVAL = 300              # секунд между проверками
+
+
+def path_for(file_hash: str) -> Path:
+    """Путь к mp3 в кэше по хешу файла (поддиректория — первые два символа хеша)"""
+    return CACHE_DIR / file_hash[:2] / f"{file_hash}.mp3"
+
+
+def blob_hash(video_id: str, extractor: str = "youtube") -> str:
+    """Хеш файла по id видео (одно видео — один файл при любом запросе)"""
+    return hashlib.md5(f"{extractor}:{video_id}".encode()).hexdigest()
+
+
+def query_key(query: str) -> str:
+    """Ключ запроса в индексе: регистр и лишние пробелы не учитываются"""
+    return hashlib.md5(" ".join(query.lower().split()).encode()).hexdigest()
+
+
+class AudioCacheManager:
+    """Учет доступа к файлам кэша и фоновое вытеснение."""
+
+    def __init__(
+        self,
+        max_bytes: int = AUDIO_CACHE_MAX_BYTES,
+        max_age: int = AUDIO_CACHE_MAX_AGE,
+        min_age: int = AUDIO_CACHE_MIN_AGE,
+        batch: int = EVICTION_BATCH,
+        interval: int = EVICTION_INTERVAL
+    ):
+        self.repo = AudioCacheRepository()
+        self.index = AudioIndex(INDEX_PATH)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self.batch = batch
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        # Алиасы неизменны после создания — кэшируем их в памяти процесса
+        self._aliases: Dict[str, str] = {}
+
+    async def resolve_many(self, file_hashes: List[str]) -> Dict[str, str]:
+        """Канонические хеши файлов: {file_hash: canonical_hash}"""
+        unknown = [h for h in dict.fromkeys(file_hashes) if h and h not in self._aliases]
+        if unknown:
+            for file_hash, alias in zip(unknown, await self.repo.get_aliases(unknown)):
+                self._aliases[file_hash] = alias or file_hash
+            if len(self._aliases) > 100000:
+                self._aliases.clear()
+        return {h: self._aliases.get(h, h) for h in file_hashes if h}
+
+    async def resolve(self, file_hash: str) -> str:
+        """Канонический хеш файла (учитывает алиасы дубликатов)"""
+        return (await self.resolve_many([file_hash])).get(file_hash, file_hash)
+
+    async def lookup_query(self, query: str) -> Optional[str]:
+        """file_hash файла в кэше, ранее загруженного по этому запросу"""
+        file_hash = await self.repo.get_query_hash(query_key(query))
+        if file_hash is None:
+            # Файлы, скачанные до индекса запросов, названы md5 исходного запроса
+            file_hash = hashlib.md5(query.encode()).hexdigest()
+        file_hash = await self.resolve(file_hash)
+        return file_hash if await self.get_entry(file_hash) else None
+
+    async def remember_query(self, query: str, file_hash: str) -> None:
+        """Запоминает, какой файл соответствует запросу"""
+        await self.repo.set_query_hash(query_key(query), file_hash)
+
+    async def lookup_search(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        """Кэшированные кандидаты поиска по запросу"""
+        return await self.repo.get_search(query_key(query))
+
+    async def remember_search(self, query: str, candidates: List[Dict[str, Any]], ttl: int) -> None:
+        """Кэширует кандидатов поиска по запросу (на ttl секунд)"""
+        await self.repo.set_search(query_key(query), candidates, ttl)
+
+    async def get_entry(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Метаданные файла из индекса (None — файла нет в кэше)"""
+        return await asyncio.to_thread(self.index.get, file_hash)
+
+    async def get_entries(self, file_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Метаданные нескольких файлов: {file_hash: запись}"""
+        return await asyncio.to_thread(self.index.get_many, file_hashes)
+
+    async def register(
+        self,
+        file_hash: str,
+        size: int,
+        title: Optional[str] = None,
+        duration: Optional[float] = None,
+        video_id: Optional[str] = None
+    ) -> None:
+        """Добавляет новый файл кэша в индекс."""
+        # Битрейт mp3 после транскодирования — по размеру и длительности
+        bitrate = round(size * 8 / duration / 1000) if duration else None
+        await asyncio.to_thread(
+            self.index.upsert, file_hash, size,
+            title=title, duration=duration, bitrate=bitrate, video_id=video_id
+        )
+
+    async def touch(self, file_hash: str) -> None:
+        """Отмечает использование файла."""
+        await asyncio.to_thread(self.index.touch, file_hash)
+
+    async def remove(self, file_hash: str) -> int:
+        """Удаляет файл из кэша и индекса. Возвращает освобожденный размер"""
+        try:
+            path_for(file_hash).unlink()
+        except FileNotFoundError:
+            pass
+        return await asyncio.to_thread(self.index.delete, file_hash)
+
+    async def evict_step(self) -> int:
+        """
+        Один шаг вытеснения: просматривает не больше batch самых старых файлов.
+
+        Returns:
+            Количество освобожденных байт
+        """
+        total = await asyncio.to_thread(self.index.total_bytes)
+        now = time.time()
+        oldest = await asyncio.to_thread(self.index.oldest, self.batch)
+        if not oldest:
+            return 0
+
+        refs = await self.repo.get_refs([file_hash for file_hash, _ in oldest])
+        freed = 0
+        for (file_hash, accessed_at), ref_count in zip(oldest, refs):
+            age = now - accessed_at
+            if age < self.min_age:
+                break  # дальше только более свежие файлы
+            if total - freed <= self.max_bytes and age < self.max_age:
+                break  # бюджет соблюден, старых файлов нет
+            if ref_count > 0:
+                # Файл в плейлистах — не вытесняем, откладываем в конец очереди
+                await self.touch(file_hash)
+                continue
+            freed += await self.remove(file_hash)
+
+        if freed:
+            print(f"🧹 Аудиокэш: освобождено {freed / 1024 / 1024:.1f} MB")
+        return freed
+
+    async def _run(self):
+        while True:
+            try:
+                # Пока шаги что-то освобождают — продолжаем, иначе ждем
+                while await self.evict_step():
+                    await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"💥 Ошибка вытеснения аудиокэша: {e}")
+            try:
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+
+    def start(self):
+        """Запускает фоновое вытеснение."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновое вытеснение."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+# Глобальный менеджер аудиокэша
+_global_cache: Optional[AudioCacheManager] = None
+
+
+def get_audio_cache() -> AudioCacheManager:
+    """Получает глобальный менеджер аудиокэша."""
+    global _global_cache
+    if _global_cache is None:
+        _global_cache = AudioCacheManager()
+    return _global_cache
@@ -0,0 +1,176 @@
+"""
+Локальный индекс метаданных аудиокэша (SQLite)
+
+Одна таблица files на все файлы кэша: название, длительность, размер,
+битрейт, id видео, время создания и последнего доступа. Поиск файлов,
+проверки размера, вытеснение и обслуживающие скрипты читают индекс
+вместо stat() и JSON-файлов рядом с mp3.
+
+Индекс локальный, как и сам кэш (CACHE_DIR/index.sqlite3). Методы
+синхронные — запросы по первичному ключу занимают доли миллисекунды;
+из event loop их вызывает AudioCacheManager через asyncio.to_thread.
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_hash   TEXT PRIMARY KEY,
+    title       TEXT,
+    duration    REAL,
+    size        INTEGER NOT NULL,
+    bitrate     INTEGER,
+    video_id    TEXT,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_accessed_at ON files (accessed_at);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+"""
+
+# Лимит числа параметров в одном запросе SQLite
+_MAX_VARIABLES = 500
+
+
+class AudioIndex:
+    """Индекс файлов аудиокэша в SQLite."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Соединение открывается при первом запросе (не при импорте):
+        # процессы пула загрузок, созданные fork, индекс не используют
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(
+                str(self.db_path),
+                timeout=30,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            # WAL: бот и обслуживающие скрипты могут работать с индексом одновременно
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            return self._connect().execute(sql, params).rowcount
+
+    def upsert(
+        self,
+        file_hash: str,
+        size: int,
+        title: Optional[str] = None,
+        duration: Optional[float] = None,
+        bitrate: Optional[int] = None,
+        video_id: Optional[str] = None,
+        created_at: Optional[float] = None,
+        accessed_at: Optional[float] = None
+    ) -> None:
+        """Добавляет файл или обновляет его запись (пустые поля не затирают известные)"""
+        now = time.time()
+        self._execute(
+            """
+            INSERT INTO files (file_hash, title, duration, size, bitrate, video_id, created_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (file_hash) DO UPDATE SET
+                title = COALESCE(excluded.title, files.title),
+                duration = COALESCE(excluded.duration, files.duration),
+                size = excluded.size,
+                bitrate = COALESCE(excluded.bitrate, files.bitrate),
+                video_id = COALESCE(excluded.video_id, files.video_id),
+                accessed_at = MAX(excluded.accessed_at, files.accessed_at)
+            """,
+            (file_hash, title, duration, size, bitrate, video_id, created_at or now, accessed_at or now)
+        )
+
+    def get(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Запись файла или None, если файла нет в кэше"""
+        rows = self._query("SELECT * FROM files WHERE file_hash = ?", (file_hash,))
+        return dict(rows[0]) if rows else None
+
+    def get_many(self, file_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Записи нескольких файлов: {file_hash: запись} (отсутствующих в кэше нет в ответе)"""
+        unique = list(dict.fromkeys(h for h in file_hashes if h))
+        entries = {}
+        for i in range(0, len(unique), _MAX_VARIABLES):
+            chunk = unique[i:i + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self._query(f"SELECT * FROM files WHERE file_hash IN ({placeholders})", tuple(chunk)):
+                entries[row["file_hash"]] = dict(row)
+        return entries
+
+    def touch(self, file_hash: str, accessed_at: Optional[float] = None) -> bool:
+        """Обновляет время последнего доступа (только для файлов в индексе)"""
+        return self._execute(
+            "UPDATE files SET accessed_at = ? WHERE file_hash = ?",
+            (accessed_at or time.time(), file_hash)
+        ) > 0
+
+    def delete(self, file_hash: str) -> int:
+        """Удаляет файл из индекса. Возвращает его размер (0 — файла не было)"""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT size FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+            if row is None:
+                return 0
+            conn.execute("DELETE FROM files WHERE file_hash = ?", (file_hash,))
+            return row["size"]
+
+    def total_bytes(self) -> int:
+        """Суммарный размер файлов в индексе"""
+        return self._query("SELECT COALESCE(SUM(size), 0) FROM files")[0][0]
+
+    def count(self) -> int:
+        """Количество файлов в индексе"""
+        return self._query("SELECT COUNT(*) FROM files")[0][0]
+
+    def oldest(self, limit: int) -> List[Tuple[str, float]]:
+        """Самые давно использованные файлы: [(file_hash, accessed_at)]"""
+        rows = self._query(
+            "SELECT file_hash, accessed_at FROM files ORDER BY accessed_at LIMIT ?",
+            (limit,)
+        )
+        return [(row["file_hash"], row["accessed_at"]) for row in rows]
+
+    def larger_than(self, size: int) -> List[Tuple[str, int]]:
+        """Файлы больше size байт: [(file_hash, size)]"""
+        rows = self._query("SELECT file_hash, size FROM files WHERE size > ? ORDER BY size DESC", (size,))
+        return [(row["file_hash"], row["size"]) for row in rows]
+
+    def same_size_groups(self) -> Dict[int, List[str]]:
+        """Группы файлов одинакового размера (кандидаты в дубликаты): {size: [file_hash]}"""
+        rows = self._query(
+            """
+            SELECT size, file_hash FROM files
+            WHERE size IN (SELECT size FROM files GROUP BY size HAVING COUNT(*) > 1)
+            """
+        )
+        groups: Dict[int, List[str]] = {}
+        for row in rows:
+            groups.setdefault(row["size"], []).append(row["file_hash"])
+        return groups
+
+    def all_hashes(self) -> List[str]:
+        """Хеши всех файлов в индексе"""
+        return [row["file_hash"] for row in self._query("SELECT file_hash FROM files")]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,241 @@
+"""
+Фоновые задачи загрузки треков
+
+Хендлер ставит задачу в Redis (DownloadJobRepository) и сразу
+возвращается; загрузкой занимаются воркеры. Задачи переживают
+перезапуск бота:
+- воркер берет задачу в аренду на JOB_LEASE секунд и продлевает ее,
+  пока идет загрузка; задача упавшего процесса возвращается в очередь
+  по истечении аренды (при корректной остановке — сразу);
+- неудачная загрузка повторяется с экспоненциальной задержкой
+  (RETRY_DELAY, 2 * RETRY_DELAY, ...), всего MAX_ATTEMPTS попыток;
+  слишком длинный для лимита Telegram трек не повторяется (error
+  "too_large");
+- одновременные запросы одного видео (один ключ кэша) объединяются
+  в одну задачу с несколькими получателями;
+- задачи берутся по очереди у пользователей (взвешенный round-robin),
+  в пределах лимитов одновременных загрузок пользователя и комнаты и
+  загрузок пользователя в минуту: пользователь, добавивший много треков
+  сразу, не задерживает остальных. Лимиты по умолчанию — ниже, свои
+  для пользователя или комнаты задаются в Redis
+  (DownloadJobRepository.set_user_quota / set_room_quota).
+
+Результат отправляет колбэк deliver (см. handlers/tracks.py) — он
+вызывается для каждого получателя с DownloadResult или None при
+окончательной ошибке. Воркеры в нескольких процессах бота берут
+задачи из общей очереди (взятие — Lua-скрипт).
+"""
+import asyncio
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from repositories.download_job_repository import DownloadJobRepository
+from util_types.youtube_types import DownloadResult, SearchCandidate
+from utils.timezone import iso_now
+from utils.youtube import DOWNLOAD_WORKERS, TrackTooLargeError, choose_bitrate, download_candidate
+
+JOB_LEASE = 120.0           # секунд аренды задачи (продлевается во время загрузки)
+MAX_ATTEMPTS = 3            # попыток загрузки
+RETRY_DELAY = 30.0          # секунд до первого повтора (дальше — вдвое больше)
+POLL_INTERVAL = 2.0         # секунд между проверками очереди без новых задач
+JOB_TTL = 24 * 3600         # секунд хранится завершенная задача
+
+# Справедливая очередь (значения по умолчанию)
+USER_CONCURRENCY = 2        # одновременных загрузок пользователя (во всех процессах)
+USER_RATE = 20              # загрузок пользователя в минуту
+USER_WEIGHT = 1.0           # доля пользователя в очереди
+ROOM_CONCURRENCY = 3        # одновременных загрузок комнаты
+FLOWS_SCAN = 100            # сколько пользователей проверяется при взятии задачи
+
+Delivery = Dict[str, Any]
+DeliverCallback = Callable[[Delivery, Dict[str, Any], Optional[DownloadResult]], Awaitable[None]]
+ProgressCallback = Callable[[Delivery, Dict[str, Any]], Awaitable[None]]
+
+
+class DownloadJobQueue:
+    """Воркеры задач загрузки из очереди в Redis."""
+
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, lease: float = JOB_LEASE):
+        self.workers = workers
+        self.lease = lease
+        self.job_repo = DownloadJobRepository()
+        self._deliver: Optional[DeliverCallback] = None
+        self._progress: Optional[ProgressCallback] = None
+        self._wakeup = asyncio.Event()
+        self._worker_tasks: List[asyncio.Task] = []
+        self.limits = {
+            "user_concurrency": USER_CONCURRENCY,
+            "user_rate": USER_RATE,
+            "weight": USER_WEIGHT,
+            "room_concurrency": ROOM_CONCURRENCY,
+            "scan": FLOWS_SCAN
+        }
+
+    async def submit(self, candidate: SearchCandidate, delivery: Delivery) -> Tuple[str, bool]:
+        """
+        Ставит загрузку кандидата в очередь.
+
+        Args:
+            candidate: Выбранный кандидат поиска
+            delivery: Получатель результата (chat_id, message_id, user_id,
+                room_id и данные для колбэка deliver; сохраняется в JSON).
+                Задача учитывается в лимитах user_id и room_id
+
+        Returns:
+            (job_id, True — создана новая задача, False — получатель
+            добавлен к уже идущей загрузке того же видео)
+        """
+        now = iso_now()
+        job = {
+            "id": secrets.token_hex(8),
+            "cache_key": candidate["hash"],
+            "url": candidate["url"],
+            "title": candidate["title"],
+            "hash": candidate["hash"],
+            "duration": candidate.get("duration"),
+            "user_id": delivery.get("user_id"),
+            "room_id": delivery.get("room_id"),
+            "status": "queued",
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        job_id, created = await self.job_repo.enqueue(job, delivery)
+        self._wakeup.set()
+        return job_id, created
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние задачи (status: queued/running/done/failed, attempts, error)"""
+        return await self.job_repo.get_job(job_id)
+
+    async def queue_position(self, job_id: str) -> Optional[int]:
+        """Примерное место задачи в очереди (None — задача уже загружается или завершена)"""
+        return await self.job_repo.queue_position(job_id, self.limits["weight"])
+
+    async def _heartbeat(self, job_id: str):
+        """Продлевает аренду задачи, пока идет загрузка."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await self.job_repo.renew(job_id, self.lease)
+
+    async def _notify(self, deliveries: List[Delivery], job: Dict[str, Any], result: Optional[DownloadResult]):
+        if self._deliver is None:
+            return
+        for delivery in deliveries:
+            try:
+                await self._deliver(delivery, job, result)
+            except Exception as e:
+                print(f"⚠️ Не удалось доставить результат загрузки {job['id']}: {e}")
+
+    async def _report_progress(self, job: Dict[str, Any]):
+        """Сообщает получателям, что загрузка началась."""
+        if self._progress is None:
+            return
+        for delivery in await self.job_repo.get_deliveries(job["id"]):
+            try:
+                await self._progress(delivery, job)
+            except Exception as e:
+                print(f"⚠️ Не удалось обновить статус загрузки {job['id']}: {e}")
+
+    async def _reject_too_large(self, job: Dict[str, Any]):
+        """Трек не поместится в лимит Telegram ни при каком битрейте — завершение без повторов."""
+        job["status"] = "failed"
+        job["error"] = "too_large"
+        await self._notify(await self.job_repo.finish(job, JOB_TTL), job, None)
+
+    async def _process(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            if choose_bitrate(job.get("duration")) is None:
+                await self._reject_too_large(job)
+                return
+            await self._report_progress(job)
+            try:
+                result = await download_candidate(job)  # type: ignore
+                error = None if result else "трек не найден или не загружен"
+            except TrackTooLargeError:
+                # Длительность кандидата была неизвестна, выяснилась при загрузке
+                await self._reject_too_large(job)
+                return
+            except Exception as e:
+                result, error = None, str(e)
+
+            if result is None:
+                job["attempts"] += 1
+                job["error"] = error
+                if job["attempts"] < MAX_ATTEMPTS:
+                    delay = RETRY_DELAY * 2 ** (job["attempts"] - 1)
+                    print(f"🔁 Загрузка {job['title']} не удалась ({error}), повтор через {delay:.0f}с")
+                    await self.job_repo.retry(job, delay)
+                    return
+                print(f"❌ Загрузка {job['title']} не удалась после {job['attempts']} попыток: {error}")
+                job["status"] = "failed"
+                await self._notify(await self.job_repo.finish(job, JOB_TTL), job, None)
+                return
+
+            job["status"] = "done"
+            job["result"] = {"title": result["title"], "hash": result["hash"], "size": result["size"]}
+            # Получатели забираются по одному: при падении процесса недоставленные
+            # останутся в задаче, и она будет выполнена повторно (файл уже в кэше)
+            while True:
+                delivery = await self.job_repo.pop_delivery(job_id)
+                if delivery is None:
+                    break
+                await self._notify([delivery], job, result)
+            await self._notify(await self.job_repo.finish(job, JOB_TTL), job, result)
+        except asyncio.CancelledError:
+            # Остановка бота: задача сразу возвращается в очередь (не ждет конца аренды)
+            await self.job_repo.release([job])
+            raise
+        finally:
+            heartbeat.cancel()
+            # Освободился слот пользователя и комнаты — задачи, ждавшие лимита, можно брать
+            self._wakeup.set()
+
+    async def _worker(self):
+        """Воркер загрузок."""
+        while True:
+            try:
+                job = await self.job_repo.claim(self.lease, self.limits)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._process(job)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"💥 Ошибка воркера загрузок: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    def start(self, deliver: DeliverCallback, progress: Optional[ProgressCallback] = None):
+        """Запускает воркеры (если еще не запущены)."""
+        self._deliver = deliver
+        self._progress = progress
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        for _ in range(self.workers - len(self._worker_tasks)):
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        """Останавливает воркеры; прерванные загрузки возвращаются в очередь."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+
+# Глобальная очередь задач загрузки
+_global_jobs: Optional[DownloadJobQueue] = None
+
+
+def get_download_jobs() -> DownloadJobQueue:
+    """Получает глобальную очередь задач загрузки."""
+    global _global_jobs
+    if _global_jobs is None:
+        _global_jobs = DownloadJobQueue()
+    return _global_jobs
@@ -0,0 +1,214 @@
+"""
+Фоновая рассылка уведомлений с учетом лимитов Telegram
+
+Хендлеры ставят сообщения в очередь и сразу возвращаются, отправкой
+занимаются воркеры. Ограничения:
+- глобальный token bucket (~30 сообщений/сек на бота);
+- не чаще одного сообщения в секунду в один чат;
+- TelegramRetryAfter приостанавливает всю рассылку на retry_after
+  и возвращает сообщение в очередь;
+- получатели, заблокировавшие бота или удаленные, помечаются
+  в Redis (notify_dead:{chat_id}) и пропускаются до истечения TTL.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import redis, bot as bot_instance
+from utils.redis_helper import redis_safe
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = 25            # сообщений в секунду на бота (лимит Telegram ~30)
+PER_CHAT_INTERVAL = 1.0     # секунд между сообщениями в один чат
+WORKERS = 8                 # параллельных отправок
+MAX_ATTEMPTS = 3            # попыток при сетевых ошибках и RetryAfter
+DEAD_RECIPIENT_TTL = 7 * 24 * 3600  # сколько не писать недоступному получателю
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Ожидает и забирает один токен."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class NotificationFanout:
+    """Очередь уведомлений с воркерами и ограничением скорости."""
+
+    def __init__(
+        self,
+        bot: Any,
+        workers: int = WORKERS,
+        global_rate: float = GLOBAL_RATE,
+        per_chat_interval: float = PER_CHAT_INTERVAL
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.bucket = TokenBucket(global_rate)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._chat_next_at: Dict[int, float] = {}
+        self._paused_until = 0.0
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def _dead_key(self, chat_id: int) -> str:
+        return f"notify_dead:{chat_id}"
+
+    async def _filter_dead(self, chat_ids: List[int]) -> List[int]:
+        """Убирает получателей, помеченных как недоступные."""
+        if not chat_ids:
+            return []
+        flags = await redis_safe(redis.mget([self._dead_key(cid) for cid in chat_ids]))
+        return [cid for cid, flag in zip(chat_ids, flags or []) if not flag]
+
+    async def _mark_dead(self, chat_id: int):
+        await redis_safe(redis.set(self._dead_key(chat_id), "1", ex=DEAD_RECIPIENT_TTL))
+
+    async def enqueue(self, chat_id: int, text: str, **kwargs: Any) -> bool:
+        """Ставит одно сообщение в очередь. kwargs передаются в send_message."""
+        return await self.enqueue_many([chat_id], text, **kwargs) == 1
+
+    async def enqueue_many(
+        self,
+        chat_ids: Iterable[int],
+        text: str,
+        exclude: Optional[int] = None,
+        **kwargs: Any
+    ) -> int:
+        """
+        Ставит сообщение в очередь для нескольких получателей.
+
+        Returns:
+            Количество поставленных в очередь сообщений
+        """
+        self.start()
+        unique_ids = list(dict.fromkeys(cid for cid in chat_ids if cid != exclude))
+
+        recipients = await self._filter_dead(unique_ids)
+        for cid in recipients:
+            self.queue.put_nowait((cid, text, kwargs, 1))
+        return len(recipients)
+
+    async def _wait_for_slot(self, chat_id: int):
+        """Ожидает паузу после RetryAfter, слот чата и глобальный токен."""
+        now = time.monotonic()
+        if self._paused_until > now:
+            await asyncio.sleep(self._paused_until - now)
+
+        # Резервируем слот чата до ожидания, чтобы воркеры не отправили в чат одновременно
+        now = time.monotonic()
+        slot = max(now, self._chat_next_at.get(chat_id, 0.0))
+        self._chat_next_at[chat_id] = slot + self.per_chat_interval
+        if len(self._chat_next_at) > 10000:
+            self._chat_next_at = {cid: t for cid, t in self._chat_next_at.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        await self.bucket.acquire()
+
+    async def _send(self, chat_id: int, text: str, kwargs: Dict[str, Any], attempt: int):
+        await self._wait_for_slot(chat_id)
+        try:
+            await self.bot.send_message(chat_id, text, **kwargs)
+        except TelegramRetryAfter as e:
+            # Флуд-контроль: приостанавливаем рассылку и повторяем позже
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logger.warning(f"⏳ RetryAfter {e.retry_after}с при отправке в {chat_id}")
+            self._retry(chat_id, text, kwargs, attempt)
+        except TelegramForbiddenError as e:
+            logger.info(f"🚫 Получатель {chat_id} недоступен: {e}")
+            await self._mark_dead(chat_id)
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower() or "user not found" in str(e).lower():
+                await self._mark_dead(chat_id)
+            logger.error(f"⚠️ Не удалось отправить уведомление {chat_id}: {e}")
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logger.warning(f"⚠️ Сетевая ошибка при отправке в {chat_id}: {e}")
+            await asyncio.sleep(attempt)  # небольшая пауза перед повтором
+            self._retry(chat_id, text, kwargs, attempt)
+        except Exception as e:
+            logger.error(f"⚠️ Не удалось отправить уведомление {chat_id}: {e}")
+
+    def _retry(self, chat_id: int, text: str, kwargs: Dict[str, Any], attempt: int):
+        if attempt >= MAX_ATTEMPTS:
+            logger.error(f"⚠️ Уведомление для {chat_id} не отправлено после {attempt} попыток")
+            return
+        self.queue.put_nowait((chat_id, text, kwargs, attempt + 1))
+
+    async def _worker(self):
+        """Воркер рассылки."""
+        while True:
+            try:
+                chat_id, text, kwargs, attempt = await self.queue.get()
+            except asyncio.CancelledError:
+                break
+            try:
+                await self._send(chat_id, text, kwargs, attempt)
+            except asyncio.CancelledError:
+                self.queue.task_done()
+                break
+            except Exception as e:
+                print(f"💥 Ошибка воркера рассылки: {e}")
+            self.queue.task_done()
+
+    def start(self):
+        """Запускает воркеры (если еще не запущены)."""
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        for _ in range(self.workers - len(self._worker_tasks)):
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Дожидается отправки очереди (не дольше drain_timeout) и останавливает воркеры."""
+        if self._worker_tasks and not self.queue.empty():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Рассылка остановлена, в очереди осталось {self.queue.qsize()} сообщений")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+
+# Глобальный движок рассылки
+_global_fanout: Optional[NotificationFanout] = None
+
+
+def get_fanout_engine() -> NotificationFanout:
+    """Получает глобальный движок рассылки."""
+    global _global_fanout
+    if _global_fanout is None:
+        _global_fanout = NotificationFanout(bot_instance)
+    return _global_fanout
+
+
+async def stop_fanout_engine():
+    """Останавливает глобальный движок рассылки, если он был запущен."""
+    if _global_fanout is not None:
+        await _global_fanout.stop()
@@ -1,12 +1,39 @@
 """
 Утилиты для работы с ролями и правами в комнате
 """
-from typing import Literal
-from config import redis
+import time
+from typing import Literal, Dict, Optional, Tuple
+from config import redis, ROLE_CACHE_TTL
 from utils.redis_helper import redis_safe
 
 Role = Literal["owner", "admin", "member", "banned"]
 
+# Кэш ролей в памяти процесса: (room_id, user_id) -> (роль, время истечения).
+# Сбрасывается при изменении ролей через set_user_role и RoomRepository;
+# изменения из других процессов видны не позже чем через ROLE_CACHE_TTL.
+_ROLE_CACHE_MAX_SIZE = 10000
+_role_cache: Dict[Tuple[str, int], Tuple[Role, float]] = {}
+
+
+def invalidate_role_cache(room_id: str, user_id: Optional[int] = None) -> None:
+    """Сбрасывает кэш ролей пользователя в комнате (или всей комнаты, если user_id не указан)"""
+    if user_id is not None:
+        _role_cache.pop((room_id, int(user_id)), None)
+        return
+    for key in [k for k in _role_cache if k[0] == room_id]:
+        _role_cache.pop(key, None)
+
+
+def _cache_role(room_id: str, user_id: int, role: Role) -> None:
+    now = time.monotonic()
+    if len(_role_cache) >= _ROLE_CACHE_MAX_SIZE:
+        # Сначала выкидываем истекшие записи, при переполнении — весь кэш
+        for key in [k for k, (_, expires) in _role_cache.items() if expires <= now]:
+            _role_cache.pop(key, None)
+        if len(_role_cache) >= _ROLE_CACHE_MAX_SIZE:
+            _role_cache.clear()
+    _role_cache[(room_id, user_id)] = (role, now + ROLE_CACHE_TTL)
+
 
 async def get_user_role(user_id: int, room_id: str) -> Role:
     """
@@ -15,26 +42,43 @@ async def get_user_role(user_id: int, room_id: str) -> Role:
     Returns:
         "owner", "admin", "member" или "banned"
         Если пользователь не найден ни в одной роли, возвращает "member" (по умолчанию)
+    
+    Результат кэшируется в памяти процесса на ROLE_CACHE_TTL секунд.
     """
+    cached = _role_cache.get((room_id, user_id))
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    role = await _resolve_user_role(user_id, room_id)
+    _cache_role(room_id, user_id, role)
+    return role
+
+
+async def _resolve_user_role(user_id: int, room_id: str) -> Role:
+    """Определяет роль по данным Redis за один round trip (пайплайн из 4 команд)"""
+    user_id_str = str(user_id)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(f"room:{room_id}:owner")
+        pipe.sismember(f"room:{room_id}:banned", user_id_str)
+        pipe.sismember(f"room:{room_id}:admins", user_id_str)
+        pipe.sismember(f"room:{room_id}:members", user_id_str)
+        owner_raw, is_banned, is_admin, is_member = await pipe.execute()
+    
     # Проверяем владельца
-    owner_raw = await redis_safe(redis.get(f"room:{room_id}:owner"))
     if owner_raw:
         owner_id = int(owner_raw.decode() if isinstance(owner_raw, bytes) else owner_raw)
         if owner_id == user_id:
             return "owner"
     
     # Проверяем заблокированных (ВАЖНО: проверяем ПЕРВЫМ после owner)
-    is_banned = await redis_safe(redis.sismember(f"room:{room_id}:banned", str(user_id)))
     if is_banned:
         return "banned"
     
     # Проверяем админов
-    is_admin = await redis_safe(redis.sismember(f"room:{room_id}:admins", str(user_id)))
     if is_admin:
         return "admin"
     
     # Проверяем участников
-    is_member = await redis_safe(redis.sismember(f"room:{room_id}:members", str(user_id)))
     if is_member:
         return "member"
     
@@ -66,28 +110,30 @@ async def set_user_role(user_id: int, room_id: str, role: Role):
     """
     user_id_str = str(user_id)
     
-    # Удаляем из всех ролей
-    await redis_safe(redis.srem(f"room:{room_id}:admins", user_id_str))
-    await redis_safe(redis.srem(f"room:{room_id}:members", user_id_str))
-    await redis_safe(redis.srem(f"room:{room_id}:banned", user_id_str))
-    await redis_safe(redis.srem(f"user:{user_id}:admin_rooms", room_id))
+    async with redis.pipeline(transaction=True) as pipe:
+        # Удаляем из всех ролей
+        pipe.srem(f"room:{room_id}:admins", user_id_str)
+        pipe.srem(f"room:{room_id}:members", user_id_str)
+        pipe.srem(f"room:{room_id}:banned", user_id_str)
+        pipe.srem(f"user:{user_id}:admin_rooms", room_id)
+        
+        # Добавляем в нужную роль
+        if role == "admin":
+            pipe.sadd(f"room:{room_id}:admins", user_id_str)
+            pipe.sadd(f"user:{user_id}:admin_rooms", room_id)
+            pipe.sadd(f"room:{room_id}:members", user_id_str)
+            pipe.sadd(f"user:{user_id}:rooms", room_id)
+        elif role == "member":
+            pipe.sadd(f"room:{room_id}:members", user_id_str)
+            pipe.sadd(f"user:{user_id}:rooms", room_id)
+        elif role == "banned":
+            pipe.sadd(f"room:{room_id}:banned", user_id_str)
+            # Удаляем из комнаты
+            pipe.srem(f"user:{user_id}:rooms", room_id)
+        # owner не меняется через эту функцию
+        await pipe.execute()
     
-    # Добавляем в нужную роль
-    if role == "admin":
-        await redis_safe(redis.sadd(f"room:{room_id}:admins", user_id_str))
-        await redis_safe(redis.sadd(f"user:{user_id}:admin_rooms", room_id))
-        await redis_safe(redis.sadd(f"room:{room_id}:members", user_id_str))
-        await redis_safe(redis.sadd(f"user:{user_id}:rooms", room_id))
-    elif role == "member":
-        await redis_safe(redis.sadd(f"room:{room_id}:members", user_id_str))
-        await redis_safe(redis.sadd(f"user:{user_id}:rooms", room_id))
-    elif role == "banned":
-        await redis_safe(redis.sadd(f"room:{room_id}:banned", user_id_str))
-        # Удаляем из комнаты
-        await redis_safe(redis.srem(f"room:{room_id}:members", user_id_str))
-        await redis_safe(redis.srem(f"user:{user_id}:rooms", room_id))
-        await redis_safe(redis.srem(f"user:{user_id}:admin_rooms", room_id))
-    # owner не меняется через эту функцию
+    invalidate_role_cache(room_id, user_id)
 
 
 async def get_room_admins(room_id: str) -> list[int]:
@@ -0,0 +1,180 @@
+"""
+Режим webhook (RUN_MODE=webhook)
+
+Апдейты принимает встроенный aiohttp-сервер (интеграция aiogram).
+Обработчик сразу отвечает Telegram и кладет апдейт в ограниченную
+очередь, которую разбирают WEBHOOK_WORKERS воркеров — число
+одновременно обрабатываемых апдейтов ограничено. Если очередь полна,
+запрос получает 503 и Telegram повторяет доставку позже.
+
+При остановке (SIGTERM/SIGINT) сервер перестает принимать апдейты,
+воркеры дорабатывают очередь (не дольше DRAIN_TIMEOUT), затем бот
+завершается как обычно. GET /healthz — проверка для балансировщика:
+503, если реплика останавливается или Redis недоступен.
+
+Состояние бота (FSM, комнаты, кэши) хранится в Redis, поэтому
+несколько реплик могут работать за одним балансировщиком.
+"""
+import asyncio
+import logging
+import signal
+from typing import Any, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    redis,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+)
+from utils.redis_helper import redis_safe
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PUT_TIMEOUT = 5.0     # сколько запрос ждет места в очереди до ответа 503
+DRAIN_TIMEOUT = 25.0        # сколько при остановке ждать обработки очереди
+HEALTH_REDIS_TIMEOUT = 1.0  # таймаут проверки Redis в /healthz
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Обработчик webhook с ограниченной очередью и пулом воркеров."""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        secret_token: Optional[str] = None,
+        **data: Any
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker_tasks: List[asyncio.Task] = []
+        self._accepting = True
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if not self._accepting:
+            return web.Response(status=503, text="Shutting down")
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            await asyncio.wait_for(self.queue.put(update), timeout=QUEUE_PUT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Очередь апдейтов переполнена ({self.queue.qsize()}), апдейт отклонен")
+            return web.Response(status=503, text="Queue is full")
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _worker(self):
+        """Воркер обработки апдейтов."""
+        while True:
+            try:
+                update = await self.queue.get()
+            except asyncio.CancelledError:
+                break
+            try:
+                await self._background_feed_update(bot=self.bot, update=update)
+            except asyncio.CancelledError:
+                self.queue.task_done()
+                break
+            except Exception as e:
+                print(f"💥 Ошибка обработки апдейта: {e}")
+            self.queue.task_done()
+
+    def start(self):
+        """Запускает воркеры (если еще не запущены)."""
+        self._accepting = True
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        for _ in range(self.workers - len(self._worker_tasks)):
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def close(self) -> None:
+        """
+        Дожидается обработки очереди (не дольше DRAIN_TIMEOUT) и останавливает воркеры.
+
+        Сессию бота не закрывает — это делает main.py после остальных сервисов.
+        """
+        self._accepting = False
+        if self._worker_tasks and not self.queue.empty():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Webhook остановлен, в очереди осталось {self.queue.qsize()} апдейтов")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        """Проверка состояния реплики для балансировщика."""
+        status = {
+            "accepting": self._accepting,
+            "queue": self.queue.qsize(),
+            "workers": len(self._worker_tasks),
+        }
+        try:
+            await asyncio.wait_for(redis_safe(redis.ping()), timeout=HEALTH_REDIS_TIMEOUT)
+            status["redis"] = True
+        except Exception:
+            status["redis"] = False
+        healthy = status["accepting"] and status["redis"]
+        return web.json_response(status, status=200 if healthy else 503)
+
+
+def build_webhook_app(bot: Bot, dp: Dispatcher) -> Tuple[web.Application, QueuedRequestHandler]:
+    """Приложение aiohttp с обработчиком webhook и /healthz (без регистрации webhook в Telegram)."""
+    app = web.Application()
+    handler = QueuedRequestHandler(dp, bot, secret_token=WEBHOOK_SECRET)
+    # Обработчик регистрируется первым: при остановке очередь дорабатывается до emit_shutdown
+    handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", handler.healthz)
+    setup_application(app, dp, bot=bot)
+
+    async def on_startup(_: web.Application):
+        handler.start()
+
+    app.on_startup.append(on_startup)
+    return app, handler
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Запускает бота в режиме webhook и ждет сигнала остановки."""
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("RUN_MODE=webhook требует WEBHOOK_BASE_URL")
+
+    app, _ = build_webhook_app(bot, dp)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+
+    # Все реплики регистрируют один и тот же адрес балансировщика; при остановке
+    # webhook не удаляется — апдейты продолжают получать остальные реплики
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=min(100, max(1, WEBHOOK_WORKERS))
+    )
+    logger.info(f"🌐 Webhook: слушаем {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows: остановка по KeyboardInterrupt
+
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("🛑 Webhook: остановка, дорабатываем очередь апдейтов")
+        await runner.cleanup()
@@ -1,48 +1,290 @@
 import yt_dlp
-from io import BytesIO
 from pathlib import Path
-import hashlib
 import tempfile
 import asyncio
-import json
+import logging
+import os
 import shutil
-from typing import Any, Optional, Callable, Awaitable, List, Dict
+import uuid
+import heapq
+import itertools
+from collections import OrderedDict
+from typing import Any, Optional, Callable, Awaitable, List, Dict, Tuple
 from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from util_types.youtube_types import DownloadResult, SearchCandidate
+from utils.audio_cache import path_for, blob_hash, query_key, get_audio_cache
+from config import TG_MAX_FILE_BYTES
 
-CACHE_DIR = Path("tmp/music_cache")
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# Решения о битрейте загрузок (size_decision ...) — отдельным логгером для метрик
+metrics_logger = logging.getLogger("metrics.download")
 
-# Семафор для ограничения параллельных загрузок (по умолчанию без ограничений)
-_download_semaphore = asyncio.Semaphore(100)
+# Загрузка и транскодирование (yt-dlp + ffmpeg) выполняются в отдельном пуле
+# процессов, чтобы не конкурировать за GIL с event loop бота.
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS") or 0) or max(1, min(4, os.cpu_count() or 1))
 
+# Back-pressure: в пул передается не больше DOWNLOAD_WORKERS задач,
+# остальные ждут здесь (и могут быть отменены до запуска)
+_download_semaphore = asyncio.Semaphore(DOWNLOAD_WORKERS)
+_executor: Optional[ProcessPoolExecutor] = None
 
-async def download_track(query: str) -> dict | None:
+# Загрузки в процессе: cache_key -> задача. Одновременные запросы одного
+# трека ждут одну задачу вместо запуска нескольких yt-dlp/ffmpeg.
+_inflight: Dict[str, "asyncio.Task[DownloadResult | None]"] = {}
+
+# Поиск без загрузки: метаданные нескольких результатов (extract_flat),
+# пользователь выбирает трек, и загружается только он
+SEARCH_RESULTS = 5                 # кандидатов в выдаче
+SEARCH_CACHE_TTL = 6 * 3600        # секунд хранится выдача по запросу
+MP3_BITRATE = 192                  # кбит/с (preferredquality при транскодировании)
+
+# Битрейт выбирается до загрузки по длительности: наибольший из
+# MP3_BITRATES, при котором mp3 помещается в лимит Telegram. Треки,
+# которые не помещаются и при наименьшем, не загружаются вовсе.
+MP3_BITRATES = (MP3_BITRATE, 160, 128, 96, 64)   # кбит/с, от лучшего к худшему
+SIZE_MARGIN = 0.03                 # запас на ID3-теги и неточность длительности
+
+# Приоритеты очереди загрузок (DownloadQueue): трек, который ждет
+# пользователь, загружается раньше массовых загрузок
+PRIORITY_BULK = 0
+PRIORITY_INTERACTIVE = 10
+RESULT_RETENTION = 1000            # завершенных задач хранится для get_result
+RESULT_TTL = 600.0                 # секунд хранится результат завершенной задачи
+
+
+class TrackTooLargeError(Exception):
+    """Трек не помещается в лимит Telegram ни при каком битрейте (повтор загрузки не поможет)."""
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Пул процессов загрузки (создается при первой загрузке)."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+    return _executor
+
+
+def shutdown_download_pool():
+    """Останавливает пул процессов загрузки (при завершении бота)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def estimate_size(duration: float, bitrate: int) -> int:
+    """Оценка размера mp3 постоянного битрейта (байт) с запасом SIZE_MARGIN."""
+    return int(duration * bitrate * 1000 / 8 * (1 + SIZE_MARGIN))
+
+
+def choose_bitrate(duration: Optional[float], max_bytes: int = TG_MAX_FILE_BYTES) -> Optional[int]:
+    """
+    Наибольший битрейт из MP3_BITRATES, при котором трек длительностью
+    duration помещается в max_bytes; None — не помещается ни при каком.
+    Без длительности — MP3_BITRATE (размер проверяется после загрузки).
+    """
+    if not duration:
+        return MP3_BITRATE
+    for bitrate in MP3_BITRATES:
+        if estimate_size(duration, bitrate) <= max_bytes:
+            return bitrate
+    return None
+
+
+def _run_ydl(query: str, ydl_opts: dict, max_bytes: int = TG_MAX_FILE_BYTES) -> dict:
+    """
+    Загрузка через yt-dlp в процессе пула.
+    
+    Сначала находит видео без загрузки; если файл этого видео уже есть
+    в кэше (скачан по другому запросу), загрузка и транскодирование
+    пропускаются (downloaded=False). Иначе по длительности (или размеру
+    и битрейту исходного формата) выбирается битрейт mp3, чтобы файл
+    поместился в max_bytes; трек, который не поместится, не загружается
+    (rejected=True).
+    
+    Функция верхнего уровня (сериализуется pickle); возвращает только
+    нужные поля info — полный info содержит несериализуемые объекты.
+    """
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:  # type: ignore
+        info = ydl.extract_info(query, download=False)
+        if "entries" in info:
+            info = info["entries"][0]
+        file_hash = blob_hash(info["id"], (info.get("extractor_key") or "youtube").lower())
+        duration = info.get("duration")
+        source_size = info.get("filesize") or info.get("filesize_approx")
+        if not duration and source_size and info.get("abr"):
+            duration = source_size * 8 / (info["abr"] * 1000)
+        result = {
+            "title": info.get("title"),
+            "duration": info.get("duration"),
+            "video_id": info["id"],
+            "hash": file_hash,
+            "downloaded": False,
+            "rejected": False,
+            "source_size": source_size,
+            "bitrate": None,
+            "estimated_size": None,
+        }
+        if path_for(file_hash).exists():
+            return result
+
+        bitrate = choose_bitrate(duration, max_bytes)
+        if bitrate is None:
+            result["rejected"] = True
+            return result
+        result["bitrate"] = bitrate
+        result["estimated_size"] = estimate_size(duration, bitrate) if duration else None
+
+        if bitrate == MP3_BITRATE:
+            ydl.process_ie_result(info, download=True)
+        else:
+            # Пониженный битрейт: исходный формат не лучше, чем нужно для
+            # транскодирования (меньше загрузка), и mp3 с этим битрейтом
+            reduced_opts = {
+                **ydl_opts,
+                "format": f"bestaudio[abr<={bitrate * 2}]/bestaudio/best",
+                "postprocessors": [
+                    {**pp, "preferredquality": str(bitrate)} if pp.get("key") == "FFmpegExtractAudio" else pp
+                    for pp in ydl_opts.get("postprocessors", [])
+                ],
+            }
+            with yt_dlp.YoutubeDL(reduced_opts) as reduced_ydl:  # type: ignore
+                reduced_ydl.process_ie_result(info, download=True)
+        result["downloaded"] = True
+        return result
+
+
+def _log_size_decision(query: str, info: dict):
+    """Пишет в метрики решение о размере загрузки."""
+    if info["rejected"]:
+        decision = "rejected"
+    elif not info["downloaded"]:
+        decision = "cached"
+    elif info["bitrate"] == MP3_BITRATE:
+        decision = "full"
+    else:
+        decision = "reduced"
+    metrics_logger.info(
+        "size_decision decision=%s video_id=%s duration=%s source_size=%s bitrate=%s estimated_size=%s limit=%s query=%r",
+        decision,
+        info["video_id"],
+        info["duration"],
+        info["source_size"],
+        info["bitrate"],
+        info["estimated_size"],
+        TG_MAX_FILE_BYTES,
+        query
+    )
+
+
+def _run_search(query: str, limit: int, ydl_opts: dict) -> List[dict]:
+    """
+    Поиск без загрузки (в потоке): только метаданные первых limit
+    результатов из выдачи, страницы видео не запрашиваются.
+    """
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:  # type: ignore
+        info = ydl.extract_info(f"ytsearch{limit}:{query}", download=False)
+    candidates = []
+    for entry in (info or {}).get("entries") or []:
+        if not entry or not entry.get("id"):
+            continue
+        duration = int(entry["duration"]) if entry.get("duration") else None
+        # Размер при битрейте, который будет выбран при загрузке; если трек не
+        # помещается в лимит ни при каком битрейте — при наименьшем (больше лимита)
+        bitrate = choose_bitrate(duration) or MP3_BITRATES[-1]
+        candidates.append({
+            "video_id": entry["id"],
+            "title": entry.get("title") or entry["id"],
+            "duration": duration,
+            # mp3 постоянного битрейта: размер определяется длительностью
+            "estimated_size": estimate_size(duration, bitrate) if duration else None,
+            "url": f"https://www.youtube.com/watch?v={entry['id']}",
+            "hash": blob_hash(entry["id"], (entry.get("ie_key") or "youtube").lower()),
+        })
+    return candidates
+
+
+async def _run_in_pool(query: str, ydl_opts: dict) -> dict:
+    """Запускает _run_ydl в пуле процессов с ограничением числа задач."""
+    async with _download_semaphore:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(_get_executor(), _run_ydl, query, ydl_opts)
+        except BrokenProcessPool:
+            # Процесс пула упал (например, OOM) — пересоздаем пул и повторяем один раз
+            print(f"⚠️ Пул загрузок пересоздан после сбоя процесса ({query})")
+            shutdown_download_pool()
+            return await loop.run_in_executor(_get_executor(), _run_ydl, query, ydl_opts)
+
+
+def _atomic_move(src: Path, dst: Path):
+    """
+    Перемещает файл в кэш атомарно: сначала во временный файл рядом с dst
+    (та же файловая система), затем os.replace. Частично записанный файл
+    никогда не виден под именем dst.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.part")
+    try:
+        shutil.move(str(src), str(tmp_path))
+        os.replace(tmp_path, dst)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+async def _cached_result(file_hash: str, default_title: str) -> DownloadResult | None:
+    """Результат по записи индекса кэша: путь и размер без stat() и чтения файла."""
+    entry = await get_audio_cache().get_entry(file_hash)
+    if entry is None:
+        return None
+    return {
+        "title": entry.get("title") or default_title,
+        "path": path_for(file_hash),
+        "size": entry["size"],
+        "hash": file_hash,
+    }
+
+
+async def download_track(query: str) -> DownloadResult | None:
     """
     Возвращает словарь с ключами:
     {
         "title": str,     # Название трека
-        "buffer": BytesIO,
+        "path": Path,     # mp3 в кэше (для отправки через FSInputFile)
+        "size": int,      # Размер файла в байтах
         "hash": str       # Хеш-файл
     }
+    
+    Одновременные вызовы с одним запросом используют одну загрузку,
+    а разные запросы одного видео — один файл в кэше.
+    
+    Raises:
+        TrackTooLargeError: трек слишком длинный для лимита Telegram
     """
-    cache_key = hashlib.md5(query.encode()).hexdigest()
-    cached_path = CACHE_DIR / f"{cache_key}.mp3"
-    meta_path = CACHE_DIR / f"{cache_key}.json"
-
-    # ⚡ Если есть в кэше — возвращаем из него
-    if cached_path.exists():
-        title = query  # по дефолту возвращаем то, что ввёл пользователь
-        if meta_path.exists():
-            try:
-                with open(meta_path, "r", encoding="utf-8") as f:
-                    meta = json.load(f)
-                    title = meta.get("title", title)
-            except Exception:
-                pass
-        with open(cached_path, "rb") as f:
-            buf = BytesIO(f.read())
-        buf.seek(0)
-        return {"title": title, "buffer": buf, "hash": cache_key}
+    cache_key = query_key(query)
+    
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_download_track(query, cache_key))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+    
+    # shield: отмена одного ожидающего не отменяет загрузку для остальных
+    return await asyncio.shield(task)
+
+
+async def _download_track(query: str, cache_key: str) -> DownloadResult | None:
+    """Возвращает трек из кэша или загружает его (вызывается только через download_track)."""
+    audio_cache = get_audio_cache()
+
+    # ⚡ Если запрос уже загружался — возвращаем файл из кэша
+    file_hash = await audio_cache.lookup_query(query)
+    if file_hash:
+        await audio_cache.touch(file_hash)
+        # по дефолту возвращаем то, что ввёл пользователь
+        return await _cached_result(file_hash, query)
 
     # ⏳ если нет — качаем
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -58,7 +300,7 @@ async def download_track(query: str) -> dict | None:
             "postprocessors": [{
                 "key": "FFmpegExtractAudio",
                 "preferredcodec": "mp3",
-                "preferredquality": "192",
+                "preferredquality": str(MP3_BITRATE),
             }],
             # Обход 403: android-клиент часто обходит блокировки YouTube
             "extractor_args": {
@@ -73,44 +315,118 @@ async def download_track(query: str) -> dict | None:
         if cookies_path.exists():
             ydl_opts["cookies"] = str(cookies_path)
 
-        def run_ydl():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:  # type: ignore
-                info = ydl.extract_info(query, download=True)
-                if "entries" in info:
-                    info = info["entries"][0]
-                return info
-
         try:
-            info = await asyncio.to_thread(run_ydl)
+            info = await _run_in_pool(query, ydl_opts)
         except Exception as e:
             print(f"💥 Ошибка при загрузке {query}: {e}")
             return None
 
-        mp3_files = list(Path(tmpdir).glob("*.mp3"))
-        if not mp3_files:
-            print(f"❌ yt_dlp не создал mp3 для {query}")
-            return None
+        _log_size_decision(query, info)
+        if info["rejected"]:
+            print(f"🚫 {query}: трек длиннее, чем помещается в лимит Telegram ({info['duration']} с), не загружаем")
+            raise TrackTooLargeError(f"{query}: {info['duration']} с")
 
-        title = info.get("title", query)
-        mp3_path = mp3_files[0]
-        
-        # Перемещаем файл в кэш
-        shutil.move(str(mp3_path), str(cached_path))
+        title = info.get("title") or query
+        file_hash = info["hash"]
+        cached_path = path_for(file_hash)
+
+        if info["downloaded"]:
+            mp3_files = list(Path(tmpdir).glob("*.mp3"))
+            if not mp3_files:
+                print(f"❌ yt_dlp не создал mp3 для {query}")
+                return None
 
-        # 💾 сохраняем мета-файл
-        with open(meta_path, "w", encoding="utf-8") as f:
-            json.dump({"title": title}, f, ensure_ascii=False)
+            # 💾 атомарно перемещаем mp3 в кэш (mp3 в кэше означает, что файл
+            # записан полностью), затем записываем метаданные в индекс
+            _atomic_move(mp3_files[0], cached_path)
+            await audio_cache.register(
+                file_hash,
+                cached_path.stat().st_size,
+                title=title,
+                duration=info.get("duration"),
+                video_id=info.get("video_id")
+            )
+        else:
+            print(f"♻️ {query}: видео уже в кэше ({file_hash}), загрузка пропущена")
+            if not await audio_cache.get_entry(file_hash) and cached_path.exists():
+                # Файл есть на диске, но не в индексе (индекс удален) — индексируем
+                await audio_cache.register(
+                    file_hash,
+                    cached_path.stat().st_size,
+                    title=title,
+                    duration=info.get("duration"),
+                    video_id=info.get("video_id")
+                )
 
-    # Читаем файл из кэша
-    if not cached_path.exists():
-        print(f"❌ Файл не найден в кэше: {cached_path}")
+    result = await _cached_result(file_hash, title)
+    if result is None:
+        print(f"❌ Файл не найден в индексе кэша: {cached_path}")
         return None
-        
-    with open(cached_path, "rb") as f:
-        buf = BytesIO(f.read())
-    buf.seek(0)
 
-    return {"title": title, "buffer": buf, "hash": cache_key}
+    await audio_cache.remember_query(query, file_hash)
+    await audio_cache.touch(file_hash)
+    return result
+
+
+async def search_candidates(query: str, limit: int = SEARCH_RESULTS) -> List[SearchCandidate]:
+    """
+    Кандидаты по запросу без загрузки (название, длительность, оценка
+    размера, id видео). Выдача кэшируется в Redis по нормализованному
+    запросу на SEARCH_CACHE_TTL; флаг cached и точный размер берутся
+    из индекса аудиокэша при каждом вызове.
+    """
+    audio_cache = get_audio_cache()
+    candidates = await audio_cache.lookup_search(query)
+    if candidates is None:
+        ydl_opts = {
+            "quiet": True,
+            "skip_download": True,
+            "extract_flat": "in_playlist",
+            "extractor_args": {
+                "youtube": {
+                    "player_client": ["android", "web"],
+                },
+            },
+        }
+        cookies_path = Path("cookies.txt")
+        if cookies_path.exists():
+            ydl_opts["cookies"] = str(cookies_path)
+
+        try:
+            candidates = await asyncio.to_thread(_run_search, query, limit, ydl_opts)
+        except Exception as e:
+            print(f"💥 Ошибка поиска {query}: {e}")
+            return []
+        if candidates:
+            await audio_cache.remember_search(query, candidates, SEARCH_CACHE_TTL)
+
+    entries = await audio_cache.get_entries([c["hash"] for c in candidates])
+    result: List[SearchCandidate] = []
+    for c in candidates[:limit]:
+        entry = entries.get(c["hash"])
+        result.append({
+            **c,
+            "estimated_size": entry["size"] if entry else c.get("estimated_size"),
+            "cached": entry is not None,
+        })
+    return result
+
+
+async def download_candidate(candidate: SearchCandidate) -> DownloadResult | None:
+    """
+    Загружает выбранного кандидата поиска (или возвращает файл из кэша).
+
+    Одновременные загрузки одного видео объединяются download_track;
+    в очереди загрузок трек идет раньше массовых загрузок.
+
+    Raises:
+        TrackTooLargeError: трек слишком длинный для лимита Telegram
+            (у кандидата не было длительности, выяснилось при загрузке)
+    """
+    if await get_audio_cache().get_entry(candidate["hash"]):
+        await get_audio_cache().touch(candidate["hash"])
+        return await _cached_result(candidate["hash"], candidate["title"])
+    return await get_download_queue().run(candidate["url"], PRIORITY_INTERACTIVE)
 
 
 async def download_tracks_parallel(
@@ -143,9 +459,7 @@ async def download_tracks_parallel(
                 await progress_callback(query, "started", completed, total)
             
             # Проверяем кэш перед загрузкой
-            cache_key = hashlib.md5(query.encode()).hexdigest()
-            cached_path = CACHE_DIR / f"{cache_key}.mp3"
-            if cached_path.exists():
+            if await get_audio_cache().lookup_query(query):
                 result = await download_track(query)
                 results[query] = result
                 completed += 1
@@ -153,9 +467,9 @@ async def download_tracks_parallel(
                     await progress_callback(query, "cached", completed, total)
                 return result
             
-            # Загружаем
+            # Загружаем через очередь (с низким приоритетом, чтобы не задерживать пользователей)
             try:
-                result = await download_track(query)
+                result = await get_download_queue().run(query, PRIORITY_BULK)
                 results[query] = result
                 completed += 1
                 if progress_callback:
@@ -177,86 +491,211 @@ async def download_tracks_parallel(
     return results
 
 
+class DownloadTask:
+    """Задача очереди загрузок."""
+
+    def __init__(self, task_id: str, query: str, priority: int):
+        self.task_id = task_id
+        self.query = query
+        self.priority = priority
+        # Результат для get_result (DownloadResult | None); отменяется при cancel
+        self.future: "asyncio.Future[DownloadResult | None]" = asyncio.get_running_loop().create_future()
+        self.runner: Optional[asyncio.Task] = None
+
+
 class DownloadQueue:
-    """Очередь загрузок с управлением приоритетами и ограничением параллелизма."""
-    
-    def __init__(self, max_concurrent: int = 100):
+    """
+    Планировщик загрузок с приоритетами.
+
+    Задачи берутся из кучи по приоритету (при равном — в порядке
+    добавления) max_concurrent воркерами. Одинаковые запросы, ожидающие
+    в очереди или загружающиеся, объединяются в одну задачу (приоритет
+    повышается до большего). Результаты доставляются через future,
+    завершенные задачи хранятся ограниченное время и в ограниченном
+    количестве.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = DOWNLOAD_WORKERS,
+        max_results: int = RESULT_RETENTION,
+        result_ttl: float = RESULT_TTL
+    ):
         self.max_concurrent = max_concurrent
-        self.semaphore = asyncio.Semaphore(max_concurrent)
-        self.queue: asyncio.Queue = asyncio.Queue()
-        self.active_downloads: Dict[str, asyncio.Task] = {}
-        self.results: Dict[str, dict | None] = {}
-        self._worker_task: Optional[asyncio.Task] = None
-    
-    async def add(self, query: str, priority: int = 0) -> str:
+        self.max_results = max_results
+        self.result_ttl = result_ttl
+        # (-priority, порядковый номер, task_id); записи устаревших приоритетов
+        # и отмененных задач пропускаются при извлечении
+        self._heap: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._tasks: Dict[str, DownloadTask] = {}
+        self._by_query: Dict[str, str] = {}           # query_key -> task_id незавершенной задачи
+        self._finished: "OrderedDict[str, float]" = OrderedDict()  # task_id -> время завершения
+        self._ready = asyncio.Event()
+        self._worker_tasks: List[asyncio.Task] = []
+
+    async def add(self, query: str, priority: int = PRIORITY_BULK) -> str:
         """
         Добавляет запрос в очередь.
         
         Args:
             query: Запрос для загрузки
-            priority: Приоритет (больше = выше приоритет)
+            priority: Приоритет (больше = выше приоритет): PRIORITY_INTERACTIVE
+                для трека, который ждет пользователь, PRIORITY_BULK — массовые загрузки
         
         Returns:
             ID задачи для отслеживания
         """
-        task_id = hashlib.md5(query.encode()).hexdigest()[:8]
-        await self.queue.put((priority, task_id, query))
+        self.start()
+        key = query_key(query)
+        task_id = self._by_query.get(key)
+        if task_id is not None:
+            task = self._tasks[task_id]
+            if priority > task.priority and task.runner is None:
+                task.priority = priority
+                heapq.heappush(self._heap, (-priority, next(self._seq), task_id))
+            return task_id
+
+        task_id = uuid.uuid4().hex[:12]
+        self._tasks[task_id] = DownloadTask(task_id, query, priority)
+        self._by_query[key] = task_id
+        heapq.heappush(self._heap, (-priority, next(self._seq), task_id))
+        self._ready.set()
         return task_id
     
-    async def get_result(self, task_id: str, timeout: float = 300.0) -> dict | None:
+    async def get_result(self, task_id: str, timeout: Optional[float] = 300.0) -> DownloadResult | None:
         """
         Ожидает результат загрузки.
         
         Args:
             task_id: ID задачи
-            timeout: Таймаут ожидания в секундах
+            timeout: Таймаут ожидания в секундах (None — без таймаута)
         
         Returns:
-            Результат загрузки или None
+            Результат загрузки или None (ошибка, таймаут, задача отменена
+            или ее результат уже не хранится)
+        
+        Raises:
+            TrackTooLargeError: трек слишком длинный для лимита Telegram
         """
-        start_time = asyncio.get_event_loop().time()
-        while True:
-            if task_id in self.results:
-                return self.results.pop(task_id)
-            
-            if asyncio.get_event_loop().time() - start_time > timeout:
+        task = self._tasks.get(task_id)
+        if task is None:
+            return None
+        try:
+            # shield: таймаут или отмена ожидающего не отменяет саму задачу
+            return await asyncio.wait_for(asyncio.shield(task.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except asyncio.CancelledError:
+            if task.future.cancelled():
                 return None
-            
-            await asyncio.sleep(0.5)
-    
+            raise
+
+    async def run(self, query: str, priority: int = PRIORITY_BULK) -> DownloadResult | None:
+        """Ставит запрос в очередь и ожидает результат."""
+        return await self.get_result(await self.add(query, priority), timeout=None)
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Отменяет задачу: ожидающая удаляется из очереди, у загружающейся
+        освобождается слот воркера (сама загрузка доводится до конца
+        в фоне — ее могут ждать другие вызовы download_track).
+
+        Returns:
+            True, если задача была отменена
+        """
+        task = self._tasks.get(task_id)
+        if task is None or task.future.done():
+            return False
+        if task.runner is not None:
+            task.runner.cancel()
+        else:
+            task.future.cancel()
+            self._mark_finished(task)
+        return True
+
+    def pending_count(self) -> int:
+        """Количество задач, ожидающих воркера."""
+        return sum(1 for t in self._tasks.values() if t.runner is None and not t.future.done())
+
+    def _next_task(self) -> Optional[DownloadTask]:
+        """Извлекает задачу с наибольшим приоритетом."""
+        while self._heap:
+            neg_priority, _, task_id = heapq.heappop(self._heap)
+            task = self._tasks.get(task_id)
+            if task is None or task.runner is not None or task.future.done():
+                continue
+            if -neg_priority != task.priority:
+                continue  # устаревшая запись: приоритет задачи был повышен
+            return task
+        return None
+
+    def _mark_finished(self, task: DownloadTask):
+        """Снимает объединение запросов и ограничивает хранение завершенных задач."""
+        key = query_key(task.query)
+        if self._by_query.get(key) == task.task_id:
+            del self._by_query[key]
+        now = asyncio.get_running_loop().time()
+        self._finished[task.task_id] = now
+        while self._finished:
+            oldest_id, finished_at = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_results and now - finished_at <= self.result_ttl:
+                break
+            del self._finished[oldest_id]
+            self._tasks.pop(oldest_id, None)
+
+    def _complete(self, task: DownloadTask):
+        """Переносит результат загрузки в future задачи."""
+        runner = task.runner
+        if runner.cancelled():  # type: ignore
+            task.future.cancel()
+        elif isinstance(runner.exception(), TrackTooLargeError):  # type: ignore
+            # Не ошибка загрузки: вызывающий должен отличить ее от None
+            task.future.set_exception(runner.exception())  # type: ignore
+        elif runner.exception() is not None:  # type: ignore
+            print(f"💥 Ошибка в очереди загрузок {task.query}: {runner.exception()}")  # type: ignore
+            task.future.set_result(None)
+        else:
+            task.future.set_result(runner.result())  # type: ignore
+        self._mark_finished(task)
+
     async def _worker(self):
-        """Воркер для обработки очереди."""
+        """Воркер очереди: загружает задачи по приоритету."""
         while True:
             try:
-                priority, task_id, query = await self.queue.get()
-                
-                async with self.semaphore:
-                    try:
-                        result = await download_track(query)
-                        self.results[task_id] = result
-                    except Exception as e:
-                        print(f"💥 Ошибка в очереди загрузок {query}: {e}")
-                        self.results[task_id] = None
-                
-                self.queue.task_done()
+                task = self._next_task()
+                if task is None:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                task.runner = asyncio.create_task(download_track(task.query))
+                # wait не пробрасывает исключение и отмену загрузки в воркер
+                await asyncio.wait({task.runner})
+                self._complete(task)
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 print(f"💥 Ошибка воркера очереди: {e}")
     
     def start(self):
-        """Запускает воркер очереди."""
-        if self._worker_task is None or self._worker_task.done():
-            self._worker_task = asyncio.create_task(self._worker())
+        """Запускает воркеры очереди (если еще не запущены)."""
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        for _ in range(self.max_concurrent - len(self._worker_tasks)):
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
     
     async def stop(self):
-        """Останавливает воркер очереди."""
-        if self._worker_task:
-            self._worker_task.cancel()
-            try:
-                await self._worker_task
-            except asyncio.CancelledError:
-                pass
+        """Останавливает воркеры; незавершенные задачи отменяются."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        for task in list(self._tasks.values()):
+            if task.runner is not None:
+                task.runner.cancel()
+            if not task.future.done():
+                task.future.cancel()
+        self._heap.clear()
+        self._by_query.clear()
 
 
 # Глобальная очередь загрузок
@@ -267,7 +706,12 @@ def get_download_queue() -> DownloadQueue:
     """Получает глобальную очередь загрузок."""
     global _global_queue
     if _global_queue is None:
-        _global_queue = DownloadQueue(max_concurrent=100)
+        _global_queue = DownloadQueue()
         _global_queue.start()
     return _global_queue
 
+
+async def stop_download_queue():
+    """Останавливает глобальную очередь загрузок, если она была запущена."""
+    if _global_queue is not None:
+        await _global_queue.stop()